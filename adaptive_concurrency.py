@@ -0,0 +1,321 @@
+"""Concorrenza adattiva (AIMD) e circuit breaker per le chiamate a Xotelo.
+
+Un numero fisso di chiamate contemporanee è troppo prudente nelle ore
+tranquille e provoca rallentamenti (429) in quelle di punta. `AIMDLimiter`
+regola invece una finestra di chiamate contemporanee come il controllo di
+congestione TCP:
+
+- aumento additivo (circa +1 per finestra di risposte) finché il p95 della
+  latenza e il tasso di errore delle ultime chiamate restano nei limiti e la
+  finestra è effettivamente utilizzata;
+- riduzione moltiplicativa (×0.5) a ogni 429, 5xx o timeout, una sola volta
+  per ondata: le chiamate partite prima dell'ultima riduzione non la ripetono.
+
+`CircuitBreaker` smette di chiamare un endpoint che fallisce in modo
+persistente: se almeno `failure_threshold` delle ultime `BREAKER_WINDOW`
+chiamate sono fallite il circuito si apre e le chiamate vengono rifiutate subito; trascorso
+`reset_timeout` passa una sola chiamata di prova che lo richiude (o lo
+riapre). Ogni chiamata ammessa riceve un biglietto: solo l'esito della
+prova decide lo stato in prova, e gli esiti delle chiamate partite prima
+dell'ultima apertura vengono ignorati. Un'ondata di 429 dovuta a una finestra troppo larga non basta ad
+aprirlo: è già gestita dalla riduzione della finestra.
+
+`AdaptiveGate` combina una finestra condivisa dal client con un breaker per
+endpoint; i client Xotelo eseguono ogni chiamata effettiva attraverso il
+proprio gate. `call_async` è la variante per l'event loop: l'attesa di un
+posto nella finestra avviene in un thread dell'executor, senza bloccare il loop.
+"""
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+
+DEFAULT_INITIAL_LIMIT = 4
+DEFAULT_MIN_LIMIT = 1
+DEFAULT_MAX_LIMIT = 16
+DEFAULT_DECREASE_FACTOR = 0.5
+# Condizioni per allargare la finestra, sulle ultime DEFAULT_SAMPLE_WINDOW chiamate
+DEFAULT_LATENCY_TARGET_SECONDS = 5.0
+DEFAULT_ERROR_RATE_THRESHOLD = 0.05
+DEFAULT_SAMPLE_WINDOW = 100
+MIN_SAMPLES = 10
+
+# Il circuito si apre con almeno DEFAULT_FAILURE_THRESHOLD fallimenti nelle ultime BREAKER_WINDOW
+# chiamate all'endpoint; la soglia supera la finestra massima, quindi le chiamate di una sola
+# ondata respinta (già in corso quando la finestra si riduce) non bastano
+BREAKER_WINDOW = 40
+DEFAULT_FAILURE_THRESHOLD = 20
+DEFAULT_RESET_TIMEOUT_SECONDS = 30
+
+# Esiti di una chiamata: la congestione riduce la finestra, i fallimenti contano per il breaker
+CONGESTION_OUTCOMES = {"throttled", "server_error", "timeout"}
+FAILURE_OUTCOMES = CONGESTION_OUTCOMES | {"network_error"}
+
+BREAKER_STATE_LABELS = {
+    "closed": "chiuso",
+    "open": "aperto",
+    "half_open": "in prova"
+}
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+def classify_status(status_code):
+    """Esito di una risposta HTTP"""
+    if status_code == 429:
+        return "throttled"
+    if status_code >= 500:
+        return "server_error"
+    if status_code >= 400:
+        return "client_error"
+    return "ok"
+
+
+def classify_exception(error):
+    """Esito di un'eccezione di rete (requests.Timeout, httpx.TimeoutException, asyncio.TimeoutError)"""
+    return "timeout" if "timeout" in type(error).__name__.lower() else "network_error"
+
+
+class AIMDLimiter:
+    def __init__(self, initial_limit=DEFAULT_INITIAL_LIMIT, min_limit=DEFAULT_MIN_LIMIT, max_limit=DEFAULT_MAX_LIMIT,
+                 decrease_factor=DEFAULT_DECREASE_FACTOR, latency_target=DEFAULT_LATENCY_TARGET_SECONDS,
+                 error_rate_threshold=DEFAULT_ERROR_RATE_THRESHOLD, sample_window=DEFAULT_SAMPLE_WINDOW):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.latency_target = latency_target
+        self.error_rate_threshold = error_rate_threshold
+        self.limit = float(min(max(initial_limit, min_limit), max_limit))
+        self.inflight = 0
+        self._cond = threading.Condition()
+        self._samples = deque(maxlen=sample_window)  # (latenza, esito)
+        self._last_decrease = 0.0
+        self.stats = {"calls": 0, "increases": 0, "decreases": 0}
+
+    def acquire(self):
+        """Attende un posto nella finestra; restituisce l'istante di inizio della chiamata"""
+        with self._cond:
+            while self.inflight >= int(self.limit):
+                self._cond.wait()
+            self.inflight += 1
+            return time.monotonic()
+
+    def free_slots(self):
+        """Posti liberi nella finestra in questo momento"""
+        with self._cond:
+            return int(self.limit) - self.inflight
+
+    def release(self, started, outcome):
+        now = time.monotonic()
+        with self._cond:
+            saturated = self.inflight >= int(self.limit)
+            self.inflight -= 1
+            self._samples.append((now - started, outcome))
+            self.stats["calls"] += 1
+
+            if outcome in CONGESTION_OUTCOMES:
+                if started >= self._last_decrease:
+                    self.limit = max(float(self.min_limit), self.limit * self.decrease_factor)
+                    self._last_decrease = now
+                    self.stats["decreases"] += 1
+            elif outcome == "ok" and saturated and self.limit < self.max_limit and self._healthy():
+                previous = int(self.limit)
+                self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+                if int(self.limit) > previous:
+                    self.stats["increases"] += 1
+
+            self._cond.notify_all()
+
+    def _p95(self):
+        latencies = sorted(latency for latency, _ in self._samples)
+        return latencies[math.ceil(0.95 * len(latencies)) - 1] if latencies else None
+
+    def _error_rate(self):
+        if not self._samples:
+            return None
+        return sum(outcome in FAILURE_OUTCOMES for _, outcome in self._samples) / len(self._samples)
+
+    def _healthy(self):
+        return (
+            len(self._samples) >= MIN_SAMPLES
+            and self._p95() <= self.latency_target
+            and self._error_rate() <= self.error_rate_threshold
+        )
+
+    def snapshot(self):
+        with self._cond:
+            return {
+                "limit": int(self.limit),
+                "inflight": self.inflight,
+                "p95_seconds": self._p95(),
+                "error_rate": self._error_rate(),
+                "samples": len(self._samples),
+                **self.stats
+            }
+
+
+class CircuitBreaker:
+    """Stato del circuito di un endpoint (non thread-safe: protetto dal gate)"""
+
+    def __init__(self, failure_threshold=DEFAULT_FAILURE_THRESHOLD, reset_timeout=DEFAULT_RESET_TIMEOUT_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._recent = deque(maxlen=BREAKER_WINDOW)  # True = chiamata fallita
+        self.opened_at = None
+        self._probing = False
+        # Aperture del circuito: i biglietti di un'apertura precedente non contano più
+        self._generation = 0
+        self.stats = {"opened": 0, "rejected": 0}
+
+    def allow(self):
+        """Biglietto (apertura, prova) della chiamata, o None se il circuito la rifiuta"""
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                self.stats["rejected"] += 1
+                return None
+            self.state = "half_open"
+            self._probing = False
+        if self.state == "half_open":
+            # Una sola chiamata di prova alla volta
+            if self._probing:
+                self.stats["rejected"] += 1
+                return None
+            self._probing = True
+            return (self._generation, True)
+        return (self._generation, False)
+
+    @property
+    def failures(self):
+        return sum(self._recent)
+
+    def record(self, outcome, ticket):
+        generation, probe = ticket
+        if generation != self._generation:
+            # Chiamata partita prima dell'ultima apertura del circuito
+            return
+        failed = outcome in FAILURE_OUTCOMES
+        if self.state == "half_open":
+            if not probe:
+                return
+            # Esito della chiamata di prova: si riparte da zero in entrambi i casi
+            self._probing = False
+            self._recent.clear()
+            if failed:
+                self._open()
+            else:
+                self.state = "closed"
+            return
+        if self.state == "open":
+            return
+
+        self._recent.append(failed)
+        if self.failures >= self.failure_threshold:
+            self._recent.clear()
+            self._open()
+
+    def _open(self):
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        self._generation += 1
+        self.stats["opened"] += 1
+
+    def retry_in(self):
+        """Secondi alla prossima chiamata di prova (0 se il circuito non è aperto)"""
+        if self.state != "open":
+            return 0.0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+
+class AdaptiveGate:
+    """Finestra AIMD condivisa e un circuit breaker per endpoint"""
+
+    def __init__(self, limiter=None, failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+                 reset_timeout=DEFAULT_RESET_TIMEOUT_SECONDS):
+        self.limiter = limiter or AIMDLimiter()
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._breakers = {}
+
+    def _admit(self, endpoint):
+        """Breaker dell'endpoint e biglietto della chiamata; CircuitOpenError se il circuito è aperto"""
+        with self._lock:
+            breaker = self._breakers.get(endpoint)
+            if breaker is None:
+                breaker = self._breakers[endpoint] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            ticket = breaker.allow()
+            retry_in = breaker.retry_in()
+        if ticket is None:
+            raise CircuitOpenError(
+                f"Circuito aperto per l'endpoint {endpoint}: troppe chiamate fallite, "
+                f"nuovo tentativo tra {retry_in:.0f} s"
+            )
+        return breaker, ticket
+
+    def _finish(self, breaker, ticket, started, outcome):
+        self.limiter.release(started, outcome)
+        with self._lock:
+            breaker.record(outcome, ticket)
+
+    def call(self, endpoint, fetch):
+        """Esegue `fetch()` (che restituisce una risposta HTTP con `status_code`) nella finestra.
+
+        Solleva CircuitOpenError senza chiamare se il circuito dell'endpoint è
+        aperto; le eccezioni di `fetch` vengono registrate e rilanciate.
+        """
+        breaker, ticket = self._admit(endpoint)
+        started = self.limiter.acquire()
+        outcome = "network_error"
+        try:
+            response = fetch()
+            outcome = classify_status(response.status_code)
+            return response
+        except Exception as e:
+            outcome = classify_exception(e)
+            raise
+        finally:
+            self._finish(breaker, ticket, started, outcome)
+
+    async def call_async(self, endpoint, fetch):
+        """Come `call`, ma `fetch()` restituisce una coroutine ed è attesa nell'event loop"""
+        breaker, ticket = self._admit(endpoint)
+        acquired = asyncio.get_running_loop().run_in_executor(None, self.limiter.acquire)
+        try:
+            started = await asyncio.shield(acquired)
+        except asyncio.CancelledError:
+            # Il posto arriverà comunque al thread in attesa: va restituito appena ottenuto
+            acquired.add_done_callback(lambda future: self._finish(breaker, ticket, future.result(), "cancelled"))
+            raise
+
+        outcome = "network_error"
+        try:
+            response = await fetch()
+            outcome = classify_status(response.status_code)
+            return response
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        except Exception as e:
+            outcome = classify_exception(e)
+            raise
+        finally:
+            self._finish(breaker, ticket, started, outcome)
+
+    def snapshot(self):
+        """Finestra corrente e stato dei breaker, per il pannello di debug"""
+        with self._lock:
+            breakers = [
+                {
+                    "endpoint": endpoint,
+                    "state": breaker.state,
+                    "failures": breaker.failures,
+                    "retry_in": breaker.retry_in(),
+                    **breaker.stats
+                }
+                for endpoint, breaker in sorted(self._breakers.items())
+            ]
+        return {"window": self.limiter.snapshot(), "breakers": breakers}
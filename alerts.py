@@ -0,0 +1,160 @@
+"""Avvisi di variazione prezzo.
+
+Confronta un nuovo shop con l'ultimo snapshot archiviato in `rate_store` e
+scrive gli eventi in una outbox SQLite da cui un notificatore può leggerli.
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+import rate_store
+
+# Soglie predefinite (variazione percentuale del prezzo per notte)
+DEFAULT_DROP_THRESHOLD_PCT = 10.0
+DEFAULT_RISE_THRESHOLD_PCT = None
+
+EVENT_COLUMNS = rate_store.RATE_KEY + ["ota", "event_type", "old_price", "new_price", "change_pct"]
+
+# Etichette per la visualizzazione nella dashboard
+EVENT_LABELS = {
+    "price_drop": "Calo prezzo",
+    "price_rise": "Aumento prezzo",
+    "new_rate": "Nuova tariffa",
+    "rate_removed": "Tariffa non più disponibile",
+}
+
+OUTBOX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS alert_outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    event_type TEXT NOT NULL,
+    hotel TEXT NOT NULL,
+    ota_code TEXT NOT NULL,
+    ota TEXT,
+    check_in TEXT NOT NULL,
+    check_out TEXT NOT NULL,
+    adults INTEGER NOT NULL,
+    children INTEGER NOT NULL,
+    rooms INTEGER NOT NULL,
+    currency TEXT NOT NULL,
+    old_price REAL,
+    new_price REAL,
+    change_pct REAL,
+    delivered_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_alert_outbox_pending
+    ON alert_outbox (delivered_at, id);
+"""
+
+
+def diff_rates(new_df, last_df, known_groups, drop_threshold_pct=DEFAULT_DROP_THRESHOLD_PCT,
+               rise_threshold_pct=DEFAULT_RISE_THRESHOLD_PCT):
+    """Confronta le tariffe nuove con l'ultimo snapshot tramite join sulla chiave tariffa.
+
+    `new_df` e `last_df` devono contenere le colonne di `rate_store.STORED_COLUMNS`;
+    `known_groups` elenca i gruppi già ricercati in passato: per gli altri non si
+    generano eventi "new_rate" (il primo shop non è una variazione).
+    """
+    key = rate_store.RATE_KEY
+    new_idx = new_df.set_index(key)[["ota", "price_raw"]]
+    old_idx = last_df.set_index(key)[["ota", "price_raw"]]
+
+    merged = new_idx.join(old_idx, how="outer", lsuffix="_new", rsuffix="_old")
+    if merged.empty:
+        return pd.DataFrame(columns=EVENT_COLUMNS)
+
+    new_price = merged["price_raw_new"].astype(float)
+    old_price = merged["price_raw_old"].astype(float)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        change_pct = (new_price - old_price) / old_price * 100
+
+    both = new_price.notna() & old_price.notna() & (old_price > 0)
+    event_type = pd.Series(None, index=merged.index, dtype=object)
+    event_type[both & (change_pct <= -drop_threshold_pct)] = "price_drop"
+    if rise_threshold_pct is not None:
+        event_type[both & (change_pct >= rise_threshold_pct)] = "price_rise"
+    event_type[new_price.isna() & old_price.notna()] = "rate_removed"
+
+    # Una tariffa è "nuova" solo se il gruppo era già stato ricercato
+    if known_groups is not None and not known_groups.empty:
+        group_idx = pd.MultiIndex.from_frame(known_groups[rate_store.GROUP_KEY])
+        merged_groups = merged.index.droplevel("ota_code")
+        was_known = merged_groups.isin(group_idx)
+        event_type[new_price.notna() & old_price.isna() & was_known] = "new_rate"
+
+    events = pd.DataFrame({
+        "ota": merged["ota_new"].fillna(merged["ota_old"]),
+        "event_type": event_type,
+        "old_price": old_price,
+        "new_price": new_price,
+        "change_pct": change_pct.where(both),
+    })
+    events = events[events["event_type"].notna()].reset_index()
+
+    return events[EVENT_COLUMNS]
+
+
+def ensure_outbox(conn):
+    conn.executescript(OUTBOX_SCHEMA)
+
+
+def write_outbox(conn, events, created_at=None):
+    """Accoda gli eventi nella outbox (senza commit)"""
+    if events.empty:
+        return 0
+
+    created_at = created_at or time.time()
+    columns = ["created_at"] + EVENT_COLUMNS
+    conn.executemany(
+        f"INSERT INTO alert_outbox ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+        [(created_at,) + row for row in rate_store._to_rows(events[EVENT_COLUMNS])]
+    )
+    return len(events)
+
+
+def process_shop(conn, rates_df, groups_df, drop_threshold_pct=DEFAULT_DROP_THRESHOLD_PCT,
+                 rise_threshold_pct=DEFAULT_RISE_THRESHOLD_PCT, shop_ts=None):
+    """Confronta lo shop con l'ultimo snapshot, scrive gli eventi e archivia lo shop.
+
+    `groups_df` contiene i gruppi (una riga per chiamata get_rates andata a buon
+    fine): un gruppo senza tariffe disponibili è trattato come sold out.
+    Restituisce il DataFrame degli eventi generati.
+    """
+    ensure_outbox(conn)
+
+    if groups_df is None or groups_df.empty:
+        return pd.DataFrame(columns=EVENT_COLUMNS)
+
+    new_rates = rate_store.rates_for_storage(rates_df)
+
+    with conn:
+        # Lock di scrittura preso subito: con più processi che archiviano insieme la lettura
+        # dell'ultimo snapshot e la scrittura restano atomiche (e non falliscono con SQLITE_BUSY)
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        last_rates, known_groups = rate_store.load_latest(conn, groups_df)
+        events = diff_rates(new_rates, last_rates, known_groups, drop_threshold_pct, rise_threshold_pct)
+        write_outbox(conn, events)
+        rate_store.record_shop(conn, rates_df, groups_df, shop_ts)
+
+    return events
+
+
+def pending_alerts(conn, limit=100):
+    """Eventi non ancora consegnati, in ordine di creazione"""
+    ensure_outbox(conn)
+    return pd.read_sql_query(
+        "SELECT * FROM alert_outbox WHERE delivered_at IS NULL ORDER BY id LIMIT ?",
+        conn,
+        params=(limit,)
+    )
+
+
+def mark_delivered(conn, alert_ids):
+    with conn:
+        conn.executemany(
+            "UPDATE alert_outbox SET delivered_at = ? WHERE id = ?",
+            [(time.time(), int(alert_id)) for alert_id in alert_ids]
+        )
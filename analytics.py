@@ -0,0 +1,346 @@
+"""Analisi SQL ad hoc sull'archivio tariffe, con un motore SQL nel processo.
+
+Le query leggono i dati da disco, senza caricarli nella sessione:
+- con DuckDB (dipendenza opzionale, `pip install -r requirements-duckdb.txt`,
+  motore colonnare) da una copia Parquet
+  dell'archivio, un file per tabella, aggiornata da `export_parquet` (dalla
+  dashboard, con `python analytics.py --export` o `headless.py --export-parquet`);
+- altrimenti direttamente dall'archivio SQLite, aperto in sola lettura.
+
+Con entrambi i motori sono disponibili le stesse viste:
+- `rates`: storico, una riga per tariffa e shop (ricostruita dagli intervalli)
+- `latest`: ultima tariffa nota per hotel, OTA, soggiorno e occupazione
+- `shops`: registro delle ricerche, anche senza tariffe
+- `heatmap`: ultimo calendario prezzi (economico/medio/alto) per hotel e data
+- `hotels`: anagrafica e rating degli hotel configurati
+- `catalog`: catalogo hotel delle località (se popolato con hotel_catalog.py)
+
+`rates` e `latest` hanno in più `nights` e `weekday` (giorno della settimana
+dell'arrivo, 0 = lunedì). Dei risultati vengono lette al massimo `max_rows`
+righe e le query vengono interrotte dopo `timeout` secondi. DuckDB e pyarrow
+vengono importati solo quando servono (query DuckDB, esportazione).
+
+Esempio:
+    python analytics.py --export
+    python analytics.py --query "SELECT hotel, ota, AVG(price_raw) FROM latest GROUP BY 1, 2"
+"""
+import argparse
+import importlib.util
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pandas as pd
+
+import rate_store
+
+DEFAULT_PARQUET_DIR = os.environ.get(
+    "RATESHOPPER_PARQUET_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "parquet")
+)
+
+DEFAULT_MAX_ROWS = 10000
+MAX_ROWS_LIMIT = 100000
+DEFAULT_TIMEOUT_SECONDS = 30
+DUCKDB_MEMORY_LIMIT = "1GB"
+
+# Righe lette dall'archivio per ogni blocco scritto nel file Parquet
+EXPORT_CHUNK_ROWS = 200000
+
+EXPORT_TABLES = ["rate_intervals", "rate_latest", "shop_log", "heatmap_days", "hotel_info", "hotel_catalog"]
+
+ENGINE_LABELS = {
+    "duckdb": "DuckDB (copia Parquet)",
+    "sqlite": "SQLite (archivio)"
+}
+
+# Tipo Arrow (nome del costruttore pyarrow) per tipo dichiarato SQLite; gli altri come testo
+_ARROW_TYPES = {"INTEGER": "int64", "REAL": "float64", "TEXT": "string"}
+
+# Colonne derivate, scritte con le funzioni di data di ciascun motore
+_DERIVED = {
+    "sqlite": {
+        "nights": "CAST(julianday({t}.check_out) - julianday({t}.check_in) AS INTEGER)",
+        "weekday": "(CAST(strftime('%w', {t}.check_in) AS INTEGER) + 6) % 7"
+    },
+    "duckdb": {
+        "nights": "date_diff('day', CAST({t}.check_in AS DATE), CAST({t}.check_out AS DATE))",
+        "weekday": "isodow(CAST({t}.check_in AS DATE)) - 1"
+    }
+}
+
+# Vista: (tabelle dell'archivio necessarie, definizione)
+VIEWS = {
+    "rates": (
+        ["shop_log", "rate_intervals"],
+        f"SELECT s.shop_ts, {', '.join('r.' + c for c in rate_store.STORED_COLUMNS)}, {{nights}} AS nights, "
+        f"{{weekday}} AS weekday FROM shop_log s JOIN rate_intervals r ON {rate_store._covering('s')}"
+    ),
+    "latest": (["rate_latest"], "SELECT r.*, {nights} AS nights, {weekday} AS weekday FROM rate_latest r"),
+    "shops": (["shop_log"], "SELECT * FROM shop_log"),
+    "heatmap": (["heatmap_days"], "SELECT * FROM heatmap_days"),
+    "hotels": (["hotel_info"], "SELECT * FROM hotel_info"),
+    "catalog": (["hotel_catalog"], "SELECT * FROM hotel_catalog")
+}
+
+EXAMPLE_QUERY = """-- Sovrapprezzo medio di Booking.com rispetto al sito dell'hotel (WIHP)
+-- per giorno della settimana dell'arrivo, soggiorni con arrivo a luglio
+WITH coppie AS (
+    SELECT hotel, weekday,
+           MAX(CASE WHEN ota_code = 'BookingCom' THEN price_raw END) AS booking,
+           MAX(CASE WHEN ota_code = 'WIHP' THEN price_raw END) AS wihp
+    FROM rates
+    WHERE substr(check_in, 6, 2) = '07'
+    GROUP BY hotel, check_in, check_out, adults, children, rooms, currency, shop_ts, weekday
+)
+SELECT hotel, weekday, COUNT(*) AS confronti,
+       ROUND(AVG(booking - wihp), 2) AS sovrapprezzo_medio,
+       ROUND(AVG(100.0 * (booking - wihp) / wihp), 1) AS sovrapprezzo_pct
+FROM coppie
+WHERE booking IS NOT NULL AND wihp IS NOT NULL
+GROUP BY hotel, weekday
+ORDER BY hotel, weekday"""
+
+
+class QueryError(Exception):
+    pass
+
+
+def available_engines():
+    # Solo verifica dell'installazione: duckdb viene importato alla prima query
+    return (["duckdb"] if importlib.util.find_spec("duckdb") is not None else []) + ["sqlite"]
+
+
+def _parquet_path(table, parquet_dir=None):
+    return os.path.join(parquet_dir or DEFAULT_PARQUET_DIR, f"{table}.parquet")
+
+
+def export_parquet(db_path=None, parquet_dir=None):
+    """Scrive la copia Parquet delle tabelle dell'archivio, a blocchi.
+
+    Ogni file viene scritto accanto al precedente e sostituito in modo
+    atomico, così le query in corso non leggono mai un file parziale.
+    Restituisce lo stato dell'esportazione (vedi `export_status`).
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    parquet_dir = parquet_dir or DEFAULT_PARQUET_DIR
+    os.makedirs(parquet_dir, exist_ok=True)
+
+    conn = rate_store.connect(db_path)
+    try:
+        rows = {}
+        for table in EXPORT_TABLES:
+            columns = conn.execute(f"PRAGMA table_info({table})").fetchall()
+            if not columns:
+                continue
+            schema = pa.schema([
+                (name, getattr(pa, _ARROW_TYPES.get(declared.upper(), "string"))()) for _, name, declared, *_ in columns
+            ])
+
+            path = _parquet_path(table, parquet_dir)
+            tmp_path = path + ".tmp"
+            rows[table] = 0
+            with pq.ParquetWriter(tmp_path, schema) as writer:
+                for chunk in pd.read_sql_query(f"SELECT * FROM {table}", conn, chunksize=EXPORT_CHUNK_ROWS):
+                    writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+                    rows[table] += len(chunk)
+            os.replace(tmp_path, path)
+
+        last_shop_ts = rate_store.last_shop_ts(conn)
+    finally:
+        conn.close()
+
+    status = {"exported_at": time.time(), "last_shop_ts": last_shop_ts, "rows": rows}
+    tmp_meta = os.path.join(parquet_dir, "export.json.tmp")
+    with open(tmp_meta, "w", encoding="utf-8") as f:
+        json.dump(status, f)
+    os.replace(tmp_meta, os.path.join(parquet_dir, "export.json"))
+    return status
+
+
+def export_status(parquet_dir=None):
+    """Orario dell'ultima esportazione, ultimo shop incluso e righe per tabella (None se mai esportata)"""
+    try:
+        with open(os.path.join(parquet_dir or DEFAULT_PARQUET_DIR, "export.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _open_duckdb(parquet_dir):
+    try:
+        import duckdb
+    except ImportError:  # dipendenza opzionale
+        raise QueryError("DuckDB non è installato (pip install -r requirements-duckdb.txt): usare il motore SQLite")
+    if export_status(parquet_dir) is None:
+        raise QueryError("Copia Parquet non ancora creata: aggiornarla prima di interrogarla con DuckDB")
+
+    conn = duckdb.connect()
+    tables = []
+    for table in EXPORT_TABLES:
+        path = _parquet_path(table, parquet_dir)
+        if os.path.exists(path):
+            escaped = path.replace("'", "''")
+            conn.execute(f"CREATE VIEW {table} AS SELECT * FROM read_parquet('{escaped}')")
+            tables.append(table)
+    # Le query possono leggere solo la copia Parquet
+    escaped_dir = os.path.join(os.path.abspath(parquet_dir), "").replace("'", "''")
+    conn.execute(f"SET allowed_directories = ['{escaped_dir}']")
+    conn.execute("SET enable_external_access = false")
+    conn.execute(f"SET memory_limit = '{DUCKDB_MEMORY_LIMIT}'")
+    return conn, tables
+
+
+def _lock_duckdb(conn):
+    # Dopo la creazione delle viste la query non può cambiare limiti e accessi
+    conn.execute("SET lock_configuration = true")
+
+
+def _open_sqlite(db_path):
+    path = db_path or rate_store.DEFAULT_DB_PATH
+    if not os.path.exists(path):
+        raise QueryError("Archivio tariffe non trovato: eseguire prima una ricerca")
+    conn = sqlite3.connect(f"{Path(path).resolve().as_uri()}?mode=ro", uri=True)
+    tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+    return conn, tables
+
+
+def _connect(engine, db_path=None, parquet_dir=None):
+    """Connessione in sola lettura con le viste di analisi; restituisce (connessione, viste)"""
+    parquet_dir = parquet_dir or DEFAULT_PARQUET_DIR
+    if engine == "duckdb":
+        conn, tables = _open_duckdb(parquet_dir)
+        create_view = "CREATE VIEW"
+    else:
+        conn, tables = _open_sqlite(db_path)
+        create_view = "CREATE TEMP VIEW"
+
+    derived = {name: expression.format(t="r") for name, expression in _DERIVED[engine].items()}
+    views = []
+    for view, (required, definition) in VIEWS.items():
+        if all(table in tables for table in required):
+            conn.execute(f"{create_view} {view} AS {definition.format(**derived)}")
+            views.append(view)
+    if engine == "duckdb":
+        _lock_duckdb(conn)
+    return conn, views
+
+
+def describe_views(engine, db_path=None, parquet_dir=None):
+    """Colonne di ogni vista disponibile con il motore indicato"""
+    conn, views = _connect(engine, db_path, parquet_dir)
+    try:
+        described = {}
+        for view in views:
+            cursor = conn.execute(f"SELECT * FROM {view} LIMIT 0")
+            described[view] = [column[0] for column in cursor.description]
+        return described
+    finally:
+        conn.close()
+
+
+def _fetch(cursor, max_rows):
+    """Al massimo max_rows + 1 righe dalla query dell'utente, così com'è (ORDER BY compreso)"""
+    if cursor.description is None:
+        raise QueryError("La query non restituisce righe: usare una SELECT sulle viste di analisi")
+    return pd.DataFrame(cursor.fetchmany(max_rows + 1), columns=[column[0] for column in cursor.description])
+
+
+def run_query(sql, engine="sqlite", max_rows=DEFAULT_MAX_ROWS, timeout=DEFAULT_TIMEOUT_SECONDS, db_path=None,
+              parquet_dir=None):
+    """Esegue una query SELECT sulle viste di analisi.
+
+    Restituisce un dizionario con il risultato (al massimo `max_rows` righe),
+    se è stato troncato, la durata in secondi e il motore usato. Errori e
+    timeout sollevano QueryError.
+    """
+    sql = sql.strip().rstrip(";").strip()
+    if not sql:
+        raise QueryError("La query è vuota")
+    max_rows = int(min(max_rows, MAX_ROWS_LIMIT))
+
+    conn, _ = _connect(engine, db_path, parquet_dir)
+    timed_out = threading.Event()
+    started = time.perf_counter()
+    try:
+        if engine == "duckdb":
+            def interrupt():
+                timed_out.set()
+                conn.interrupt()
+
+            timer = threading.Timer(timeout, interrupt)
+            timer.start()
+            try:
+                data = _fetch(conn.execute(sql), max_rows)
+            finally:
+                timer.cancel()
+        else:
+            deadline = started + timeout
+
+            def check_deadline():
+                if time.perf_counter() > deadline:
+                    timed_out.set()
+                    return 1
+                return 0
+
+            conn.set_progress_handler(check_deadline, 10000)
+            data = _fetch(conn.execute(sql), max_rows)
+    except QueryError:
+        raise
+    except Exception as e:
+        if timed_out.is_set():
+            raise QueryError(f"Query interrotta dopo {timeout} s: restringere il periodo o le tabelle lette") from e
+        raise QueryError(f"Errore nella query: {e}") from e
+    finally:
+        conn.close()
+
+    return {
+        "data": data.head(max_rows),
+        "truncated": len(data) > max_rows,
+        "seconds": time.perf_counter() - started,
+        "engine": engine
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Analisi SQL sull'archivio tariffe")
+    parser.add_argument("--export", action="store_true", help="Aggiorna la copia Parquet dell'archivio")
+    parser.add_argument("--query", help="Query SQL da eseguire sulle viste di analisi")
+    parser.add_argument("--engine", choices=["duckdb", "sqlite"], default=available_engines()[0])
+    parser.add_argument("--max-rows", type=int, default=DEFAULT_MAX_ROWS, help="Righe massime del risultato")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT_SECONDS, help="Durata massima della query (s)")
+    parser.add_argument("--db", default=rate_store.DEFAULT_DB_PATH, help="Percorso del database SQLite")
+    parser.add_argument("--parquet-dir", default=DEFAULT_PARQUET_DIR)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.export:
+        started = time.perf_counter()
+        status = export_parquet(args.db, args.parquet_dir)
+        rows = ", ".join(f"{table} {count}" for table, count in status["rows"].items())
+        print(f"Copia Parquet aggiornata in {time.perf_counter() - started:.1f} s ({rows})")
+
+    if args.query:
+        try:
+            result = run_query(args.query, args.engine, args.max_rows, args.timeout, args.db, args.parquet_dir)
+        except QueryError as e:
+            print(e)
+            return 1
+        print(result["data"].to_string(index=False))
+        truncated = f" (limitato a {args.max_rows} righe)" if result["truncated"] else ""
+        print(f"{len(result['data'])} righe in {result['seconds'] * 1000:.0f} ms con {ENGINE_LABELS[result['engine']]}{truncated}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,680 +1,429 @@
 import streamlit as st
 import pandas as pd
-import numpy as np
-import plotly.express as px
-import plotly.graph_objects as go
 from datetime import datetime, timedelta
-import requests
-import json
 import base64
 import locale
+import os
+import threading
+import time
 
-# Imposta locale italiana per nomi mesi e giorni
-try:
-    locale.setlocale(locale.LC_TIME, 'it_IT.UTF-8')
-except:
+import alerts
+import calibrate
+import rate_store
+import refresh_scheduler
+from adaptive_concurrency import BREAKER_STATE_LABELS
+from core import (
+    HOTEL_INFO_TTL_SECONDS,
+    SEARCH_CACHE_TTL_SECONDS,
+    XoteloAPI,
+    build_rate_heatmap,
+    get_nome_mese,
+    hotel_keys,
+    load_stored_search,
+    load_stored_sweep,
+    normalize_dataframe,
+    reference_delta,
+    archive_search,
+    run_search,
+    search_cache_key,
+    search_succeeded,
+)
+from fx import BASE_CURRENCY, SUPPORTED_CURRENCIES, convert_rates, fx_as_of, fx_factor
+from los_matrix import MAX_LOS, build_los_matrix, los_slice
+from market_index import DEFAULT_HORIZON_DAYS, DEFAULT_REFERENCE_HOTEL, load_market_index, rating_weights
+from prefetch import Prefetcher, gate_busy, likely_next_searches, remember_occupancy
+from rate_cube import CubeReader
+from rounding import CORRECTION_COLUMNS, DEFAULT_CORRECTIONS_PATH, apply_corrections, load_corrections
+from shared_cache import SharedResultStore
+from shop_jobs import JOB_STATUS_LABELS, ShopJob, format_eta, job_params, list_jobs
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+
+# Logo remoto usato solo se il file locale non è presente in static/
+LOGO_FILE = "ratevision_logo.png"
+LOGO_URL = "https://revguardian.altervista.org/images/ratevision_logo.png"
+
+@st.cache_resource(show_spinner=False)
+def init_locale():
+    # Imposta locale italiana per nomi mesi e giorni (una sola volta per processo)
     try:
-        locale.setlocale(locale.LC_TIME, 'it_IT')
+        locale.setlocale(locale.LC_TIME, 'it_IT.UTF-8')
     except:
-        pass  # Fallback alla locale di default
+        try:
+            locale.setlocale(locale.LC_TIME, 'it_IT')
+        except:
+            pass  # Fallback alla locale di default
+    return True
 
-st.set_page_config(
-    page_title="Rate Checker VOI Alimini (BETA)",
-    page_icon="📊",
-    layout="wide"
-)
+@st.cache_resource(show_spinner=False)
+def load_css():
+    with open(os.path.join(STATIC_DIR, "style.css"), encoding="utf-8") as f:
+        return f"<style>\n{f.read()}</style>"
 
-# Aggiunta di Font Awesome per le icone
-st.markdown(
-    """
-    <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/5.15.3/css/all.min.css">
-    """,
-    unsafe_allow_html=True
-)
+@st.cache_resource(show_spinner=False)
+def load_icon(name):
+    with open(os.path.join(STATIC_DIR, "icons", f"{name}.svg"), encoding="utf-8") as f:
+        return f.read().strip()
 
-# CSS personalizzato per la sidebar e gli elementi
-st.markdown(
-    """
-    <style>
-    /* Colori base */
-    [data-testid="stSidebar"] {
-        background-color: #0f7378 !important;
-        color: white !important;
-    }
-    [data-testid="stSidebar"] .css-1d391kg {
-        padding-top: 0;
-    }
-    [data-testid="stSidebar"] .block-container {
-        padding-top: 0;
-    }
-    
-    /* Contenitore del logo */
-    .sidebar-logo {
-        text-align: center;
-        padding: 20px 0;
-        margin-bottom: 20px;
-        border-bottom: 1px solid rgba(255, 255, 255, 0.2);
-        background-color: rgba(255, 255, 255, 0.05);
-    }
-    
-    /* Stile immagine logo */
-    .sidebar-logo img {
-        max-width: 80%;
-        height: auto;
-        filter: drop-shadow(0 2px 3px rgba(0, 0, 0, 0.2));
-        transition: all 0.3s ease;
-    }
-    
-    /* Effetto hover sul logo */
-    .sidebar-logo img:hover {
-        transform: scale(1.05);
-    }
-    
-    /* Testo sottotitolo del logo */
-    .logo-subtitle {
-        color: rgba(255, 255, 255, 0.8);
-        font-size: 12px;
-        margin-top: 5px;
-        font-style: italic;
-    }
-    
-    /* Miglioramento delle pills del multiselect */
-    [data-testid="stSidebar"] .stMultiSelect span[data-baseweb="tag"] {
-        background-color: #0a5c60 !important;
-        color: white !important;
-        border: 1px solid rgba(255, 255, 255, 0.3) !important;
-        border-radius: 4px !important;
-        margin: 2px !important;
-        padding: 5px 8px !important;
-        font-size: 0.9em !important;
-    }
-    
-    [data-testid="stSidebar"] .stMultiSelect span[data-baseweb="tag"]:hover {
-        background-color: #084548 !important;
-        border-color: white !important;
-    }
-    
-    /* Miglioramento pulsante X nelle pills */
-    [data-testid="stSidebar"] .stMultiSelect span[data-baseweb="tag"] button {
-        background-color: transparent !important;
-        color: rgba(255, 255, 255, 0.8) !important;
-        border: none !important;
-        font-weight: bold !important;
-        padding: 0 4px !important;
-        margin-left: 5px !important;
-    }
-    
-    [data-testid="stSidebar"] .stMultiSelect span[data-baseweb="tag"] button:hover {
-        color: white !important;
-        background-color: rgba(255, 255, 255, 0.1) !important;
-        border-radius: 50% !important;
-    }
-    
-    /* Radio e checkbox */
-    [data-testid="stSidebar"] .stRadio input,
-    [data-testid="stSidebar"] .stCheckbox input {
-        accent-color: #f5f5f5 !important;
-    }
-    
-    /* Testo e label */
-    [data-testid="stSidebar"] h1, [data-testid="stSidebar"] h2, [data-testid="stSidebar"] h3, 
-    [data-testid="stSidebar"] h4, [data-testid="stSidebar"] h5, [data-testid="stSidebar"] h6,
-    [data-testid="stSidebar"] p {
-        color: white !important;
-    }
-    [data-testid="stSidebar"] .stMarkdown {
-        color: white !important;
-    }
-    [data-testid="stSidebar"] .css-pkbazv {
-        color: white !important;
-    }
-    [data-testid="stSidebar"] .css-16idsys p {
-        color: white !important;
-    }
-    [data-testid="stSidebar"] .e1nzilvr1 {
-        color: white !important;
-    }
-    
-    /* Banner informativi */
-    .info-banner {
-        background-color: rgba(255, 255, 255, 0.1);
-        border-left: 3px solid rgba(255, 255, 255, 0.7);
-        padding: 10px 15px;
-        margin: 12px 0;
-        border-radius: 0 4px 4px 0;
-        display: flex;
-        align-items: center;
-    }
-    
-    /* Icone per i banner */
-    .info-banner i {
-        margin-right: 10px;
-        color: rgba(255, 255, 255, 0.9);
-    }
-    
-    /* Testo nei banner */
-    .info-banner-text {
-        font-size: 14px;
-        font-weight: 500;
-        color: white;
-    }
-    
-    /* Evidenziazione dei valori numerici */
-    .info-banner-value {
-        font-weight: 700;
-    }
-    
-    /* Stile bottone primario */
-    [data-testid="stSidebar"] button[kind="primary"] {
-        background-color: #f5f5f5 !important;
-        color: #0a5c60 !important;
-        border-radius: 6px !important;
-        font-weight: 600 !important;
-        padding: 0.5rem 1rem !important;
-        box-shadow: 0 2px 5px rgba(0,0,0,0.1) !important;
-        transition: all 0.2s !important;
-        border: none !important;
-        width: 100% !important;
-        margin: 8px 0 !important;
-    }
-    
-    [data-testid="stSidebar"] button[kind="primary"]:hover {
-        background-color: white !important;
-        box-shadow: 0 3px 8px rgba(0,0,0,0.2) !important;
-        transform: translateY(-1px) !important;
-    }
-    
-    /* Stile bottone secondario */
-    [data-testid="stSidebar"] button[kind="secondary"] {
-        background-color: transparent !important;
-        color: white !important;
-        border: 1px solid rgba(255,255,255,0.6) !important;
-        border-radius: 6px !important;
-        font-weight: 400 !important;
-        padding: 0.4rem 0.8rem !important;
-        transition: all 0.2s !important;
-        width: 100% !important;
-        margin: 5px 0 !important;
-    }
-    
-    [data-testid="stSidebar"] button[kind="secondary"]:hover {
-        background-color: rgba(255,255,255,0.1) !important;
-        border-color: white !important;
-    }
-    
-    /* Miglioramento bottoni +/- nei selettori numerici */
-    [data-testid="stSidebar"] [data-testid="stNumberInput"] button {
-        background-color: #0a5c60 !important; 
-        color: white !important;
-        border: 1px solid rgba(255, 255, 255, 0.3) !important;
-        border-radius: 4px !important;
-        font-weight: bold !important;
-        width: 28px !important;
-        height: 28px !important;
-        display: flex !important;
-        align-items: center !important;
-        justify-content: center !important;
-    }
-    
-    [data-testid="stSidebar"] [data-testid="stNumberInput"] button:hover {
-        background-color: white !important;
-        color: #0a5c60 !important;
-        border-color: white !important;
-        transform: scale(1.05);
-        transition: all 0.2s;
-    }
-    
-    /* Campo input del numero più grande e meglio centrato */
-    [data-testid="stSidebar"] [data-testid="stNumberInput"] input {
-        text-align: center !important;
-        font-size: 1.1em !important;
-        font-weight: 500 !important;
-        background-color: rgba(255, 255, 255, 0.9) !important;
-        color: #0a5c60 !important;
-        border: 1px solid rgba(255, 255, 255, 0.3) !important;
-    }
+@st.cache_resource(show_spinner=False)
+def load_logo_src():
+    logo_path = os.path.join(STATIC_DIR, LOGO_FILE)
+    if os.path.exists(logo_path):
+        with open(logo_path, "rb") as f:
+            return "data:image/png;base64," + base64.b64encode(f.read()).decode("ascii")
+    return LOGO_URL
+
+def setup_page():
+    """Configurazione pagina, CSS e logo: da chiamare all'inizio di ogni esecuzione dello script"""
+    st.set_page_config(
+        page_title="Rate Checker VOI Alimini (BETA)",
+        page_icon="📊",
+        layout="wide"
+    )
     
-    /* Miglioramento dei dropdown */
-    [data-testid="stSidebar"] .stSelectbox select {
-        background-color: rgba(255, 255, 255, 0.9) !important;
-        color: #0a5c60 !important;
-        border-radius: 4px !important;
-        border: 1px solid rgba(255, 255, 255, 0.3) !important;
-    }
+    init_locale()
     
-    /* Miglioramento date input */
-    [data-testid="stSidebar"] .stDateInput input {
-        background-color: rgba(255, 255, 255, 0.9) !important;
-        color: #0a5c60 !important;
-        border-radius: 4px !important;
-        border: 1px solid rgba(255, 255, 255, 0.3) !important;
-        text-align: center !important;
-    }
+    # CSS personalizzato per la sidebar e gli elementi (letto da static/style.css)
+    st.markdown(load_css(), unsafe_allow_html=True)
     
-    /* Header della sidebar */
-    [data-testid="stSidebar"] h1, 
-    [data-testid="stSidebar"] h2, 
-    [data-testid="stSidebar"] h3 {
-        margin-top: 20px !important;
-        margin-bottom: 10px !important;
-        font-weight: 600 !important;
-        border-bottom: 1px solid rgba(255, 255, 255, 0.2) !important;
-        padding-bottom: 5px !important;
-    }
-    
-    /* Stile calendario */
-    .calendar-container table {
-        width: 100%;
-        border-collapse: collapse;
-        margin-bottom: 20px;
-    }
-    .calendar-container th, 
-    .calendar-container td {
-        border: 1px solid #ddd;
-        padding: 8px;
-        text-align: center;
-    }
-    .calendar-container th {
-        background-color: #f2f2f2;
-        font-weight: bold;
-    }
-    .calendar-day {
-        font-weight: bold;
-        font-size: 16px;
-        margin-bottom: 4px;
-    }
-    .price-level {
-        font-size: 12px;
-    }
-    .price-economic {
-        background-color: #90EE90;
-    }
-    .price-medium {
-        background-color: #F0E68C;
-    }
-    .price-high {
-        background-color: #F08080;
-    }
-    .price-unavailable {
-        background-color: #D3D3D3;
-    }
-    .calendar-legend {
-        display: flex;
-        justify-content: center;
-        margin-top: 10px;
-        margin-bottom: 30px;
-    }
-    .legend-item {
-        display: flex;
-        align-items: center;
-        margin-right: 20px;
-    }
-    .legend-color {
-        width: 20px;
-        height: 20px;
-        margin-right: 5px;
-    }
-    </style>
-    """,
-    unsafe_allow_html=True
-)
+    # Logo nella sidebar
+    st.sidebar.markdown(
+        f"""
+        <div class="sidebar-logo">
+            <img src="{load_logo_src()}" alt="Rate Vision Logo">
+            <div class="logo-subtitle">Hotel Rate Intelligence</div>
+        </div>
+        """,
+        unsafe_allow_html=True
+    )
 
-# Logo nella sidebar
-st.sidebar.markdown(
-    """
-    <div class="sidebar-logo">
-        <img src="https://revguardian.altervista.org/images/ratevision_logo.png" alt="Rate Vision Logo">
-        <div class="logo-subtitle">Hotel Rate Intelligence</div>
-    </div>
-    """,
-    unsafe_allow_html=True
-)
+@st.cache_resource
+def get_xotelo_api():
+    """Client Xotelo condiviso dal processo: pool di connessioni asincrono se httpx è installato"""
+    try:
+        # httpx viene importato solo quando il client viene creato
+        from xotelo_async import SyncXoteloAPI
+        return SyncXoteloAPI()
+    except ImportError:
+        return XoteloAPI()
 
-class XoteloAPI:
-    def __init__(self):
-        self.base_url = "https://data.xotelo.com/api"
-    
-    def get_rates(self, hotel_key, check_in, check_out, adults=2, children_ages=None, rooms=1, currency="EUR"):
-        endpoint = f"{self.base_url}/rates"
-        params = {
-            "hotel_key": hotel_key,
-            "chk_in": check_in,
-            "chk_out": check_out,
-            "adults": adults,
-            "rooms": rooms,
-            "currency": currency
-        }
-        
-        if children_ages and len(children_ages) > 0:
-            params["age_of_children"] = ",".join(map(str, children_ages))
-        
-        try:
-            response = requests.get(endpoint, params=params)
-            return response.json()
-        except Exception as e:
-            return {"error": str(e), "timestamp": 0, "result": None}
-    
-    def get_heatmap(self, hotel_key, check_out):
-        endpoint = f"{self.base_url}/heatmap"
-        params = {
-            "hotel_key": hotel_key,
-            "chk_out": check_out
-        }
-        
-        try:
-            response = requests.get(endpoint, params=params)
-            return response.json()
-        except Exception as e:
-            return {"error": str(e), "timestamp": 0, "result": None}
-    
-    def get_hotel_list(self, location_key, limit=30, offset=0, sort="best_value"):
-        endpoint = f"{self.base_url}/list"
-        params = {
-            "location_key": location_key,
-            "limit": limit,
-            "offset": offset,
-            "sort": sort
-        }
-        
-        try:
-            response = requests.get(endpoint, params=params)
-            return response.json()
-        except Exception as e:
-            return {"error": str(e), "timestamp": 0, "result": None}
+@st.cache_resource
+def get_shared_store():
+    """Archivio risultati unico per il processo, condiviso da tutte le sessioni"""
+    return SharedResultStore(ttl_seconds=SEARCH_CACHE_TTL_SECONDS)
 
-hotel_keys = {
-    "VOI Alimini": "g652004-d1799967",  
-    "Ciaoclub Arco Del Saracino": "g946998-d947000", 
-    "Hotel Alpiselect Robinson Apulia": "g947837-d949958",  
-    "Alpiclub Hotel Thalas Club": "g1179328-d1159227" 
-}
+@st.cache_resource(show_spinner=False, max_entries=16)
+def get_market_index(adults, children, rooms, currency, num_nights, as_of=None):
+    """Indice di mercato condiviso per occupazione, valuta e durata; aggiornato a ogni ricerca
+    e, alla visualizzazione, con gli shop archiviati nel frattempo (refresh).
 
-location_key = "g652004"
+    Con `as_of` (modalità snapshot) è l'indice fisso ricostruito dall'archivio a quel momento.
+    """
+    occupancy = {"adults": adults, "children": children, "rooms": rooms}
+    return load_market_index(occupancy, currency, num_nights, as_of=as_of)
 
-# Nomi mesi in italiano (fallback se locale non disponibile)
-MESI_IT = {
-    1: "Gennaio", 2: "Febbraio", 3: "Marzo", 4: "Aprile",
-    5: "Maggio", 6: "Giugno", 7: "Luglio", 8: "Agosto",
-    9: "Settembre", 10: "Ottobre", 11: "Novembre", 12: "Dicembre"
-}
+@st.cache_resource
+def get_cube_reader():
+    """Cubi tariffe su disco, mappati in memoria una volta per processo"""
+    return CubeReader()
 
-def get_nome_mese(data):
-    """Restituisce il nome del mese in italiano"""
-    return f"{MESI_IT[data.month]} {data.year}"
+@st.cache_resource(ttl=HOTEL_INFO_TTL_SECONDS, show_spinner=False)
+def get_hotel_index():
+    """Catalogo hotel con indice spaziale, ricaricato dopo il TTL delle info hotel"""
+    # Catalogo e scipy vengono importati solo dalla vista Mappa Competitor
+    from hotel_catalog import load_hotel_index
+    return load_hotel_index()
 
-# Correzioni arrotondamento API per OTA (€/notte)
-# L'API Xotelo restituisce rate e tax come interi arrotondati per difetto.
-# Queste correzioni compensano la differenza rispetto ai prezzi reali su TripAdvisor.
-OTA_ROUNDING_CORRECTIONS = {
-    "BookingCom": 2,      # Booking.com: +2€/notte
-    "WIHP": 1,            # Official Site (WIHP): +1€/notte
-    "Vio": 1,             # Vio.com: +1€/notte
-    "Expedia": 1,         # Expedia: +1€/notte
-    "HotelsCom2": 1,      # Hotels.com: +1€/notte
-    "Agoda": 1,           # Agoda: +1€/notte
-    "Destinia": 1,        # Destinia: +1€/notte
-}
+@st.cache_data(show_spinner=False, max_entries=4)
+def get_calibration_matches(observations_mtime, last_shop_ts):
+    """Osservazioni associate alle tariffe archiviate; si ricalcola solo se cambiano il file o l'archivio"""
+    conn = rate_store.connect()
+    try:
+        return calibrate.match_observations(conn, calibrate.load_observations())
+    finally:
+        conn.close()
 
-def process_xotelo_response(response, hotel_name, num_nights=1, adults=2, children_count=0, rooms=1, currency="EUR"):
-    if response.get("error") is not None or response.get("result") is None:
-        return pd.DataFrame([{
-            "hotel": hotel_name,
-            "ota": "N/A",
-            "ota_code": "N/A",
-            "price": 0,
-            "price_raw": 0,
-            "price_net": 0,
-            "tax": 0,
-            "rounding_correction": 0,
-            "price_total": 0,
-            "price_total_raw": 0,
-            "currency": currency,
-            "check_in": "",
-            "check_out": "",
-            "timestamp": 0,
-            "available": False,
-            "message": "Dati non disponibili/sold out",
-            "adults": adults,
-            "children": children_count,
-            "rooms": rooms
-        }])
-    
-    rates = response.get("result", {}).get("rates", [])
-    check_in = response.get("result", {}).get("chk_in", "")
-    check_out = response.get("result", {}).get("chk_out", "")
-    
-    if not rates:
-        return pd.DataFrame([{
-            "hotel": hotel_name,
-            "ota": "N/A",
-            "ota_code": "N/A",
-            "price": 0,
-            "price_raw": 0,
-            "price_net": 0,
-            "tax": 0,
-            "rounding_correction": 0,
-            "price_total": 0,
-            "price_total_raw": 0,
-            "currency": currency,
-            "check_in": check_in,
-            "check_out": check_out,
-            "timestamp": response.get("timestamp", 0),
-            "available": False,
-            "message": "Dati non disponibili/sold out",
-            "adults": adults,
-            "children": children_count,
-            "rooms": rooms
-        }])
-    
-    data = []
-    # Filtriamo Traveloka dai risultati
-    for rate in rates:
-        if "traveloka" not in rate.get("name", "").lower():  # Escludiamo Traveloka
-            rate_net = rate.get("rate", 0)
-            tax = rate.get("tax", 0)
-            ota_code = rate.get("code", "")
-            rounding_correction = OTA_ROUNDING_CORRECTIONS.get(ota_code, 0)
-            price_per_night_raw = rate_net + tax  # Prezzo API grezzo (rate + tax)
-            price_per_night_corrected = price_per_night_raw + rounding_correction  # Prezzo corretto
-            
-            data.append({
-                "hotel": hotel_name,
-                "ota": rate.get("name", ""),
-                "ota_code": ota_code,
-                "price_raw": price_per_night_raw,
-                "price": price_per_night_corrected,
-                "price_net": rate_net,
-                "tax": tax,
-                "rounding_correction": rounding_correction,
-                "price_total_raw": price_per_night_raw * num_nights,
-                "price_total": price_per_night_corrected * num_nights,
-                "currency": currency,
-                "check_in": check_in,
-                "check_out": check_out,
-                "timestamp": response.get("timestamp", 0),
-                "available": True,
-                "message": "",
-                "adults": adults,
-                "children": children_count,
-                "rooms": rooms
-            })
-    
-    return pd.DataFrame(data)
+@st.cache_data(ttl=600, show_spinner=False, max_entries=8)
+def get_analytics_views(engine, exported_at):
+    """Colonne delle viste di analisi, ricalcolate dopo una nuova copia Parquet (o dopo il TTL)"""
+    import analytics
+    return analytics.describe_views(engine)
 
-def process_heatmap_response(response, hotel_name):
-    if response.get("error") is not None or response.get("result") is None:
-        return None
-    
-    heatmap_data = response.get("result", {}).get("heatmap", {})
-    
-    if not heatmap_data:
-        return None
-    
-    average_days = heatmap_data.get("average_price_days", [])
-    cheap_days = heatmap_data.get("cheap_price_days", [])
-    high_days = heatmap_data.get("high_price_days", [])
-    
-    formatted_average_days = [datetime.strptime(date, "%Y-%m-%d") for date in average_days]
-    formatted_cheap_days = [datetime.strptime(date, "%Y-%m-%d") for date in cheap_days]
-    formatted_high_days = [datetime.strptime(date, "%Y-%m-%d") for date in high_days]
-    
-    all_dates = []
-    
-    for date in formatted_cheap_days:
-        all_dates.append({
-            "hotel": hotel_name,
-            "date": date,
-            "price_level": "Economico",
-            "level_value": 1
-        })
-    
-    for date in formatted_average_days:
-        all_dates.append({
-            "hotel": hotel_name,
-            "date": date,
-            "price_level": "Medio",
-            "level_value": 2
-        })
-    
-    for date in formatted_high_days:
-        all_dates.append({
-            "hotel": hotel_name,
-            "date": date,
-            "price_level": "Alto",
-            "level_value": 3
-        })
-    
-    if all_dates:
-        df = pd.DataFrame(all_dates)
-        return {
-            "hotel": hotel_name,
-            "timestamp": response.get("timestamp", 0),
-            "check_out": response.get("result", {}).get("chk_out", ""),
-            "data": df,
-            "ranges": {
-                "cheap": formatted_cheap_days,
-                "average": formatted_average_days,
-                "high": formatted_high_days
-            }
-        }
-    
-    return None
+@st.cache_resource
+def get_job_threads():
+    """Thread dei job di shop avviati da questo processo, per id del job"""
+    return {}
 
-def process_hotel_list_response(response):
-    if response.get("error") is not None or response.get("result") is None:
-        return None
+def start_shop_job(job):
+    """Esegue il job in un thread in background (se non è già in esecuzione)"""
+    threads = get_job_threads()
+    thread = threads.get(job.job_id)
+    if (thread is not None and thread.is_alive()) or job.is_active():
+        return False
     
-    hotels_list = response.get("result", {}).get("list", [])
+    xotelo_api = get_xotelo_api()
     
-    if not hotels_list:
-        return None
-    
-    data = []
-    for hotel in hotels_list:
+    def run():
         try:
-            hotel_key = hotel.get("key", "")
-            name = hotel.get("name", "")
-            accommodation_type = hotel.get("accommodation_type", "")
-            url = hotel.get("url", "")
-            
-            review_summary = hotel.get("review_summary", {}) or {}
-            rating = review_summary.get("rating", 0) if isinstance(review_summary, dict) else 0
-            review_count = review_summary.get("count", 0) if isinstance(review_summary, dict) else 0
-            
-            price_ranges = hotel.get("price_ranges", {}) or {}
-            min_price = price_ranges.get("minimum", 0) if isinstance(price_ranges, dict) else 0
-            max_price = price_ranges.get("maximum", 0) if isinstance(price_ranges, dict) else 0
-            
-            geo = hotel.get("geo", {}) or {}
-            latitude = geo.get("latitude", 0) if isinstance(geo, dict) else 0
-            longitude = geo.get("longitude", 0) if isinstance(geo, dict) else 0
-            
-            amenities = hotel.get("highlighted_amenities", []) or []
-            amenities_list = [a.get("name", "") for a in amenities] if isinstance(amenities, list) else []
-            amenities_str = ", ".join(filter(None, amenities_list))
-            
-            data.append({
-                "hotel_key": hotel_key,
-                "name": name,
-                "accommodation_type": accommodation_type,
-                "url": url,
-                "rating": rating,
-                "review_count": review_count,
-                "min_price": min_price,
-                "max_price": max_price,
-                "latitude": latitude,
-                "longitude": longitude,
-                "amenities": amenities_str
-            })
-        except Exception as e:
-            continue
-    
-    if data:
-        return pd.DataFrame(data)
-    else:
-        return None
+            job.run(xotelo_api)
+        except Exception:
+            # Lo stato "interrotto" è già nel manifest: il job si riprende dalla dashboard o da CLI
+            pass
+    
+    thread = threading.Thread(target=run, name=f"shop-job-{job.job_id}", daemon=True)
+    threads[job.job_id] = thread
+    thread.start()
+    return True
+
+@st.cache_resource
+def get_prefetcher():
+    return Prefetcher(
+        get_shared_store(),
+        cache_if=search_succeeded,
+        busy=lambda: gate_busy(getattr(get_xotelo_api(), "gate", None))
+    )
+
+def schedule_prefetch(search):
+    """Avvia il prefetch delle ricerche adiacenti, annullando quelle pendenti della sessione"""
+    if "prefetch_cancel" in st.session_state:
+        st.session_state.prefetch_cancel.set()
+    
+    cancel_event = threading.Event()
+    st.session_state.prefetch_cancel = cancel_event
+    
+    store = get_shared_store()
+    xotelo_api = get_xotelo_api()
+    jobs = [
+        (
+            search_cache_key(next_search),
+            lambda cancel_event, next_search=next_search: run_search(
+                xotelo_api, next_search, store=store, archive=False, cancel_event=cancel_event
+            )
+        )
+        for next_search in likely_next_searches(search, st.session_state.get("recent_occupancies", []))
+    ]
+    get_prefetcher().schedule(jobs, cancel_event)
+
+def apply_search_result(result, search, live=True):
+    """Porta in session_state i risultati di una ricerca (aggiornati o archiviati).
 
-def normalize_dataframe(df, num_nights):
-    normalized_df = df.copy()
+    I risultati sono condivisi tra le sessioni: in session_state solo riferimenti.
+    Con `live=False` (snapshot storico) l'indice di mercato non viene aggiornato.
+    Restituisce False se la ricerca non ha prodotto tariffe.
+    """
+    st.session_state.raw_api_responses = result["raw_api_responses"]
+    if result["raw_hotel_data"]:
+        st.session_state.raw_hotel_data = result["raw_hotel_data"]
+    if result["hotel_info"] is not None:
+        st.session_state.hotel_info = result["hotel_info"]
+    
+    if result["rate_data"] is None:
+        return False
+    
+    st.session_state.rate_data = result["rate_data"]
+    st.session_state.hotel_fetched_at = result["hotel_fetched_at"]
+    st.session_state.currency = search["currency"]
+    st.session_state.num_nights = search["num_nights"]
+    st.session_state.occupancy = {
+        "adults": search["adults"],
+        "children": len(search["children_ages"]),
+        "children_ages": list(search["children_ages"]),
+        "rooms": search["rooms"]
+    }
     
-    columns = df.columns.tolist()
+    if result["heatmap_data"]:
+        st.session_state.heatmap_data = result["heatmap_data"]
     
-    if "price" in columns and "price_night" not in columns:
-        normalized_df["price_night"] = normalized_df["price"]
-    elif "price_night" in columns and "price" not in columns:
-        normalized_df["price"] = normalized_df["price_night"]
-    elif "price" not in columns and "price_night" not in columns:
-        if "price_total" in columns:
-            normalized_df["price"] = normalized_df["price_total"] / num_nights
-            normalized_df["price_night"] = normalized_df["price"]
-        else:
-            normalized_df["price"] = 0
-            normalized_df["price_night"] = 0
-            normalized_df["price_total"] = 0
+    if result["sweep_data"] is not None:
+        st.session_state.sweep_data = result["sweep_data"]
+    elif "sweep_data" in st.session_state:
+        del st.session_state["sweep_data"]
     
-    if "price_total" not in columns:
-        if "price" in columns:
-            normalized_df["price_total"] = normalized_df["price"] * num_nights
-        elif "price_night" in columns:
-            normalized_df["price_total"] = normalized_df["price_night"] * num_nights
-        else:
-            normalized_df["price_total"] = 0
+    if not live:
+        return True
     
-    if "is_available" in columns and "available" not in columns:
-        normalized_df["available"] = normalized_df["is_available"]
-    elif "available" in columns and "is_available" not in columns:
-        normalized_df["is_available"] = normalized_df["available"]
-    elif "available" not in columns and "is_available" not in columns:
-        normalized_df["available"] = normalized_df["price"] > 0
-        normalized_df["is_available"] = normalized_df["available"]
+    # Aggiornamento incrementale dell'indice di mercato con le date appena ricercate
+    market_index = get_market_index(
+        search["adults"], len(search["children_ages"]), search["rooms"], search["currency"], search["num_nights"]
+    )
+    market_index.update(result["rate_data"])
+    market_index.update(result["sweep_data"])
     
-    if "message" not in columns:
-        normalized_df["message"] = ""
-        if "available" in columns:
-            normalized_df.loc[~normalized_df["available"], "message"] = "Dati non disponibili/sold out"
-        elif "is_available" in columns:
-            normalized_df.loc[~normalized_df["is_available"], "message"] = "Dati non disponibili/sold out"
+    return True
+
+def format_age(seconds):
+    minutes = int(seconds // 60)
+    if minutes < 1:
+        return "adesso"
+    if minutes < 60:
+        return f"{minutes} min fa"
+    if minutes < 24 * 60:
+        return f"{minutes // 60} h fa"
+    return f"{minutes // (24 * 60)} g fa"
+
+def hotel_age_badges(hotel_fetched_at):
+    """Badge HTML con l'età dei dati di ogni hotel (arancione se oltre il TTL della cache)"""
+    now = datetime.now().timestamp()
+    badges = []
+    for hotel, fetched_at in sorted(hotel_fetched_at.items()):
+        age = now - fetched_at
+        css_class = "age-badge stale" if age > SEARCH_CACHE_TTL_SECONDS else "age-badge"
+        badges.append(f'<span class="{css_class}">{hotel} · {format_age(age)}</span>')
+    return f'<div class="age-badges">{"".join(badges)}</div>'
+
+@st.experimental_fragment(run_every=2)
+def watch_background_refresh():
+    """Sostituisce i dati archiviati con quelli aggiornati appena il refresh in background termina"""
+    pending = st.session_state.get("pending_refresh")
+    if pending is None:
+        return
+    
+    store = get_shared_store()
+    entry = store.get_entry(pending["key"])
+    if entry is not None and entry[0] >= pending["started"]:
+        del st.session_state["pending_refresh"]
+        # Aggiorna la pagina solo se l'utente non ha nel frattempo lanciato un'altra ricerca
+        if st.session_state.get("current_search_key") == pending["key"]:
+            apply_search_result(entry[1], pending["search"])
+            st.session_state.pop("snapshot_as_of", None)
+            st.rerun()
+    elif not store.is_refreshing(pending["key"]):
+        del st.session_state["pending_refresh"]
+        st.warning("Aggiornamento in background non riuscito: vengono mostrati i dati salvati.")
+    else:
+        st.caption("🔄 Aggiornamento delle tariffe in corso in background...")
+
+PARITY_COLORS = {
+    "parità": [46, 125, 50],
+    "disparità": [230, 81, 0],
+    "non rilevato": [150, 150, 150]
+}
+
+@st.experimental_fragment
+def competitor_map(rates_df, price_col, currency_symbol):
+    """Mappa dei competitor: i filtri rieseguono solo questo frammento e aggiornano solo i dati del layer"""
+    import pydeck as pdk
+    from hotel_catalog import DEFAULT_PRICE_TOLERANCE, DEFAULT_RADIUS_KM, hotel_map_points
     
-    if "adults" not in columns:
-        normalized_df["adults"] = 2
-    if "children" not in columns:
-        normalized_df["children"] = 0
-    if "rooms" not in columns:
-        normalized_df["rooms"] = 1
+    hotel_index = get_hotel_index()
     
-    # Gestione colonne raw per correzione arrotondamenti
-    if "price_raw" not in columns:
-        normalized_df["price_raw"] = normalized_df["price"]
-    if "price_total_raw" not in columns:
-        normalized_df["price_total_raw"] = normalized_df["price_raw"] * num_nights
-    if "rounding_correction" not in columns:
-        normalized_df["rounding_correction"] = 0
-    if "price_net" not in columns:
-        normalized_df["price_net"] = normalized_df["price_raw"]
-    if "tax" not in columns:
-        normalized_df["tax"] = 0
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        radius_km = st.slider("Raggio (km)", 1, 100, DEFAULT_RADIUS_KM, key="map_radius")
+    with col2:
+        min_rating = st.slider("Rating minimo", 0.0, 5.0, 0.0, 0.5, key="map_min_rating")
+    with col3:
+        similar_price = st.checkbox("Solo fascia di prezzo simile", value=False, key="map_similar_price")
+    
+    reference = hotel_index.locate(DEFAULT_REFERENCE_HOTEL)
+    if reference is not None:
+        hotels = hotel_index.comp_set(
+            DEFAULT_REFERENCE_HOTEL, radius_km, min_rating, DEFAULT_PRICE_TOLERANCE if similar_price else None
+        )
+        hotels = pd.concat([hotel_index.hotels.iloc[[reference]], hotels], ignore_index=True)
+        center = hotel_index.hotels.iloc[reference]
+    else:
+        st.caption(f"{DEFAULT_REFERENCE_HOTEL} non è nel catalogo: vengono mostrati tutti gli hotel.")
+        hotels = hotel_index.hotels
+        center = hotels[["latitude", "longitude"]].mean()
+    
+    # Un punto per hotel, già aggregato: al browser arriva un solo layer con poche colonne
+    points = hotel_map_points(hotels, rates_df, price_col)
+    points["color"] = points["parity"].map(PARITY_COLORS)
+    if reference is not None:
+        points.at[0, "color"] = [21, 101, 192]
+    points["label"] = (
+        currency_symbol + points["price"].map("{:.2f}".format) + "/notte · "
+        + points["otas"].astype(str) + " OTA · scarto " + points["spread_pct"].map("{:.1f}".format) + "%"
+    ).where(points["price"].notna(), "Fascia TripAdvisor: " + points["price_range"])
+    
+    layer = pdk.Layer(
+        "ScatterplotLayer",
+        id="competitor-prices",
+        data=points[["longitude", "latitude", "name", "parity", "label", "color"]],
+        get_position=["longitude", "latitude"],
+        get_fill_color="color",
+        get_radius=8,
+        radius_units="pixels",
+        pickable=True,
+        auto_highlight=True
+    )
+    # Vista iniziale fissa (dipende solo dal centro): cambiando i filtri la mappa mantiene zoom e posizione
+    view_state = pdk.ViewState(latitude=float(center["latitude"]), longitude=float(center["longitude"]), zoom=10)
+    st.pydeck_chart(pdk.Deck(
+        layers=[layer],
+        initial_view_state=view_state,
+        map_style=None,
+        tooltip={"html": "<b>{name}</b><br/>{parity}<br/>{label}"}
+    ))
+    
+    counts = points["parity"].value_counts()
+    st.caption(
+        f"{len(points)} hotel · parità {counts.get('parità', 0)} · disparità {counts.get('disparità', 0)} "
+        f"· non rilevati {counts.get('non rilevato', 0)} (catalogo di {len(hotel_index)} hotel)."
+    )
+
+@st.experimental_fragment(run_every=2)
+def shop_jobs_panel():
+    """Avanzamento dei job di shop letto dai manifest (sopravvive a refresh e riavvii)"""
+    jobs = list_jobs()[:5]
+    if not jobs:
+        st.caption("Nessun job di shop avviato.")
+        return
+    
+    for job in jobs:
+        p = job.progress()
+        params = job.manifest["params"]
+        label = JOB_STATUS_LABELS.get(p["status"], p["status"])
+        st.progress(
+            p["done"] / p["total"] if p["total"] else 1.0,
+            text=(
+                f"{params['first_arrival']} +{params['days']} giorni, {params['num_nights']} notti, "
+                f"{params['currency']} · {label} · {p['done']}/{p['total']} chiamate"
+                + (f" · ETA {format_eta(p['eta_seconds'])}" if p["status"] == "running" else "")
+            )
+        )
+        if p["status"] in ("interrupted", "failed", "pending"):
+            if st.button("Riprendi", key=f"resume_job_{job.job_id}"):
+                start_shop_job(job)
+                st.rerun()
+
+@st.experimental_fragment(run_every=2)
+def adaptive_concurrency_panel():
+    """Finestra di concorrenza adattiva e stato dei circuit breaker del client Xotelo, aggiornati dal vivo"""
+    gate = getattr(get_xotelo_api(), "gate", None)
+    if gate is None:
+        st.caption("Il client Xotelo in uso non regola la concorrenza.")
+        return
+    
+    snapshot = gate.snapshot()
+    window = snapshot["window"]
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Finestra", f"{window['limit']} / {gate.limiter.max_limit}")
+    col2.metric("Chiamate in corso", window["inflight"])
+    col3.metric("Latenza p95", f"{window['p95_seconds']:.2f} s" if window["p95_seconds"] is not None else "n.d.")
+    col4.metric("Tasso di errore", f"{window['error_rate']:.1%}" if window["error_rate"] is not None else "n.d.")
+    st.caption(
+        f"Chiamate: {window['calls']}, allargamenti della finestra: {window['increases']}, "
+        f"riduzioni (429, 5xx, timeout): {window['decreases']}"
+    )
     
-    return normalized_df
+    if snapshot["breakers"]:
+        st.dataframe(
+            pd.DataFrame([
+                {
+                    "Endpoint": breaker["endpoint"],
+                    "Circuito": BREAKER_STATE_LABELS[breaker["state"]],
+                    "Fallimenti recenti": breaker["failures"],
+                    "Nuovo tentativo tra (s)": round(breaker["retry_in"]),
+                    "Aperture": breaker["opened"],
+                    "Chiamate rifiutate": breaker["rejected"]
+                }
+                for breaker in snapshot["breakers"]
+            ]),
+            use_container_width=True,
+            hide_index=True
+        )
 
 def rate_checker_app():
     st.title("Rate Checker VOI Alimini (Beta)")
@@ -687,9 +436,17 @@ def rate_checker_app():
     
     currency = st.sidebar.selectbox(
         "Valuta",
-        ["EUR", "USD", "GBP", "CAD", "CHF", "AUD", "JPY", "CNY", "INR", "THB", "BRL", "HKD", "RUB", "BZD"],
+        SUPPORTED_CURRENCIES,
         index=0
     )
+    exact_currency = st.sidebar.checkbox(
+        "Prezzi esatti nella valuta OTA",
+        value=False,
+        help=f"Ricerca le tariffe direttamente nella valuta selezionata (nuove chiamate API) invece di "
+             f"convertire quelle in {BASE_CURRENCY} con la tabella dei cambi"
+    )
+    # Senza cambio disponibile si ricerca comunque nella valuta selezionata
+    fetch_currency = currency if exact_currency or fx_factor(BASE_CURRENCY, currency) is None else BASE_CURRENCY
     
     competitors = list(hotel_keys.keys())
     selected_hotels = st.sidebar.multiselect(
@@ -713,7 +470,7 @@ def rate_checker_app():
         st.sidebar.markdown(
             f"""
             <div class="info-banner">
-                <i class="fas fa-calendar-alt"></i>
+                {load_icon("calendar")}
                 <div class="info-banner-text">
                     Durata soggiorno: <span class="info-banner-value">{num_nights} {'notte' if num_nights == 1 else 'notti'}</span>
                 </div>
@@ -722,6 +479,14 @@ def rate_checker_app():
             unsafe_allow_html=True
         )
     
+    sweep_days = st.sidebar.number_input(
+        "Date di arrivo da analizzare",
+        min_value=1,
+        max_value=60,
+        value=1,
+        help="Con valori maggiori di 1 vengono ricercate anche le date di arrivo successive (stessa durata) per il calendario prezzi"
+    )
+    
     st.sidebar.header("Occupazione")
     
     col1, col2 = st.sidebar.columns(2)
@@ -755,7 +520,7 @@ def rate_checker_app():
     st.sidebar.markdown(
         f"""
         <div class="info-banner">
-            <i class="fas fa-users"></i>
+            {load_icon("users")}
             <div class="info-banner-text">
                 Configurazione: <span class="info-banner-value">{occupancy_summary}</span>
             </div>
@@ -791,8 +556,37 @@ def rate_checker_app():
             help="Mostra i prezzi originali dall'API senza correzione, per confronto"
         )
     
+    prefetch_enabled = st.sidebar.checkbox(
+        "Prefetch ricerche successive",
+        value=False,
+        help="Dopo ogni ricerca recupera in background la settimana precedente/successiva e le ultime occupazioni usate"
+    )
+    
+    serve_stale = st.sidebar.checkbox(
+        "Mostra subito i dati salvati",
+        value=True,
+        help="Se i risultati della ricerca non sono recenti mostra subito gli ultimi salvati e li aggiorna in background"
+    )
+    
+    snapshot_enabled = st.sidebar.checkbox(
+        "Snapshot storico",
+        value=False,
+        help="Mostra le tariffe come erano note in un momento passato, dallo storico salvato (nessuna chiamata API)"
+    )
+    snapshot_as_of = None
+    if snapshot_enabled:
+        col_date, col_time = st.sidebar.columns(2)
+        snapshot_date = col_date.date_input(
+            "Dati al",
+            value=datetime.now().date() - timedelta(days=1),
+            max_value=datetime.now().date(),
+            key="snapshot_date"
+        )
+        snapshot_time = col_time.time_input("Ora", value=datetime.strptime("23:59", "%H:%M").time(), key="snapshot_time")
+        snapshot_as_of = datetime.combine(snapshot_date, snapshot_time).timestamp()
+    
     if st.sidebar.button("Cancella dati salvati", key="clear_data"):
-        keys_to_clear = ["rate_data", "heatmap_data", "hotel_info", "raw_hotel_data", "raw_api_responses"]
+        keys_to_clear = ["rate_data", "snapshot_as_of", "hotel_fetched_at", "pending_refresh", "sweep_data", "los_matrix", "heatmap_data", "hotel_info", "raw_hotel_data", "raw_api_responses", "sql_result"]
         for key in keys_to_clear:
             if key in st.session_state:
                 del st.session_state[key]
@@ -810,191 +604,136 @@ def rate_checker_app():
         price_total_col = "price_total_raw"
     price_description = f"{'totali per ' + str(num_nights) + ' notti' if use_total_price else 'per notte'}"
     
-    if st.sidebar.button("Cerca tariffe", key="search_rates"):
-        xotelo_api = XoteloAPI()
+    search = {
+        "hotels": tuple(selected_hotels),
+        "check_in": check_in_date.strftime("%Y-%m-%d"),
+        "check_out": check_out_date.strftime("%Y-%m-%d"),
+        "num_nights": num_nights,
+        "sweep_days": int(sweep_days),
+        "adults": int(num_adults),
+        "children_ages": tuple(children_ages) if has_children else (),
+        "rooms": int(num_rooms),
+        "currency": fetch_currency
+    }
+    
+    search_clicked = st.sidebar.button("Cerca tariffe", key="search_rates")
+    # All'apertura della dashboard vengono caricati subito gli ultimi dati salvati
+    autoload = serve_stale and "rate_data" not in st.session_state and not st.session_state.get("autoloaded")
+    
+    if search_clicked and snapshot_as_of is not None:
+        # Snapshot storico: ultimo shop di ogni soggiorno non successivo alla data indicata
+        result = load_stored_search(search, as_of=snapshot_as_of)
+        if result is not None and apply_search_result(result, search, live=False):
+            st.session_state.snapshot_as_of = snapshot_as_of
+            for key in ["pending_refresh", "heatmap_data", "los_matrix"]:
+                st.session_state.pop(key, None)
+        else:
+            st.error("Nessuna tariffa archiviata per questa ricerca alla data indicata.")
+    
+    elif search_clicked or autoload:
+        st.session_state.autoloaded = True
         
-        with st.spinner(f"Recupero tariffe e dati per {occupancy_summary}..."):
-            all_data = []
-            all_heatmap_data = []
-            all_raw_hotel_data = {}
-            
-            # Inizializza il dizionario delle risposte API
-            if "raw_api_responses" not in st.session_state:
-                st.session_state.raw_api_responses = {}
-            
-            progress_bar = st.progress(0)
-            status_text = st.empty()
-            
-            for i, hotel in enumerate(selected_hotels):
-                progress = int(100 * i / (4 * len(selected_hotels)))
-                progress_bar.progress(progress)
-                status_text.text(f"Elaborazione tariffe per {hotel}... ({i+1}/{len(selected_hotels)})")
-                
-                hotel_key = hotel_keys.get(hotel, "")
-                if hotel_key:
-                    response = xotelo_api.get_rates(
-                        hotel_key,
-                        check_in_date.strftime("%Y-%m-%d"),
-                        check_out_date.strftime("%Y-%m-%d"),
-                        adults=num_adults,
-                        children_ages=children_ages if has_children else None,
-                        rooms=num_rooms,
-                        currency=currency
-                    )
-                    
-                    # Salva la risposta grezza per il debug
-                    st.session_state.raw_api_responses[f"rates_{hotel}"] = response
-                    
-                    df = process_xotelo_response(
-                        response, 
-                        hotel,
-                        num_nights,
-                        num_adults,
-                        len(children_ages) if has_children else 0,
-                        num_rooms,
-                        currency
-                    )
-                    
-                    all_data.append(df)
-            
-            for i, hotel in enumerate(selected_hotels):
-                progress = int(25 + 100 * i / (4 * len(selected_hotels)))
-                progress_bar.progress(progress)
-                status_text.text(f"Elaborazione heatmap per {hotel}... ({i+1}/{len(selected_hotels)})")
-                
-                hotel_key = hotel_keys.get(hotel, "")
-                if hotel_key:
-                    heatmap_response = xotelo_api.get_heatmap(
-                        hotel_key,
-                        check_out_date.strftime("%Y-%m-%d")
-                    )
-                    
-                    # Salva la risposta grezza per il debug
-                    st.session_state.raw_api_responses[f"heatmap_{hotel}"] = heatmap_response
-                    
-                    heatmap_data = process_heatmap_response(heatmap_response, hotel)
-                    if heatmap_data:
-                        all_heatmap_data.append(heatmap_data)
-            
-            status_text.text("Recupero informazioni hotel dalla località...")
-            progress_bar.progress(50)
-            
-            try:
-                hotel_list_response = xotelo_api.get_hotel_list(
-                    location_key,
-                    limit=100,
-                    sort="best_value"
+        # Una nuova ricerca annulla i prefetch pendenti della sessione
+        if "prefetch_cancel" in st.session_state:
+            st.session_state.prefetch_cancel.set()
+        
+        store = get_shared_store()
+        key = search_cache_key(search)
+        st.session_state.current_search_key = key
+        result = store.get(key)
+        stale = False
+        
+        if result is None and serve_stale:
+            # Stale-while-revalidate: risultato scaduto in memoria o ultimo shop archiviato
+            entry = store.get_entry(key)
+            stale_result = entry[1] if entry is not None else load_stored_search(search)
+            if stale_result is not None:
+                st.session_state.pending_refresh = {"key": key, "search": search, "started": time.time()}
+                xotelo_api = get_xotelo_api()
+                store.refresh_in_background(
+                    key, lambda: run_search(xotelo_api, search, store=store), cache_if=search_succeeded
                 )
+                result = stale_result
+                stale = True
+        
+        if result is None and search_clicked:
+            with st.spinner(f"Recupero tariffe e dati per {occupancy_summary}..."):
+                progress_bar = st.progress(0)
+                status_text = st.empty()
                 
-                # Salva la risposta grezza per il debug
-                st.session_state.raw_api_responses["hotel_list"] = hotel_list_response
-                
-                hotel_info_df = process_hotel_list_response(hotel_list_response)
-                
-                if hotel_info_df is not None:
-                    all_raw_hotel_data["location_search"] = hotel_info_df.to_dict()
-                
-                individual_hotel_data = []
-                
-                for idx, (hotel_name, hotel_key) in enumerate(hotel_keys.items()):
-                    progress = int(75 + 25 * idx / len(hotel_keys))
+                def update_progress(progress, text):
                     progress_bar.progress(progress)
-                    status_text.text(f"Recupero rating per {hotel_name}...")
-                    
-                    location_id = hotel_key.split("-")[0]
-                    
-                    try:
-                        single_hotel_response = xotelo_api.get_hotel_list(
-                            location_id,
-                            limit=30, 
-                            sort="best_value"
-                        )
-                        
-                        # Salva la risposta grezza per il debug
-                        st.session_state.raw_api_responses[f"hotel_list_{hotel_name}"] = single_hotel_response
-                        
-                        single_hotel_df = process_hotel_list_response(single_hotel_response)
-                        
-                        if single_hotel_df is not None:
-                            all_raw_hotel_data[f"search_{hotel_name}"] = single_hotel_df.to_dict()
-                            
-                            match_hotel = single_hotel_df[single_hotel_df["hotel_key"] == hotel_key]
-                            if not match_hotel.empty:
-                                match_hotel = match_hotel.copy()
-                                match_hotel["our_hotel_name"] = hotel_name
-                                individual_hotel_data.append(match_hotel)
-                            else:
-                                st.warning(f"Hotel {hotel_name} (chiave: {hotel_key}) non trovato nei risultati di ricerca.")
-                    except Exception as e:
-                        st.warning(f"Errore nel recupero dei dati per {hotel_name}: {str(e)}")
-                
-                st.session_state.raw_hotel_data = all_raw_hotel_data
+                    status_text.text(text)
                 
-                merged_hotel_info = None
-                
-                if individual_hotel_data:
-                    individual_df = pd.concat(individual_hotel_data, ignore_index=True)
-                    if hotel_info_df is not None and not hotel_info_df.empty:
-                        hotel_info_df["our_hotel_name"] = hotel_info_df["hotel_key"].apply(
-                            lambda x: hotel_keys.get(x, "")
-                        )
-                        merged_hotel_info = pd.concat([individual_df, hotel_info_df], ignore_index=True)
-                        merged_hotel_info = merged_hotel_info.drop_duplicates(subset=["hotel_key"])
-                    else:
-                        merged_hotel_info = individual_df
-                elif hotel_info_df is not None:
-                    hotel_key_to_name = {v: k for k, v in hotel_keys.items()}
-                    hotel_info_df["our_hotel_name"] = hotel_info_df["hotel_key"].apply(
-                        lambda x: hotel_key_to_name.get(x, "")
-                    )
-                    merged_hotel_info = hotel_info_df
-                
-                if merged_hotel_info is not None:
-                    filtered_hotel_info = merged_hotel_info[merged_hotel_info["our_hotel_name"] != ""].copy()
-                    if not filtered_hotel_info.empty:
-                        st.session_state.hotel_info = filtered_hotel_info
+                result = store.get_or_compute(
+                    key,
+                    lambda: run_search(get_xotelo_api(), search, progress=update_progress, store=store),
+                    cache_if=search_succeeded
+                )
                 
-            except Exception as e:
-                st.warning(f"Non è stato possibile recuperare le informazioni degli hotel: {str(e)}")
+                progress_bar.progress(100)
+                status_text.text("Elaborazione completata!")
+        
+        if result is not None:
+            # Un risultato calcolato dal prefetch entra nello storico quando viene usato
+            archive_search(result)
+            for message in result["messages"]:
+                st.warning(message)
             
-            progress_bar.progress(100)
-            status_text.text("Elaborazione completata!")
+            st.session_state.recent_occupancies = remember_occupancy(
+                st.session_state.get("recent_occupancies", []),
+                search
+            )
+            if prefetch_enabled:
+                schedule_prefetch(search)
             
-            if all_data:
-                combined_df = pd.concat(all_data, ignore_index=True)
-                
-                normalized_df = normalize_dataframe(combined_df, num_nights)
-                
-                st.session_state.rate_data = normalized_df
-                st.session_state.currency = currency
-                st.session_state.num_nights = num_nights
-                st.session_state.occupancy = {
-                    "adults": num_adults,
-                    "children": len(children_ages) if has_children else 0,
-                    "children_ages": children_ages if has_children else [],
-                    "rooms": num_rooms
-                }
-                
-                if all_heatmap_data:
-                    st.session_state.heatmap_data = all_heatmap_data
-                
+            if apply_search_result(result, search):
+                st.session_state.pop("snapshot_as_of", None)
+                normalized_df = result["rate_data"]
                 available_hotels = normalized_df[normalized_df["available"]]["hotel"].unique()
                 unavailable_hotels = normalized_df[~normalized_df["available"]]["hotel"].unique()
                 
                 if len(unavailable_hotels) > 0:
                     st.warning(f"Hotel non disponibili: {', '.join(unavailable_hotels)}")
                 
-                st.success(f"Dati tariffari recuperati con successo per {len(available_hotels)} hotel!")
+                if stale:
+                    st.info(
+                        f"Mostrati gli ultimi dati salvati per {len(available_hotels)} hotel: "
+                        "le tariffe vengono aggiornate in background."
+                    )
+                else:
+                    st.success(f"Dati tariffari recuperati con successo per {len(available_hotels)} hotel!")
+                    
+                    age_minutes = int((datetime.now().timestamp() - result["fetched_at"]) // 60)
+                    if age_minutes > 0:
+                        st.caption(f"Risultati condivisi da una ricerca identica di {age_minutes} minuti fa.")
+                
+                events = result["events"]
+                if events is not None and not events.empty:
+                    drops = events[events["event_type"] == "price_drop"]
+                    st.info(
+                        f"Rilevate {len(events)} variazioni rispetto all'ultima ricerca "
+                        f"({len(drops)} cali oltre il {alerts.DEFAULT_DROP_THRESHOLD_PCT:.0f}%)."
+                    )
             else:
                 st.error("Nessun dato recuperato. Verifica le chiavi degli hotel e riprova.")
     
+    if "pending_refresh" in st.session_state:
+        watch_background_refresh()
+    
     if "rate_data" in st.session_state:
         df = st.session_state.rate_data
         
-        df = normalize_dataframe(df, num_nights)
-        st.session_state.rate_data = df
+        # Copia locale al rerun: il DataFrame in sessione può essere condiviso tra sessioni.
+        # La tabella delle correzioni viene riapplicata in blocco, senza rielaborare le risposte
+        df = apply_corrections(normalize_dataframe(df, num_nights), num_nights)
         
-        current_currency = st.session_state.currency
+        # Valuta in cui sono state ricercate le tariffe e valuta di visualizzazione
+        data_currency = st.session_state.currency
+        fx_rate = fx_factor(data_currency, currency)
+        fx_missing = fx_rate is None
+        current_currency = data_currency if fx_missing else currency
+        fx_rate = 1.0 if fx_missing else fx_rate
         
         saved_occupancy = st.session_state.get("occupancy", {
             "adults": 2,
@@ -1009,6 +748,16 @@ def rate_checker_app():
             f" in {saved_occupancy['rooms']} {'camera' if saved_occupancy['rooms'] == 1 else 'camere'}"
         )
         
+        if st.session_state.get("snapshot_as_of"):
+            st.info(
+                f"Snapshot storico: tariffe note al "
+                f"{datetime.fromtimestamp(st.session_state.snapshot_as_of).strftime('%d/%m/%Y %H:%M')} "
+                "(ultimo shop precedente di ogni soggiorno). Clicca 'Cerca tariffe' senza snapshot per i dati attuali."
+            )
+        
+        if st.session_state.get("hotel_fetched_at"):
+            st.markdown(hotel_age_badges(st.session_state.hotel_fetched_at), unsafe_allow_html=True)
+        
         current_occupancy_different = (
             num_adults != saved_occupancy['adults'] or
             (len(children_ages) if has_children else 0) != saved_occupancy['children'] or
@@ -1021,10 +770,14 @@ def rate_checker_app():
                 "Clicca 'Cerca tariffe' per aggiornare i dati con la nuova occupazione."
             )
         
-        if current_currency != currency:
+        if fx_missing:
             st.warning(
-                f"La valuta selezionata ({currency}) è diversa da quella nei dati visualizzati ({current_currency}). "
-                "Clicca 'Cerca tariffe' per aggiornare i dati con la nuova valuta."
+                f"La valuta selezionata ({currency}) è diversa da quella nei dati visualizzati ({data_currency}) "
+                "e manca il cambio. Clicca 'Cerca tariffe' per aggiornare i dati con la nuova valuta."
+            )
+        elif exact_currency and data_currency != currency:
+            st.info(
+                f"Prezzi convertiti da {data_currency}: clicca 'Cerca tariffe' per i prezzi esatti in {currency} delle OTA."
             )
         
         if "num_nights" in st.session_state and st.session_state.num_nights != num_nights:
@@ -1035,6 +788,14 @@ def rate_checker_app():
             st.session_state.rate_data = df
             st.info(f"Prezzi totali aggiornati per {num_nights} notti")
         
+        if data_currency != current_currency:
+            # Conversione locale dopo le correzioni (definite nella valuta di ricerca)
+            df = convert_rates(df, current_currency)
+            st.caption(
+                f"Prezzi convertiti da {data_currency} a {current_currency} al cambio del "
+                f"{fx_as_of([data_currency, current_currency]) or 'n.d.'} (1 {data_currency} = {fx_rate:.4f} {current_currency})."
+            )
+        
         currency_symbols = {
             "EUR": "€", "USD": "$", "GBP": "£", "CAD": "CA$", "CHF": "CHF", 
             "AUD": "A$", "JPY": "¥", "CNY": "¥", "INR": "₹", "THB": "฿", 
@@ -1042,9 +803,21 @@ def rate_checker_app():
         }
         currency_symbol = currency_symbols.get(current_currency, current_currency)
         
-        tabs = st.tabs(["Confronto Tariffe", "Calendari Prezzi", "Analisi Comparativa", "Rating e Qualità", "Debug"])
+        # Navigazione a viste: st.tabs esegue ad ogni rerun il contenuto di tutte le schede,
+        # qui invece viene calcolata e renderizzata solo la vista selezionata
+        views = ["Confronto Tariffe", "Calendari Prezzi", "Analisi Comparativa", "Rating e Qualità", "Indice di Mercato", "Mappa Competitor", "Matrice LOS", "Analisi SQL", "Debug"]
+        selected_view = st.radio(
+            "Vista",
+            views,
+            horizontal=True,
+            key="selected_view",
+            label_visibility="collapsed"
+        )
         
-        with tabs[0]:
+        if selected_view == "Confronto Tariffe":
+            # Plotly viene importato solo dalle viste che disegnano grafici
+            import plotly.express as px
+            
             st.header(f"Confronto tariffe tra OTA (Prezzi {price_description})")
             
             available_hotels = df[df["available"]]["hotel"].unique()
@@ -1154,10 +927,130 @@ def rate_checker_app():
             else:
                 st.warning("Nessun hotel disponibile per le date selezionate.")
         
-        with tabs[1]:
+        if selected_view == "Calendari Prezzi":
+            import plotly.graph_objects as go
+            
             st.header("Calendari Prezzi - Heatmap")
             
-            if "heatmap_data" in st.session_state and st.session_state.heatmap_data:
+            sweep_df = st.session_state.get("sweep_data")
+            if sweep_df is not None:
+                # Come per df: copia locale con la tabella delle correzioni corrente
+                sweep_nights = st.session_state.get("num_nights", num_nights)
+                sweep_df = apply_corrections(normalize_dataframe(sweep_df, sweep_nights), sweep_nights)
+            cube = None
+            if sweep_df is None:
+                # Cubo su disco (se costruito): lettura solo delle sezioni necessarie
+                cube = get_cube_reader().get(data_currency, st.session_state.get("num_nights", num_nights))
+                if cube is not None and cube.occupancy(saved_occupancy["adults"], saved_occupancy["children"], saved_occupancy["rooms"]) is None:
+                    cube = None
+                if cube is not None:
+                    conn = rate_store.connect()
+                    try:
+                        stale = cube.is_stale(conn)
+                    finally:
+                        conn.close()
+                    if stale:
+                        # Shop delle date del cubo archiviati dopo la costruzione: il cubo non li contiene
+                        st.info(
+                            "Il cubo tariffe su disco è precedente all'ultimo shop archiviato per queste date: "
+                            "dati letti dall'archivio. Ricostruirlo con `python rate_cube.py`."
+                        )
+                        cube = None
+            if sweep_df is None and cube is None:
+                try:
+                    sweep_df = load_stored_sweep(saved_occupancy, data_currency, st.session_state.get("num_nights", num_nights))
+                except Exception as e:
+                    st.warning(f"Non è stato possibile leggere lo storico tariffe: {str(e)}")
+            if sweep_df is not None and data_currency != current_currency:
+                sweep_df = convert_rates(sweep_df, current_currency)
+            
+            if cube is not None or (sweep_df is not None and sweep_df.loc[sweep_df["available"], "check_in"].nunique() > 1):
+                heatmap_mode = st.radio(
+                    "Valori",
+                    ["Prezzo minimo", "Differenza vs VOI Alimini"],
+                    horizontal=True,
+                    key="rate_heatmap_mode"
+                )
+                
+                delta_mode = heatmap_mode != "Prezzo minimo"
+                if cube is not None:
+                    matrix = cube.min_price_matrix(
+                        saved_occupancy["adults"],
+                        saved_occupancy["children"],
+                        saved_occupancy["rooms"],
+                        apply_rounding=apply_rounding,
+                        hotels=selected_hotels
+                    )
+                    if matrix is not None:
+                        matrix = matrix.loc[:, matrix.notna().any()] * fx_rate
+                        if delta_mode:
+                            matrix = reference_delta(matrix, "VOI Alimini")
+                else:
+                    matrix = build_rate_heatmap(
+                        sweep_df,
+                        price_per_night_col,
+                        reference_hotel="VOI Alimini" if delta_mode else None
+                    )
+                
+                if matrix is not None and not matrix.empty:
+                    if delta_mode:
+                        z_label = f"VOI Alimini - hotel ({currency_symbol}/notte)"
+                        colorscale = "RdBu_r"
+                    else:
+                        z_label = f"Prezzo minimo ({currency_symbol}/notte)"
+                        colorscale = "RdYlGn_r"
+                    
+                    fig = go.Figure(go.Heatmap(
+                        z=matrix.values,
+                        x=matrix.columns,
+                        y=matrix.index,
+                        colorscale=colorscale,
+                        zmid=0 if delta_mode else None,
+                        hoverongaps=False,
+                        colorbar=dict(title=z_label),
+                        hovertemplate="%{y}<br>%{x|%d/%m/%Y}<br>" + currency_symbol + "%{z:.2f}<extra></extra>"
+                    ))
+                    fig.update_layout(
+                        title=f"{z_label} per data di arrivo ({saved_occupancy['adults']} adulti, {st.session_state.get('num_nights', num_nights)} notti)",
+                        xaxis_title="Data di arrivo",
+                        yaxis_title="Hotel",
+                        height=max(300, 60 * len(matrix.index) + 150)
+                    )
+                    st.plotly_chart(fig, use_container_width=True)
+                    st.caption("Calendario calcolato dai prezzi minimi reali per data di arrivo (ricerca multi-data o storico tariffe).")
+                else:
+                    st.warning("VOI Alimini non ha tariffe nel periodo analizzato: impossibile calcolare la differenza.")
+                
+                if cube is not None:
+                    cube_hotels = [h for h in selected_hotels if h in cube.hotels]
+                    if cube_hotels:
+                        st.subheader("Dettaglio per OTA")
+                        detail_hotel = st.selectbox("Hotel", cube_hotels, key="cube_detail_hotel")
+                        hotel_rates = cube.hotel_slice(
+                            detail_hotel,
+                            saved_occupancy["adults"],
+                            saved_occupancy["children"],
+                            saved_occupancy["rooms"],
+                            apply_rounding=apply_rounding
+                        ).dropna(how="all").dropna(axis=1, how="all") * fx_rate
+                        
+                        if not hotel_rates.empty:
+                            fig = go.Figure([
+                                go.Scatter(x=hotel_rates.index, y=hotel_rates[ota], mode="lines+markers", name=ota)
+                                for ota in hotel_rates.columns
+                            ])
+                            fig.update_layout(
+                                title=f"Prezzo per notte per OTA - {detail_hotel}",
+                                xaxis_title="Data di arrivo",
+                                yaxis_title=f"Prezzo per notte ({currency_symbol})"
+                            )
+                            st.plotly_chart(fig, use_container_width=True)
+                        st.caption(
+                            f"Dal cubo tariffe su disco ({len(cube.hotels)} hotel × {len(cube.dates)} date × {len(cube.otas)} OTA), "
+                            f"aggiornato al {datetime.fromtimestamp(cube.meta['built_at']).strftime('%d/%m/%Y %H:%M')}."
+                        )
+            
+            elif "heatmap_data" in st.session_state and st.session_state.heatmap_data:
                 heatmap_data = st.session_state.heatmap_data
                 
                 available_hotels_heatmap = [data["hotel"] for data in heatmap_data]
@@ -1174,8 +1067,10 @@ def rate_checker_app():
                     if hotel_heatmap:
                         st.subheader(f"Calendario Prezzi per {selected_hotel_heatmap}")
                         
-                        df_heatmap = hotel_heatmap["data"]
-                        df_heatmap["date_str"] = df_heatmap["date"].dt.strftime("%Y-%m-%d")
+                        # I dati heatmap sono condivisi tra sessioni: si lavora su una copia
+                        df_heatmap = hotel_heatmap["data"].assign(
+                            date_str=hotel_heatmap["data"]["date"].dt.strftime("%Y-%m-%d")
+                        )
                         
                         today = datetime.now()
                         start_date = today.replace(day=1)
@@ -1273,8 +1168,32 @@ def rate_checker_app():
                     st.warning("Nessun dato di calendario prezzi disponibile per gli hotel selezionati.")
             else:
                 st.warning("Nessun dato di calendario prezzi disponibile. Effettua una ricerca tariffe per visualizzare i calendari.")
+            
+            with st.expander("Shop esteso in background (riprendibile)"):
+                st.caption(
+                    "Ricerca tutte le date di arrivo indicate a fette salvate nell'archivio man mano che vengono "
+                    "completate: dopo un'interruzione il job riprende solo le date mancanti. "
+                    "Il calendario usa lo storico appena il job avanza."
+                )
+                job_days = st.number_input("Date di arrivo", min_value=1, max_value=365, value=60, key="job_days")
+                if st.button("Avvia shop esteso", key="start_shop_job"):
+                    job = ShopJob.create(job_params(
+                        selected_hotels,
+                        check_in_date.strftime("%Y-%m-%d"),
+                        job_days,
+                        st.session_state.get("num_nights", num_nights),
+                        saved_occupancy["adults"],
+                        saved_occupancy["children_ages"],
+                        saved_occupancy["rooms"],
+                        data_currency
+                    ))
+                    if not start_shop_job(job):
+                        st.info("Il job con questi parametri è già in esecuzione.")
+                shop_jobs_panel()
         
-        with tabs[2]:
+        if selected_view == "Analisi Comparativa":
+            import plotly.express as px
+            
             st.header("Analisi Comparativa")
             
             available_df = df[df["available"]]
@@ -1376,9 +1295,14 @@ def rate_checker_app():
                 st.warning(f"I seguenti hotel non hanno disponibilità: {', '.join(unavailable_hotels)}")
                 st.dataframe(unavailable_df, use_container_width=True)
         
-        with tabs[3]:
+        if selected_view == "Rating e Qualità":
+            import plotly.express as px
+            import plotly.graph_objects as go
+            
             st.header("Rating e Qualità degli Hotel")
             
+            available_df = df[df["available"]]
+            
             if "hotel_info" in st.session_state and not st.session_state.hotel_info.empty:
                 hotel_info_df = st.session_state.hotel_info
                 
@@ -1530,7 +1454,289 @@ def rate_checker_app():
             else:
                 st.warning("Nessun dato di rating disponibile. Effettua una ricerca tariffe per visualizzare i rating.")
         
-        with tabs[4]:
+        if selected_view == "Indice di Mercato":
+            import plotly.graph_objects as go
+            
+            st.header("Indice di mercato dei competitor")
+            st.write(
+                f"Prezzo per notte dei competitor per data di arrivo nei prossimi {DEFAULT_HORIZON_DAYS} giorni "
+                f"(mediana e quartili pesati per rating TripAdvisor) confrontato con {DEFAULT_REFERENCE_HOTEL}."
+            )
+            
+            market_as_of = st.session_state.get("snapshot_as_of")
+            market_index = get_market_index(
+                saved_occupancy["adults"],
+                saved_occupancy["children"],
+                saved_occupancy["rooms"],
+                data_currency,
+                st.session_state.get("num_nights", num_nights),
+                as_of=market_as_of
+            )
+            # Shop archiviati da altri processi (headless, worker, job) dall'ultimo caricamento
+            market_index.refresh()
+            market_index.set_weights(rating_weights(st.session_state.get("hotel_info")))
+            if market_as_of:
+                st.caption(
+                    f"Indice ricostruito con le tariffe archiviate al "
+                    f"{datetime.fromtimestamp(market_as_of).strftime('%d/%m/%Y %H:%M')} (modalità snapshot)."
+                )
+                curve = market_index.curve(start=datetime.fromtimestamp(market_as_of).strftime("%Y-%m-%d"))
+            else:
+                curve = market_index.curve()
+            curve[["q25", "q50", "q75", "reference"]] *= fx_rate
+            
+            if curve["q50"].notna().sum() == 0:
+                st.info(
+                    "Nessuna tariffa dei competitor disponibile per le prossime date. Aumentare le "
+                    "'Date di arrivo da analizzare' o pianificare lo shop headless per popolare l'indice."
+                )
+            else:
+                fig = go.Figure()
+                fig.add_trace(go.Scatter(
+                    x=curve.index, y=curve["q75"], mode="lines", line=dict(width=0),
+                    name="75° percentile", showlegend=False
+                ))
+                fig.add_trace(go.Scatter(
+                    x=curve.index, y=curve["q25"], mode="lines", line=dict(width=0),
+                    fill="tonexty", fillcolor="rgba(15, 115, 120, 0.2)", name="Quartili competitor"
+                ))
+                fig.add_trace(go.Scatter(
+                    x=curve.index, y=curve["q50"], mode="lines+markers",
+                    line=dict(color="#0f7378"), name="Mediana competitor"
+                ))
+                fig.add_trace(go.Scatter(
+                    x=curve.index, y=curve["reference"], mode="lines+markers",
+                    line=dict(color="#e65100"), name=DEFAULT_REFERENCE_HOTEL
+                ))
+                fig.update_layout(
+                    title=f"Curva di mercato ({saved_occupancy['adults']} adulti, {st.session_state.get('num_nights', num_nights)} notti)",
+                    xaxis_title="Data di arrivo",
+                    yaxis_title=f"Prezzo per notte ({currency_symbol})",
+                    hovermode="x unified"
+                )
+                st.plotly_chart(fig, use_container_width=True)
+                
+                both = curve.dropna(subset=["q50", "reference"])
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    st.metric("Date coperte", f"{curve['q50'].notna().sum()} / {DEFAULT_HORIZON_DAYS}")
+                with col2:
+                    st.metric("Competitor medi per data", f"{curve.loc[curve['q50'].notna(), 'competitors'].mean():.1f}")
+                with col3:
+                    if not both.empty:
+                        gap_pct = ((both["reference"] - both["q50"]) / both["q50"] * 100).mean()
+                        st.metric(f"{DEFAULT_REFERENCE_HOTEL} vs mediana", f"{gap_pct:+.1f}%")
+                
+                with st.expander("Dati dell'indice"):
+                    st.dataframe(
+                        curve.rename(columns={
+                            "q25": "25° percentile",
+                            "q50": "Mediana",
+                            "q75": "75° percentile",
+                            "reference": DEFAULT_REFERENCE_HOTEL,
+                            "competitors": "Competitor"
+                        }),
+                        use_container_width=True
+                    )
+        
+        if selected_view == "Mappa Competitor":
+            st.header("Mappa dei competitor")
+            st.write(
+                f"Prezzo minimo attuale e parità tra le OTA degli hotel vicini a {DEFAULT_REFERENCE_HOTEL}; "
+                "gli hotel del catalogo non ricercati mostrano la fascia di prezzo TripAdvisor."
+            )
+            
+            if len(get_hotel_index()) == 0:
+                st.info(
+                    "Il catalogo hotel è vuoto: eseguire `python hotel_catalog.py --crawl` per popolarlo "
+                    "con gli hotel delle località configurate."
+                )
+            else:
+                competitor_map(df, price_per_night_col, currency_symbol)
+        
+        if selected_view == "Matrice LOS" and st.session_state.get("snapshot_as_of"):
+            st.header("Matrice arrivo × durata del soggiorno")
+            st.info(
+                "La matrice LOS interroga Xotelo in tempo reale e non è disponibile in modalità snapshot: "
+                "disattivare lo snapshot e ripetere la ricerca per calcolarla."
+            )
+        
+        elif selected_view == "Matrice LOS":
+            import plotly.graph_objects as go
+            
+            st.header("Matrice arrivo × durata del soggiorno")
+            st.write(
+                "Prezzi reali per ogni combinazione di data di arrivo e numero di notti "
+                "(una chiamata API per combinazione, eseguite in parallelo)."
+            )
+            
+            col1, col2 = st.columns(2)
+            with col1:
+                los_arrival_days = st.number_input("Date di arrivo", min_value=1, max_value=31, value=7, key="los_arrival_days")
+            with col2:
+                los_max = st.number_input("Notti massime", min_value=1, max_value=MAX_LOS, value=7, key="los_max")
+            
+            los_hotels = [h for h in df["hotel"].unique() if h in hotel_keys]
+            los_calls = len(los_hotels) * los_arrival_days * los_max
+            st.caption(f"Chiamate API necessarie: {los_calls} ({len(los_hotels)} hotel × {los_arrival_days} arrivi × {los_max} durate)")
+            
+            if st.button("Calcola matrice LOS", key="compute_los"):
+                los_search = {
+                    "hotels": tuple(los_hotels),
+                    "first_arrival": check_in_date.strftime("%Y-%m-%d"),
+                    "arrival_days": int(los_arrival_days),
+                    "max_los": int(los_max),
+                    "adults": saved_occupancy["adults"],
+                    "children_ages": tuple(saved_occupancy["children_ages"]),
+                    "rooms": saved_occupancy["rooms"],
+                    "currency": data_currency
+                }
+                
+                progress_bar = st.progress(0)
+                
+                def update_los_progress(done, total):
+                    progress_bar.progress(int(100 * done / total), text=f"Chiamate completate: {done}/{total}")
+                
+                with st.spinner("Recupero tariffe per tutte le combinazioni arrivo/durata..."):
+                    st.session_state.los_matrix = get_shared_store().get_or_compute(
+                        ("los",) + tuple(sorted(los_search.items())),
+                        lambda: build_los_matrix(
+                            get_xotelo_api(),
+                            los_hotels,
+                            [check_in_date + timedelta(days=d) for d in range(los_arrival_days)],
+                            range(1, los_max + 1),
+                            adults=saved_occupancy["adults"],
+                            children_ages=saved_occupancy["children_ages"],
+                            rooms=saved_occupancy["rooms"],
+                            currency=data_currency,
+                            progress=update_los_progress
+                        )
+                    )
+                progress_bar.empty()
+            
+            los_data = st.session_state.get("los_matrix")
+            if los_data is not None and los_data["hotels"]:
+                value_key = "price" if apply_rounding else "price_raw"
+                
+                los_hotel = st.selectbox("Hotel", los_data["hotels"], key="los_hotel")
+                hotel_matrix = los_slice(los_data, hotel=los_hotel, value=value_key) * fx_rate
+                
+                fig = go.Figure(go.Heatmap(
+                    z=hotel_matrix.values,
+                    x=[f"{n} {'notte' if n == 1 else 'notti'}" for n in hotel_matrix.columns],
+                    y=pd.to_datetime(hotel_matrix.index),
+                    colorscale="RdYlGn_r",
+                    hoverongaps=False,
+                    colorbar=dict(title=f"{currency_symbol}/notte"),
+                    hovertemplate="Arrivo %{y|%d/%m/%Y}<br>%{x}<br>" + currency_symbol + "%{z:.2f}/notte<extra></extra>"
+                ))
+                fig.update_layout(
+                    title=f"Prezzo minimo per notte - {los_hotel}",
+                    xaxis_title="Durata del soggiorno",
+                    yaxis_title="Data di arrivo",
+                    yaxis_autorange="reversed"
+                )
+                st.plotly_chart(fig, use_container_width=True)
+                
+                los_arrival = st.selectbox("Data di arrivo per il confronto tra hotel", los_data["arrivals"], key="los_arrival")
+                arrival_matrix = los_slice(los_data, arrival=los_arrival, value=value_key) * fx_rate
+                
+                fig = go.Figure([
+                    go.Scatter(x=arrival_matrix.columns, y=arrival_matrix.loc[hotel], mode="lines+markers", name=hotel)
+                    for hotel in arrival_matrix.index
+                ])
+                fig.update_layout(
+                    title=f"Prezzo per notte in funzione della durata - arrivo {los_arrival}",
+                    xaxis_title="Notti",
+                    yaxis_title=f"Prezzo per notte ({currency_symbol})"
+                )
+                st.plotly_chart(fig, use_container_width=True)
+                
+                st.caption(f"Matrice calcolata con {los_data['calls']} chiamate API distinte.")
+        
+        if selected_view == "Analisi SQL":
+            # Motore SQL (ed eventualmente DuckDB) caricato solo da questa vista
+            import analytics
+            
+            st.header("Analisi SQL sull'archivio")
+            st.write(
+                "Query SQL ad hoc su storico tariffe, calendario prezzi e info hotel, eseguite direttamente "
+                "sui dati su disco (senza caricarli nella sessione)."
+            )
+            
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                sql_engine = st.selectbox(
+                    "Motore", analytics.available_engines(), format_func=analytics.ENGINE_LABELS.get, key="sql_engine"
+                )
+            with col2:
+                sql_max_rows = st.number_input(
+                    "Righe massime", min_value=1, max_value=analytics.MAX_ROWS_LIMIT,
+                    value=analytics.DEFAULT_MAX_ROWS, step=1000, key="sql_max_rows"
+                )
+            with col3:
+                sql_timeout = st.number_input(
+                    "Durata massima (s)", min_value=1, max_value=600,
+                    value=analytics.DEFAULT_TIMEOUT_SECONDS, key="sql_timeout"
+                )
+            
+            if sql_engine == "duckdb":
+                export = analytics.export_status()
+                if export is None:
+                    st.info("La copia Parquet dell'archivio non è ancora stata creata.")
+                else:
+                    last_search = max(st.session_state.get("hotel_fetched_at", {}).values(), default=0)
+                    stale = (export["last_shop_ts"] or 0) < last_search
+                    st.caption(
+                        f"Copia Parquet aggiornata al {datetime.fromtimestamp(export['exported_at']).strftime('%d/%m/%Y %H:%M')}"
+                        + (" (precedente all'ultima ricerca)" if stale else "")
+                    )
+                if st.button("Aggiorna copia Parquet", key="sql_export"):
+                    with st.spinner("Esportazione dell'archivio in Parquet..."):
+                        started = time.perf_counter()
+                        analytics.export_parquet()
+                    st.success(f"Copia Parquet aggiornata in {time.perf_counter() - started:.1f} s")
+            
+            with st.expander("Viste disponibili"):
+                try:
+                    exported_at = (analytics.export_status() or {}).get("exported_at")
+                    for view, columns in get_analytics_views(sql_engine, exported_at).items():
+                        st.markdown(f"**{view}**: " + ", ".join(f"`{c}`" for c in columns))
+                except analytics.QueryError as e:
+                    st.info(str(e))
+                st.caption(
+                    "`rates`: una riga per tariffa e shop; `latest`: ultima tariffa nota; `shops`: registro delle ricerche; "
+                    "`heatmap`: calendario prezzi; `hotels`: info hotel; `catalog`: catalogo della località. "
+                    "`weekday` è il giorno della settimana dell'arrivo (0 = lunedì)."
+                )
+            
+            sql_query = st.text_area("Query", value=analytics.EXAMPLE_QUERY, height=300, key="sql_query")
+            
+            if st.button("Esegui query", key="sql_run"):
+                try:
+                    st.session_state.sql_result = analytics.run_query(sql_query, sql_engine, sql_max_rows, sql_timeout)
+                except analytics.QueryError as e:
+                    st.session_state.pop("sql_result", None)
+                    st.error(str(e))
+            
+            sql_result = st.session_state.get("sql_result")
+            if sql_result is not None:
+                st.caption(
+                    f"{len(sql_result['data'])} righe in {sql_result['seconds'] * 1000:.0f} ms "
+                    f"con {analytics.ENGINE_LABELS[sql_result['engine']]}"
+                )
+                if sql_result["truncated"]:
+                    st.warning(f"Risultato limitato alle prime {len(sql_result['data'])} righe: aggiungere filtri o aggregazioni.")
+                st.dataframe(sql_result["data"], use_container_width=True, hide_index=True)
+                st.download_button(
+                    "Scarica CSV",
+                    sql_result["data"].to_csv(index=False).encode("utf-8"),
+                    file_name="query.csv",
+                    mime="text/csv",
+                    key="sql_download"
+                )
+        
+        if selected_view == "Debug":
             st.header("Debug e Informazioni Tecniche")
             
             st.subheader("Dati grezzi delle chiamate API Xotelo")
@@ -1618,6 +1824,66 @@ def rate_checker_app():
                         st.warning("Nessun dato disponibile per l'analisi OTA")
             
             # Dettagli API
+            with st.expander("Cache condivisa e prefetch"):
+                store_stats = get_shared_store().stats
+                st.write(
+                    f"Ricerche servite dalla cache: {store_stats['hits']}, "
+                    f"calcolate: {store_stats['misses']}, "
+                    f"in attesa di una ricerca identica già in corso: {store_stats['coalesced']}"
+                )
+                st.json(get_prefetcher().stats)
+            
+            with st.expander("Coalescenza chiamate Xotelo"):
+                flight_stats = get_xotelo_api().single_flight.stats
+                st.write(
+                    f"Richieste: {flight_stats['requests']}, "
+                    f"chiamate effettive a Xotelo: {flight_stats['upstream']}, "
+                    f"chiamate risparmiate (richiesta identica già in corso): {flight_stats['saved']}"
+                )
+
+            with st.expander("Concorrenza adattiva e circuit breaker"):
+                adaptive_concurrency_panel()
+
+            with st.expander("Pianificazione refresh"):
+                st.markdown(
+                    "Intervallo di refresh per hotel e anticipo, scelto dalla frequenza di cambio osservata "
+                    "nello storico per massimizzare i cambi rilevati per chiamata."
+                )
+                refresh_budget = st.number_input(
+                    "Chiamate API al giorno (0 = nessun limite)", min_value=0, value=0, step=100, key="refresh_budget"
+                )
+                conn = rate_store.connect()
+                try:
+                    schedule = refresh_scheduler.build_schedule(conn, refresh_budget or None)
+                finally:
+                    conn.close()
+
+                if schedule.empty:
+                    st.info("Nessun soggiorno futuro nell'archivio tariffe.")
+                else:
+                    calls_per_day = schedule["calls_per_day"].sum()
+                    changes_per_day = schedule["changes_per_day"].sum()
+                    col1, col2, col3 = st.columns(3)
+                    col1.metric("Chiamate previste al giorno", f"{calls_per_day:.0f}")
+                    col2.metric("Cambi rilevati al giorno", f"{changes_per_day:.1f}")
+                    col3.metric("Cambi per chiamata", f"{changes_per_day / calls_per_day:.3f}" if calls_per_day else "n.d.")
+                    st.dataframe(
+                        schedule.rename(columns={
+                            "hotel": "Hotel",
+                            "lead_bucket": "Anticipo",
+                            "slices": "Soggiorni",
+                            "intervals": "Intervalli osservati",
+                            "changes": "Cambi osservati",
+                            "change_rate_per_day": "Cambi al giorno (λ)",
+                            "interval_hours": "Refresh ogni (ore)",
+                            "calls_per_day": "Chiamate al giorno",
+                            "changes_per_day": "Cambi rilevati al giorno"
+                        }),
+                        use_container_width=True,
+                        hide_index=True
+                    )
+                    st.caption("Per accodare i soggiorni da aggiornare: `python refresh_scheduler.py --enqueue`")
+
             with st.expander("Dettagli delle richieste API"):
                 st.markdown("### Parametri utilizzati nelle richieste API")
                 
@@ -1652,13 +1918,64 @@ def rate_checker_app():
             
             # Correzioni arrotondamento
             with st.expander("Correzioni arrotondamento OTA"):
-                st.markdown("### Valori di correzione configurati (€/notte)")
+                st.markdown("### Valori di correzione configurati (per notte)")
                 st.markdown("Questi valori vengono sommati ai prezzi API per compensare gli arrotondamenti per difetto di Xotelo.")
-                corrections_data = []
-                for ota_code, correction in OTA_ROUNDING_CORRECTIONS.items():
-                    corrections_data.append({"Codice OTA": ota_code, "Correzione (€/notte)": f"+{correction}€"})
-                st.dataframe(pd.DataFrame(corrections_data), use_container_width=True)
-                st.info("Per modificare i valori di correzione, editare il dizionario OTA_ROUNDING_CORRECTIONS nel codice sorgente.")
+                corrections_table = load_corrections()[CORRECTION_COLUMNS].rename(columns={
+                    "ota_code": "Codice OTA",
+                    "currency": "Valuta",
+                    "price_min": "Prezzo da",
+                    "price_max": "Prezzo fino a",
+                    "correction": "Correzione per notte"
+                })
+                st.dataframe(corrections_table, use_container_width=True)
+                st.info(
+                    f"Per modificare i valori di correzione, editare la tabella `{os.path.relpath(DEFAULT_CORRECTIONS_PATH, os.path.dirname(os.path.abspath(__file__)))}` "
+                    "(valuta * = tutte le valute; fascia di prezzo sul prezzo API grezzo per notte)."
+                )
+                
+                st.markdown("### Scarti rispetto ai prezzi osservati")
+                if os.path.exists(calibrate.DEFAULT_OBSERVATIONS_PATH):
+                    conn = rate_store.connect()
+                    try:
+                        shop_ts = rate_store.last_shop_ts(conn)
+                    finally:
+                        conn.close()
+                    matched = get_calibration_matches(
+                        os.path.getmtime(calibrate.DEFAULT_OBSERVATIONS_PATH), shop_ts
+                    )
+                    
+                    if matched.empty:
+                        st.warning("Nessun prezzo osservato corrisponde alle tariffe archiviate.")
+                    else:
+                        residual_df = calibrate.residuals(matched)
+                        residual_summary = residual_df.groupby(["ota_code", "currency"])["residual"].agg(
+                            n="count",
+                            media="mean",
+                            deviazione="std",
+                            errore_medio_assoluto=lambda r: r.abs().mean()
+                        ).round(2)
+                        st.dataframe(residual_summary, use_container_width=True)
+                        
+                        import plotly.express as px
+                        fig = px.box(
+                            residual_df,
+                            x="ota_code",
+                            y="residual",
+                            color="currency",
+                            labels={"ota_code": "OTA", "residual": "Osservato - corretto (per notte)", "currency": "Valuta"}
+                        )
+                        fig.add_hline(y=0, line_dash="dash", line_color="gray")
+                        st.plotly_chart(fig, use_container_width=True)
+                    
+                    if os.path.exists(calibrate.DEFAULT_REPORT_PATH):
+                        st.markdown("**Ultima calibrazione** (intervalli di confidenza bootstrap al 95%)")
+                        st.dataframe(pd.read_csv(calibrate.DEFAULT_REPORT_PATH), use_container_width=True)
+                else:
+                    st.info(
+                        "Per calcolare gli scarti salvare i prezzi osservati su TripAdvisor in "
+                        f"`{os.path.relpath(calibrate.DEFAULT_OBSERVATIONS_PATH, os.path.dirname(os.path.abspath(__file__)))}` "
+                        "e ricalibrare la tabella con `python calibrate.py`."
+                    )
     else:
         st.info("Clicca su 'Cerca tariffe' per recuperare i dati tariffari")
     
@@ -1689,4 +2006,5 @@ def rate_checker_app():
     st.sidebar.info("Versione 0.6.0 - Developed by Alessandro Merella with Xotelo API")
 
 if __name__ == "__main__":
+    setup_page()
     rate_checker_app()
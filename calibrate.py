@@ -0,0 +1,261 @@
+"""Calibrazione statistica delle correzioni di arrotondamento.
+
+Confronta i prezzi archiviati nello storico con un file locale di prezzi
+"veri" osservati su TripAdvisor (CSV, prezzo per notte):
+
+    hotel,check_in,check_out,adults,children,rooms,currency,ota_code,price,observed_at
+    VOI Alimini,2026-08-15,2026-08-22,2,0,1,EUR,BookingCom,187.40,2026-07-01T09:30
+
+Ogni osservazione viene associata all'ultimo shop archiviato non successivo
+a `observed_at` (colonna facoltativa: se assente vale l'ultimo shop). Gli
+orari senza fuso sono intesi nell'ora locale (`DEFAULT_OBSERVATIONS_TZ`),
+quelli con fuso esplicito (es. 2026-07-01T09:30+02:00) vengono convertiti. Per
+ogni OTA, valuta ed eventuale fascia di prezzo la correzione è lo scarto
+medio (osservato - grezzo), con intervallo di confidenza bootstrap; la
+regressione lineare dello scarto sul prezzo grezzo indica se servono fasce
+di prezzo. La tabella delle correzioni viene aggiornata solo per i gruppi
+con abbastanza osservazioni.
+
+Esempio:
+    python calibrate.py --observations data/observed_prices.csv --bands 100,200
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+import rate_store
+from rounding import CORRECTION_COLUMNS, DEFAULT_CORRECTIONS_PATH, load_corrections, lookup_corrections, save_corrections
+
+_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+DEFAULT_OBSERVATIONS_PATH = os.environ.get(
+    "RATESHOPPER_OBSERVATIONS",
+    os.path.join(_DATA_DIR, "observed_prices.csv")
+)
+DEFAULT_REPORT_PATH = os.path.join(_DATA_DIR, "rounding_calibration.csv")
+
+# Fuso degli orari di osservazione senza fuso esplicito (inseriti in ora italiana)
+DEFAULT_OBSERVATIONS_TZ = "Europe/Rome"
+
+DEFAULT_BOOTSTRAP = 1000
+DEFAULT_MIN_OBSERVATIONS = 30
+
+# Limite di elementi per blocco di ricampionamento (memoria ~ 8 byte ciascuno)
+_BOOTSTRAP_CHUNK_ELEMENTS = 5_000_000
+
+REPORT_COLUMNS = CORRECTION_COLUMNS + ["n", "ci_low", "ci_high", "slope", "residual_std"]
+
+
+def _to_epoch(value, tz):
+    """Orario di osservazione in secondi epoch UTC (NaN se mancante o non valido)"""
+    try:
+        ts = pd.Timestamp(value)
+    except (TypeError, ValueError):
+        return np.nan
+    if pd.isna(ts):
+        return np.nan
+    if ts.tzinfo is None:
+        # Cambio d'ora: l'ora ripetuta vale come ora legale, quella saltata slitta in avanti
+        ts = ts.tz_localize(tz, ambiguous=True, nonexistent="shift_forward")
+    return ts.timestamp()
+
+
+def load_observations(path=None, tz=DEFAULT_OBSERVATIONS_TZ):
+    """Legge i prezzi osservati; `observed_at` diventa un timestamp epoch (inf se assente)"""
+    observations = pd.read_csv(path or DEFAULT_OBSERVATIONS_PATH, dtype={"ota_code": str, "currency": str})
+    for col in ["adults", "children", "rooms"]:
+        observations[col] = observations[col].astype("int64")
+    observations["currency"] = observations["currency"].str.upper()
+    observations["price"] = pd.to_numeric(observations["price"], errors="coerce")
+
+    if "observed_at" in observations.columns:
+        observations["observed_at"] = observations["observed_at"].map(lambda value: _to_epoch(value, tz))
+    else:
+        observations["observed_at"] = np.nan
+    observations["observed_at"] = observations["observed_at"].fillna(np.inf)
+
+    return observations.dropna(subset=["price"])
+
+
+def match_observations(conn, observations):
+    """Associa ogni osservazione al prezzo grezzo dell'ultimo shop non successivo"""
+    history = rate_store.load_history(conn, observations)
+    if history.empty or observations.empty:
+        return pd.DataFrame(columns=rate_store.RATE_KEY + ["observed_price", "price_raw", "shop_ts"])
+
+    for col in ["adults", "children", "rooms"]:
+        history[col] = history[col].astype("int64")
+
+    matched = pd.merge_asof(
+        observations.rename(columns={"price": "observed_price"}).sort_values("observed_at"),
+        history[rate_store.RATE_KEY + ["price_raw", "shop_ts"]].sort_values("shop_ts"),
+        left_on="observed_at",
+        right_on="shop_ts",
+        by=rate_store.RATE_KEY,
+        direction="backward"
+    )
+    return matched.dropna(subset=["price_raw"]).reset_index(drop=True)
+
+
+def residuals(matched, table=None):
+    """Scarto (osservato - prezzo corretto) con la tabella di correzioni indicata o corrente"""
+    matched = matched.copy()
+    matched["correction"] = lookup_corrections(matched, table)
+    matched["residual"] = matched["observed_price"] - matched["price_raw"] - matched["correction"]
+    return matched
+
+
+def _group_regression(codes, x, y, groups):
+    # Regressione y = a + b·x per tutti i gruppi insieme, tramite somme per gruppo
+    n = np.bincount(codes, minlength=groups).astype(float)
+    sx = np.bincount(codes, x, groups)
+    sy = np.bincount(codes, y, groups)
+    sxx = np.bincount(codes, x * x, groups)
+    sxy = np.bincount(codes, x * y, groups)
+
+    denominator = n * sxx - sx * sx
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = np.where(denominator > 0, (n * sxy - sx * sy) / denominator, 0.0)
+        mean = sy / n
+        variance = np.bincount(codes, y * y, groups) / n - mean * mean
+    return n, mean, slope, np.sqrt(np.clip(variance, 0, None))
+
+
+def _bootstrap_mean_ci(values, n_boot, rng, alpha=0.05):
+    # Ricampionamento vettoriale a blocchi di repliche
+    n = len(values)
+    per_chunk = max(1, _BOOTSTRAP_CHUNK_ELEMENTS // n)
+    means = []
+    for start in range(0, n_boot, per_chunk):
+        size = min(per_chunk, n_boot - start)
+        means.append(values[rng.integers(0, n, size=(size, n))].mean(axis=1))
+    means = np.concatenate(means)
+    return np.quantile(means, alpha / 2), np.quantile(means, 1 - alpha / 2)
+
+
+def fit_corrections(matched, bands=None, n_boot=DEFAULT_BOOTSTRAP, seed=0):
+    """Stima la correzione per OTA, valuta ed eventuale fascia di prezzo.
+
+    `bands` sono i limiti delle fasce sul prezzo grezzo per notte (ad es.
+    [100, 200] → <100, 100-200, ≥200). Restituisce una riga per gruppo con le
+    colonne di REPORT_COLUMNS.
+    """
+    if matched.empty:
+        return pd.DataFrame(columns=REPORT_COLUMNS)
+
+    x = matched["price_raw"].to_numpy(dtype=float)
+    y = matched["observed_price"].to_numpy(dtype=float) - x
+
+    edges = np.concatenate(([-np.inf], np.sort(np.asarray(bands, dtype=float)), [np.inf])) if bands else None
+    band = np.searchsorted(edges, x, side="right") - 1 if edges is not None else np.zeros(len(x), dtype=int)
+
+    keys = pd.DataFrame({"ota_code": matched["ota_code"].to_numpy(), "currency": matched["currency"].to_numpy(), "band": band})
+    codes = keys.groupby(["ota_code", "currency", "band"], sort=True).ngroup().to_numpy()
+    groups = codes.max() + 1
+    group_keys = keys.assign(_code=codes).drop_duplicates("_code").sort_values("_code")
+
+    n, mean, slope, residual_std = _group_regression(codes, x, y, groups)
+
+    rng = np.random.default_rng(seed)
+    order = np.argsort(codes, kind="stable")
+    bounds = np.cumsum(np.concatenate(([0], n.astype(int))))
+    ci = np.array([
+        _bootstrap_mean_ci(y[order[bounds[g]:bounds[g + 1]]], n_boot, rng)
+        for g in range(groups)
+    ])
+
+    band_index = group_keys["band"].to_numpy()
+    report = pd.DataFrame({
+        "ota_code": group_keys["ota_code"].to_numpy(),
+        "currency": group_keys["currency"].to_numpy(),
+        "price_min": edges[band_index] if edges is not None else np.nan,
+        "price_max": edges[band_index + 1] if edges is not None else np.nan,
+        "correction": np.round(mean, 2),
+        "n": n.astype(int),
+        "ci_low": np.round(ci[:, 0], 2),
+        "ci_high": np.round(ci[:, 1], 2),
+        "slope": np.round(slope, 4),
+        "residual_std": np.round(residual_std, 2)
+    })
+    # Le fasce aperte non hanno limite: nella tabella restano vuote
+    report[["price_min", "price_max"]] = report[["price_min", "price_max"]].replace([-np.inf, np.inf], np.nan)
+    return report[REPORT_COLUMNS]
+
+
+def update_table(table, estimates):
+    """Sostituisce nella tabella le righe dei gruppi stimati (stessa OTA, valuta e fascia)"""
+    table = table.reindex(columns=CORRECTION_COLUMNS)
+    estimates = estimates.reindex(columns=CORRECTION_COLUMNS)
+    match_key = ["ota_code", "currency", "price_min", "price_max"]
+
+    replaced = table[match_key].fillna(-1).merge(
+        estimates[match_key].fillna(-1).drop_duplicates(), how="left", indicator=True
+    )["_merge"].eq("both").to_numpy()
+
+    return pd.concat([table[~replaced], estimates], ignore_index=True)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Calibrazione delle correzioni di arrotondamento OTA")
+    parser.add_argument("--observations", default=DEFAULT_OBSERVATIONS_PATH, help="CSV dei prezzi osservati")
+    parser.add_argument("--tz", default=DEFAULT_OBSERVATIONS_TZ, help="Fuso degli orari di osservazione senza fuso")
+    parser.add_argument("--db", default=rate_store.DEFAULT_DB_PATH, help="Percorso del database SQLite")
+    parser.add_argument("--table", default=DEFAULT_CORRECTIONS_PATH, help="Tabella delle correzioni da aggiornare")
+    parser.add_argument("--report", default=DEFAULT_REPORT_PATH, help="CSV con le stime e gli intervalli di confidenza")
+    parser.add_argument("--bands", default="", help="Limiti delle fasce di prezzo separati da virgola (es. 100,200)")
+    parser.add_argument("--bootstrap", type=int, default=DEFAULT_BOOTSTRAP, help="Numero di ricampionamenti")
+    parser.add_argument("--min-observations", type=int, default=DEFAULT_MIN_OBSERVATIONS,
+                        help="Osservazioni minime per aggiornare un gruppo")
+    parser.add_argument("--dry-run", action="store_true", help="Mostra le stime senza scrivere la tabella")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    bands = [float(b) for b in args.bands.split(",") if b.strip()]
+
+    observations = load_observations(args.observations, args.tz)
+    conn = rate_store.connect(args.db)
+    try:
+        matched = match_observations(conn, observations)
+    finally:
+        conn.close()
+
+    print(f"Osservazioni associate allo storico: {len(matched)} (su {len(observations)})")
+    if matched.empty:
+        return 1
+
+    report = fit_corrections(matched, bands, n_boot=args.bootstrap)
+    accepted = report[report["n"] >= args.min_observations]
+
+    for _, row in report.iterrows():
+        band = ""
+        if pd.notna(row["price_min"]) or pd.notna(row["price_max"]):
+            low = "" if pd.isna(row["price_min"]) else f"{row['price_min']:g}"
+            high = "" if pd.isna(row["price_max"]) else f"{row['price_max']:g}"
+            band = f" [{low}-{high})"
+        skipped = "" if row["n"] >= args.min_observations else " (ignorato: poche osservazioni)"
+        print(
+            f"- {row['ota_code']} {row['currency']}{band}: {row['correction']:+.2f} "
+            f"IC95% [{row['ci_low']:+.2f}, {row['ci_high']:+.2f}], n={row['n']}, pendenza {row['slope']:+.4f}{skipped}"
+        )
+
+    before = residuals(matched, load_corrections(args.table))["residual"].abs().mean()
+    after = residuals(matched, update_table(load_corrections(args.table), accepted))["residual"].abs().mean()
+    print(f"Errore medio assoluto: {before:.2f} → {after:.2f}")
+
+    if args.dry_run:
+        return 0
+
+    save_corrections(update_table(load_corrections(args.table), accepted), args.table)
+    os.makedirs(os.path.dirname(args.report) or ".", exist_ok=True)
+    report.to_csv(args.report, index=False)
+    print(f"Tabella aggiornata: {args.table} ({len(accepted)} gruppi)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
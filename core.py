@@ -0,0 +1,877 @@
+"""Nucleo del Rate Checker: client Xotelo, parser delle risposte e analisi.
+
+Il modulo non dipende da Streamlit e può essere importato da script headless,
+worker e test senza effetti collaterali sull'interfaccia.
+"""
+from datetime import datetime, timedelta
+import json
+import threading
+
+import pandas as pd
+import requests
+
+import alerts
+import rate_store
+from adaptive_concurrency import AdaptiveGate
+from rounding import apply_corrections
+from singleflight import SingleFlight, request_key
+
+XOTELO_BASE_URL = "https://data.xotelo.com/api"
+REQUEST_TIMEOUT_SECONDS = 30
+
+def rates_params(hotel_key, check_in, check_out, adults=2, children_ages=None, rooms=1, currency="EUR"):
+    params = {
+        "hotel_key": hotel_key,
+        "chk_in": check_in,
+        "chk_out": check_out,
+        "adults": adults,
+        "rooms": rooms,
+        "currency": currency
+    }
+    
+    if children_ages and len(children_ages) > 0:
+        params["age_of_children"] = ",".join(map(str, children_ages))
+    
+    return params
+
+def heatmap_params(hotel_key, check_out):
+    return {
+        "hotel_key": hotel_key,
+        "chk_out": check_out
+    }
+
+def hotel_list_params(location_key, limit=30, offset=0, sort="best_value"):
+    return {
+        "location_key": location_key,
+        "limit": limit,
+        "offset": offset,
+        "sort": sort
+    }
+
+class XoteloAPI:
+    def __init__(self):
+        self.base_url = XOTELO_BASE_URL
+        # Le richieste identiche in corso da più thread diventano una sola chiamata
+        self.single_flight = SingleFlight()
+        # Finestra di chiamate contemporanee adattiva e circuit breaker per endpoint
+        self.gate = AdaptiveGate()
+    
+    def _get(self, endpoint, params, as_text=False):
+        def fetch():
+            try:
+                response = self.gate.call(
+                    endpoint,
+                    lambda: requests.get(f"{self.base_url}/{endpoint}", params=params, timeout=REQUEST_TIMEOUT_SECONDS)
+                )
+                return response.text if as_text else response.json()
+            except Exception as e:
+                error = {"error": str(e), "timestamp": 0, "result": None}
+                return json.dumps(error) if as_text else error
+        
+        return self.single_flight.do((request_key(endpoint, params), as_text), fetch)
+    
+    def get_rates(self, hotel_key, check_in, check_out, adults=2, children_ages=None, rooms=1, currency="EUR"):
+        return self._get("rates", rates_params(hotel_key, check_in, check_out, adults, children_ages, rooms, currency))
+    
+    def get_rates_text(self, hotel_key, check_in, check_out, adults=2, children_ages=None, rooms=1, currency="EUR"):
+        """Come get_rates, ma restituisce il corpo JSON non decodificato (per il parsing in parallelo)"""
+        return self._get("rates", rates_params(hotel_key, check_in, check_out, adults, children_ages, rooms, currency), as_text=True)
+    
+    def get_heatmap(self, hotel_key, check_out):
+        return self._get("heatmap", heatmap_params(hotel_key, check_out))
+    
+    def get_hotel_list(self, location_key, limit=30, offset=0, sort="best_value"):
+        return self._get("list", hotel_list_params(location_key, limit, offset, sort))
+
+hotel_keys = {
+    "VOI Alimini": "g652004-d1799967",  
+    "Ciaoclub Arco Del Saracino": "g946998-d947000", 
+    "Hotel Alpiselect Robinson Apulia": "g947837-d949958",  
+    "Alpiclub Hotel Thalas Club": "g1179328-d1159227" 
+}
+
+location_key = "g652004"
+
+# Durata della condivisione dei risultati tra sessioni (secondi)
+SEARCH_CACHE_TTL_SECONDS = 15 * 60
+HOTEL_INFO_TTL_SECONDS = 6 * 60 * 60
+
+# Un risultato condiviso viene archiviato una sola volta anche se più sessioni lo usano insieme
+_archive_lock = threading.Lock()
+
+# Nomi mesi in italiano (fallback se locale non disponibile)
+MESI_IT = {
+    1: "Gennaio", 2: "Febbraio", 3: "Marzo", 4: "Aprile",
+    5: "Maggio", 6: "Giugno", 7: "Luglio", 8: "Agosto",
+    9: "Settembre", 10: "Ottobre", 11: "Novembre", 12: "Dicembre"
+}
+
+def get_nome_mese(data):
+    """Restituisce il nome del mese in italiano"""
+    return f"{MESI_IT[data.month]} {data.year}"
+
+def process_xotelo_response(response, hotel_name, num_nights=1, adults=2, children_count=0, rooms=1, currency="EUR"):
+    if response.get("error") is not None or response.get("result") is None:
+        return pd.DataFrame([{
+            "hotel": hotel_name,
+            "ota": "N/A",
+            "ota_code": "N/A",
+            "price": 0,
+            "price_raw": 0,
+            "price_net": 0,
+            "tax": 0,
+            "rounding_correction": 0,
+            "price_total": 0,
+            "price_total_raw": 0,
+            "currency": currency,
+            "check_in": "",
+            "check_out": "",
+            "timestamp": 0,
+            "available": False,
+            "message": "Dati non disponibili/sold out",
+            "adults": adults,
+            "children": children_count,
+            "rooms": rooms
+        }])
+    
+    rates = response.get("result", {}).get("rates", [])
+    check_in = response.get("result", {}).get("chk_in", "")
+    check_out = response.get("result", {}).get("chk_out", "")
+    
+    if not rates:
+        return pd.DataFrame([{
+            "hotel": hotel_name,
+            "ota": "N/A",
+            "ota_code": "N/A",
+            "price": 0,
+            "price_raw": 0,
+            "price_net": 0,
+            "tax": 0,
+            "rounding_correction": 0,
+            "price_total": 0,
+            "price_total_raw": 0,
+            "currency": currency,
+            "check_in": check_in,
+            "check_out": check_out,
+            "timestamp": response.get("timestamp", 0),
+            "available": False,
+            "message": "Dati non disponibili/sold out",
+            "adults": adults,
+            "children": children_count,
+            "rooms": rooms
+        }])
+    
+    data = []
+    # Filtriamo Traveloka dai risultati
+    for rate in rates:
+        if "traveloka" not in rate.get("name", "").lower():  # Escludiamo Traveloka
+            rate_net = rate.get("rate", 0)
+            tax = rate.get("tax", 0)
+            price_per_night_raw = rate_net + tax  # Prezzo API grezzo (rate + tax)
+            
+            # La correzione arrotondamenti viene applicata in blocco sull'intero
+            # DataFrame delle tariffe (rounding.apply_corrections)
+            data.append({
+                "hotel": hotel_name,
+                "ota": rate.get("name", ""),
+                "ota_code": rate.get("code", ""),
+                "price_raw": price_per_night_raw,
+                "price": price_per_night_raw,
+                "price_net": rate_net,
+                "tax": tax,
+                "rounding_correction": 0,
+                "price_total_raw": price_per_night_raw * num_nights,
+                "price_total": price_per_night_raw * num_nights,
+                "currency": currency,
+                "check_in": check_in,
+                "check_out": check_out,
+                "timestamp": response.get("timestamp", 0),
+                "available": True,
+                "message": "",
+                "adults": adults,
+                "children": children_count,
+                "rooms": rooms
+            })
+    
+    return pd.DataFrame(data)
+
+def process_heatmap_response(response, hotel_name):
+    if response.get("error") is not None or response.get("result") is None:
+        return None
+    
+    heatmap_data = response.get("result", {}).get("heatmap", {})
+    
+    if not heatmap_data:
+        return None
+    
+    average_days = heatmap_data.get("average_price_days", [])
+    cheap_days = heatmap_data.get("cheap_price_days", [])
+    high_days = heatmap_data.get("high_price_days", [])
+    
+    formatted_average_days = [datetime.strptime(date, "%Y-%m-%d") for date in average_days]
+    formatted_cheap_days = [datetime.strptime(date, "%Y-%m-%d") for date in cheap_days]
+    formatted_high_days = [datetime.strptime(date, "%Y-%m-%d") for date in high_days]
+    
+    all_dates = []
+    
+    for date in formatted_cheap_days:
+        all_dates.append({
+            "hotel": hotel_name,
+            "date": date,
+            "price_level": "Economico",
+            "level_value": 1
+        })
+    
+    for date in formatted_average_days:
+        all_dates.append({
+            "hotel": hotel_name,
+            "date": date,
+            "price_level": "Medio",
+            "level_value": 2
+        })
+    
+    for date in formatted_high_days:
+        all_dates.append({
+            "hotel": hotel_name,
+            "date": date,
+            "price_level": "Alto",
+            "level_value": 3
+        })
+    
+    if all_dates:
+        df = pd.DataFrame(all_dates)
+        return {
+            "hotel": hotel_name,
+            "timestamp": response.get("timestamp", 0),
+            "check_out": response.get("result", {}).get("chk_out", ""),
+            "data": df,
+            "ranges": {
+                "cheap": formatted_cheap_days,
+                "average": formatted_average_days,
+                "high": formatted_high_days
+            }
+        }
+    
+    return None
+
+def process_hotel_list_response(response):
+    if response.get("error") is not None or response.get("result") is None:
+        return None
+    
+    hotels_list = response.get("result", {}).get("list", [])
+    
+    if not hotels_list:
+        return None
+    
+    data = []
+    for hotel in hotels_list:
+        try:
+            hotel_key = hotel.get("key", "")
+            name = hotel.get("name", "")
+            accommodation_type = hotel.get("accommodation_type", "")
+            url = hotel.get("url", "")
+            
+            review_summary = hotel.get("review_summary", {}) or {}
+            rating = review_summary.get("rating", 0) if isinstance(review_summary, dict) else 0
+            review_count = review_summary.get("count", 0) if isinstance(review_summary, dict) else 0
+            
+            price_ranges = hotel.get("price_ranges", {}) or {}
+            min_price = price_ranges.get("minimum", 0) if isinstance(price_ranges, dict) else 0
+            max_price = price_ranges.get("maximum", 0) if isinstance(price_ranges, dict) else 0
+            
+            geo = hotel.get("geo", {}) or {}
+            latitude = geo.get("latitude", 0) if isinstance(geo, dict) else 0
+            longitude = geo.get("longitude", 0) if isinstance(geo, dict) else 0
+            
+            amenities = hotel.get("highlighted_amenities", []) or []
+            amenities_list = [a.get("name", "") for a in amenities] if isinstance(amenities, list) else []
+            amenities_str = ", ".join(filter(None, amenities_list))
+            
+            data.append({
+                "hotel_key": hotel_key,
+                "name": name,
+                "accommodation_type": accommodation_type,
+                "url": url,
+                "rating": rating,
+                "review_count": review_count,
+                "min_price": min_price,
+                "max_price": max_price,
+                "latitude": latitude,
+                "longitude": longitude,
+                "amenities": amenities_str
+            })
+        except Exception as e:
+            continue
+    
+    if data:
+        return pd.DataFrame(data)
+    else:
+        return None
+
+def normalize_dataframe(df, num_nights):
+    normalized_df = df.copy()
+    
+    columns = df.columns.tolist()
+    
+    if "price" in columns and "price_night" not in columns:
+        normalized_df["price_night"] = normalized_df["price"]
+    elif "price_night" in columns and "price" not in columns:
+        normalized_df["price"] = normalized_df["price_night"]
+    elif "price" not in columns and "price_night" not in columns:
+        if "price_total" in columns:
+            normalized_df["price"] = normalized_df["price_total"] / num_nights
+            normalized_df["price_night"] = normalized_df["price"]
+        else:
+            normalized_df["price"] = 0
+            normalized_df["price_night"] = 0
+            normalized_df["price_total"] = 0
+    
+    if "price_total" not in columns:
+        if "price" in columns:
+            normalized_df["price_total"] = normalized_df["price"] * num_nights
+        elif "price_night" in columns:
+            normalized_df["price_total"] = normalized_df["price_night"] * num_nights
+        else:
+            normalized_df["price_total"] = 0
+    
+    if "is_available" in columns and "available" not in columns:
+        normalized_df["available"] = normalized_df["is_available"]
+    elif "available" in columns and "is_available" not in columns:
+        normalized_df["is_available"] = normalized_df["available"]
+    elif "available" not in columns and "is_available" not in columns:
+        normalized_df["available"] = normalized_df["price"] > 0
+        normalized_df["is_available"] = normalized_df["available"]
+    
+    if "message" not in columns:
+        normalized_df["message"] = ""
+        if "available" in columns:
+            normalized_df.loc[~normalized_df["available"], "message"] = "Dati non disponibili/sold out"
+        elif "is_available" in columns:
+            normalized_df.loc[~normalized_df["is_available"], "message"] = "Dati non disponibili/sold out"
+    
+    if "adults" not in columns:
+        normalized_df["adults"] = 2
+    if "children" not in columns:
+        normalized_df["children"] = 0
+    if "rooms" not in columns:
+        normalized_df["rooms"] = 1
+    
+    # Gestione colonne raw per correzione arrotondamenti
+    if "price_raw" not in columns:
+        normalized_df["price_raw"] = normalized_df["price"]
+    if "price_total_raw" not in columns:
+        normalized_df["price_total_raw"] = normalized_df["price_raw"] * num_nights
+    if "rounding_correction" not in columns:
+        normalized_df["rounding_correction"] = 0
+    if "price_net" not in columns:
+        normalized_df["price_net"] = normalized_df["price_raw"]
+    if "tax" not in columns:
+        normalized_df["tax"] = 0
+    
+    return normalized_df
+
+def fill_requested_dates(df, check_in, check_out):
+    """Le risposte in errore non riportano le date: usa quelle richieste.
+
+    Una risposta valida con sole tariffe escluse (Traveloka) produce un
+    DataFrame vuoto senza colonne, che viene restituito invariato.
+    """
+    if df.empty:
+        return df
+    df.loc[df["check_in"] == "", "check_in"] = check_in
+    df.loc[df["check_out"] == "", "check_out"] = check_out
+    return df
+
+def shop_rates(xotelo_api, hotels, arrivals, num_nights, adults=2, children_ages=None, rooms=1, currency="EUR"):
+    """Esegue get_rates per ogni coppia (hotel, arrivo).
+
+    Restituisce il DataFrame delle tariffe e quello dei gruppi ricercati con
+    successo (le chiamate in errore sono escluse, per non scambiarle per sold out).
+    """
+    children_count = len(children_ages) if children_ages else 0
+    all_data = []
+    groups = []
+
+    for arrival in arrivals:
+        check_in = arrival.strftime("%Y-%m-%d")
+        check_out = (arrival + timedelta(days=num_nights)).strftime("%Y-%m-%d")
+
+        for hotel in hotels:
+            hotel_key = hotel_keys.get(hotel, "")
+            if not hotel_key:
+                continue
+
+            response = xotelo_api.get_rates(
+                hotel_key,
+                check_in,
+                check_out,
+                adults=adults,
+                children_ages=children_ages,
+                rooms=rooms,
+                currency=currency
+            )
+
+            df = process_xotelo_response(response, hotel, num_nights, adults, children_count, rooms, currency)
+            if not df.empty:
+                all_data.append(fill_requested_dates(df, check_in, check_out))
+
+            if response.get("error") is None and response.get("result") is not None:
+                groups.append({
+                    "hotel": hotel,
+                    "check_in": check_in,
+                    "check_out": check_out,
+                    "adults": adults,
+                    "children": children_count,
+                    "rooms": rooms,
+                    "currency": currency
+                })
+
+    rates_df = None
+    if all_data:
+        rates_df = normalize_dataframe(apply_corrections(pd.concat(all_data, ignore_index=True), num_nights), num_nights)
+    return rates_df, pd.DataFrame(groups, columns=rate_store.GROUP_KEY)
+
+
+def build_rate_heatmap(rates_df, price_col, reference_hotel=None):
+    """Matrice hotel × data di arrivo con il prezzo minimo per data.
+
+    Con `reference_hotel` restituisce la differenza (riferimento - hotel) come
+    nell'analisi comparativa. Le date senza tariffe restano vuote (NaN).
+    """
+    available = rates_df[rates_df["available"] & (rates_df["check_in"] != "")]
+    if available.empty:
+        return None
+    
+    matrix = available.pivot_table(index="hotel", columns="check_in", values=price_col, aggfunc="min")
+    matrix.columns = pd.to_datetime(matrix.columns)
+    matrix = matrix.reindex(columns=pd.date_range(matrix.columns.min(), matrix.columns.max(), freq="D"))
+    
+    if reference_hotel is not None:
+        return reference_delta(matrix, reference_hotel)
+    
+    return matrix
+
+def reference_delta(matrix, reference_hotel):
+    """Differenza (riferimento - hotel) su una matrice hotel × data; None se manca il riferimento"""
+    if reference_hotel not in matrix.index:
+        return None
+    return (matrix.loc[reference_hotel] - matrix).drop(index=reference_hotel)
+
+def load_stored_sweep(occupancy, currency, num_nights, as_of=None):
+    """Tariffe già archiviate (shop headless o ricerche precedenti) dalla data odierna in poi.
+
+    Con `as_of` (epoch) restituisce le tariffe note in quel momento, dagli
+    arrivi di quel giorno in poi.
+    """
+    conn = rate_store.connect()
+    try:
+        if as_of is None:
+            stored = rate_store.load_latest_range(
+                conn,
+                occupancy["adults"],
+                occupancy["children"],
+                occupancy["rooms"],
+                currency,
+                nights=num_nights,
+                check_in_from=datetime.now().strftime("%Y-%m-%d")
+            )
+        else:
+            stored, _ = rate_store.load_as_of_range(
+                conn,
+                as_of,
+                occupancy["adults"],
+                occupancy["children"],
+                occupancy["rooms"],
+                currency,
+                nights=num_nights,
+                check_in_from=datetime.fromtimestamp(as_of).strftime("%Y-%m-%d")
+            )
+    finally:
+        conn.close()
+    
+    if stored.empty:
+        return None
+    
+    return stored_rates_frame(stored, num_nights)
+
+def stored_rates_frame(stored, num_nights):
+    """Converte le righe dell'archivio tariffe nel formato di process_xotelo_response"""
+    stored = stored.copy()
+    stored["available"] = True
+    stored["message"] = ""
+    return normalize_dataframe(apply_corrections(stored, num_nights), num_nights)
+
+def load_stored_search(search, as_of=None):
+    """Ultimi risultati archiviati per una ricerca, con l'orario di rilevazione per hotel.
+
+    Usato per mostrare subito dati non aggiornati mentre la ricerca viene
+    rieseguita in background. Con `as_of` (epoch) restituisce invece i dati
+    noti in quel momento (snapshot storico), con le tariffe del calendario.
+    Restituisce None se nessun hotel è in archivio.
+    """
+    children_count = len(search["children_ages"])
+    groups_df = pd.DataFrame([
+        {
+            "hotel": hotel,
+            "check_in": search["check_in"],
+            "check_out": search["check_out"],
+            "adults": search["adults"],
+            "children": children_count,
+            "rooms": search["rooms"],
+            "currency": search["currency"]
+        }
+        for hotel in search["hotels"]
+    ], columns=rate_store.GROUP_KEY)
+    
+    conn = rate_store.connect()
+    try:
+        if as_of is None:
+            latest_df, known_groups = rate_store.load_latest(conn, groups_df)
+        else:
+            known_groups = rate_store.as_of_shops(conn, groups_df.assign(as_of=float(as_of))).dropna(subset=["shop_ts"])
+            latest_df = rate_store.load_shop_rates(conn, known_groups)
+    finally:
+        conn.close()
+    
+    if known_groups.empty:
+        return None
+    
+    hotel_fetched_at = known_groups.set_index("hotel")["shop_ts"].to_dict()
+    frames = [stored_rates_frame(latest_df, search["num_nights"])] if not latest_df.empty else []
+    
+    # Hotel ricercati in passato ma senza tariffe: sold out all'ultima rilevazione
+    for hotel in hotel_fetched_at:
+        if latest_df.empty or hotel not in set(latest_df["hotel"]):
+            frames.append(process_xotelo_response(
+                {"error": None, "timestamp": 0, "result": {"rates": [], "chk_in": search["check_in"], "chk_out": search["check_out"]}},
+                hotel,
+                search["num_nights"],
+                search["adults"],
+                children_count,
+                search["rooms"],
+                search["currency"]
+            ))
+    
+    rate_data = normalize_dataframe(pd.concat(frames, ignore_index=True), search["num_nights"])
+    
+    sweep_data = None
+    if as_of is not None:
+        occupancy = {"adults": search["adults"], "children": children_count, "rooms": search["rooms"]}
+        sweep_data = load_stored_sweep(occupancy, search["currency"], search["num_nights"], as_of=as_of)
+    
+    return {
+        "rate_data": rate_data,
+        "sweep_data": sweep_data,
+        "heatmap_data": [],
+        "hotel_info": None,
+        "raw_hotel_data": {},
+        "raw_api_responses": {},
+        "events": None,
+        "messages": [],
+        "fetched_at": min(hotel_fetched_at.values()),
+        "hotel_fetched_at": hotel_fetched_at
+    }
+
+def search_cache_key(search):
+    return ("search",) + tuple(sorted(search.items()))
+
+def fetch_hotel_info(xotelo_api, progress=None):
+    """Rating e dati anagrafici degli hotel configurati, dalla ricerca per località"""
+    raw_api_responses = {}
+    all_raw_hotel_data = {}
+    messages = []
+    hotel_info = None
+    
+    if progress:
+        progress(50, "Recupero informazioni hotel dalla località...")
+    
+    try:
+        hotel_list_response = xotelo_api.get_hotel_list(
+            location_key,
+            limit=100,
+            sort="best_value"
+        )
+        
+        # Salva la risposta grezza per il debug
+        raw_api_responses["hotel_list"] = hotel_list_response
+        
+        hotel_info_df = process_hotel_list_response(hotel_list_response)
+        
+        if hotel_info_df is not None:
+            all_raw_hotel_data["location_search"] = hotel_info_df.to_dict()
+        
+        individual_hotel_data = []
+        
+        for idx, (hotel_name, hotel_key) in enumerate(hotel_keys.items()):
+            if progress:
+                progress(int(75 + 25 * idx / len(hotel_keys)), f"Recupero rating per {hotel_name}...")
+            
+            location_id = hotel_key.split("-")[0]
+            
+            try:
+                single_hotel_response = xotelo_api.get_hotel_list(
+                    location_id,
+                    limit=30, 
+                    sort="best_value"
+                )
+                
+                # Salva la risposta grezza per il debug
+                raw_api_responses[f"hotel_list_{hotel_name}"] = single_hotel_response
+                
+                single_hotel_df = process_hotel_list_response(single_hotel_response)
+                
+                if single_hotel_df is not None:
+                    all_raw_hotel_data[f"search_{hotel_name}"] = single_hotel_df.to_dict()
+                    
+                    match_hotel = single_hotel_df[single_hotel_df["hotel_key"] == hotel_key]
+                    if not match_hotel.empty:
+                        match_hotel = match_hotel.copy()
+                        match_hotel["our_hotel_name"] = hotel_name
+                        individual_hotel_data.append(match_hotel)
+                    else:
+                        messages.append(f"Hotel {hotel_name} (chiave: {hotel_key}) non trovato nei risultati di ricerca.")
+            except Exception as e:
+                messages.append(f"Errore nel recupero dei dati per {hotel_name}: {str(e)}")
+        
+        merged_hotel_info = None
+        
+        if individual_hotel_data:
+            individual_df = pd.concat(individual_hotel_data, ignore_index=True)
+            if hotel_info_df is not None and not hotel_info_df.empty:
+                hotel_info_df["our_hotel_name"] = hotel_info_df["hotel_key"].apply(
+                    lambda x: hotel_keys.get(x, "")
+                )
+                merged_hotel_info = pd.concat([individual_df, hotel_info_df], ignore_index=True)
+                merged_hotel_info = merged_hotel_info.drop_duplicates(subset=["hotel_key"])
+            else:
+                merged_hotel_info = individual_df
+        elif hotel_info_df is not None:
+            hotel_key_to_name = {v: k for k, v in hotel_keys.items()}
+            hotel_info_df["our_hotel_name"] = hotel_info_df["hotel_key"].apply(
+                lambda x: hotel_key_to_name.get(x, "")
+            )
+            merged_hotel_info = hotel_info_df
+        
+        if merged_hotel_info is not None:
+            filtered_hotel_info = merged_hotel_info[merged_hotel_info["our_hotel_name"] != ""].copy()
+            if not filtered_hotel_info.empty:
+                hotel_info = filtered_hotel_info
+    
+    except Exception as e:
+        messages.append(f"Non è stato possibile recuperare le informazioni degli hotel: {str(e)}")
+    
+    return {
+        "hotel_info": hotel_info,
+        "raw_hotel_data": all_raw_hotel_data,
+        "raw_api_responses": raw_api_responses,
+        "messages": messages
+    }
+
+class SearchCancelled(Exception):
+    pass
+
+def check_cancelled(cancel_event):
+    if cancel_event is not None and cancel_event.is_set():
+        raise SearchCancelled()
+
+def search_succeeded(result):
+    """Esito da conservare nella cache condivisa: almeno una chiamata riuscita con tariffe disponibili.
+
+    Con tutte le chiamate fallite (rete, circuito aperto) il risultato contiene
+    solo righe "N/A" e non va servito alle altre sessioni fino alla scadenza.
+    """
+    rate_data = result["rate_data"]
+    return (
+        result.get("searched_groups", 0) > 0
+        and rate_data is not None
+        and bool(rate_data["available"].any())
+    )
+
+
+def run_search(xotelo_api, search, progress=None, store=None, archive=True, cancel_event=None):
+    """Esegue una ricerca completa (tariffe, heatmap, info hotel) senza toccare la sessione.
+
+    Il risultato può essere condiviso tra sessioni e va trattato in sola lettura.
+    Se `store` è indicato, le info hotel (indipendenti dalla ricerca) vengono
+    condivise anche tra ricerche diverse. Con `archive=False` lo shop viene
+    archiviato solo da `archive_search`; `cancel_event` interrompe la ricerca
+    tra una chiamata e l'altra con `SearchCancelled`.
+    """
+    hotels = search["hotels"]
+    num_nights = search["num_nights"]
+    children_ages = list(search["children_ages"]) or None
+    children_count = len(search["children_ages"])
+    
+    all_data = []
+    all_heatmap_data = []
+    raw_api_responses = {}
+    messages = []
+    shop_groups = []
+    
+    for i, hotel in enumerate(hotels):
+        check_cancelled(cancel_event)
+        if progress:
+            progress(int(100 * i / (4 * len(hotels))), f"Elaborazione tariffe per {hotel}... ({i+1}/{len(hotels)})")
+        
+        hotel_key = hotel_keys.get(hotel, "")
+        if hotel_key:
+            response = xotelo_api.get_rates(
+                hotel_key,
+                search["check_in"],
+                search["check_out"],
+                adults=search["adults"],
+                children_ages=children_ages,
+                rooms=search["rooms"],
+                currency=search["currency"]
+            )
+            
+            # Salva la risposta grezza per il debug
+            raw_api_responses[f"rates_{hotel}"] = response
+            
+            if response.get("error") is None and response.get("result") is not None:
+                shop_groups.append({
+                    "hotel": hotel,
+                    "check_in": search["check_in"],
+                    "check_out": search["check_out"],
+                    "adults": search["adults"],
+                    "children": children_count,
+                    "rooms": search["rooms"],
+                    "currency": search["currency"]
+                })
+            
+            df = process_xotelo_response(
+                response, 
+                hotel,
+                num_nights,
+                search["adults"],
+                children_count,
+                search["rooms"],
+                search["currency"]
+            )
+            
+            if not df.empty:
+                all_data.append(df)
+    
+    sweep_df = None
+    if search["sweep_days"] > 1:
+        if progress:
+            progress(25, f"Ricerca tariffe per le successive {search['sweep_days'] - 1} date di arrivo...")
+        first_arrival = datetime.strptime(search["check_in"], "%Y-%m-%d")
+        sweep_df, sweep_groups = shop_rates(
+            xotelo_api,
+            hotels,
+            [first_arrival + timedelta(days=d) for d in range(1, search["sweep_days"])],
+            num_nights,
+            adults=search["adults"],
+            children_ages=children_ages,
+            rooms=search["rooms"],
+            currency=search["currency"]
+        )
+        shop_groups.extend(sweep_groups.to_dict("records"))
+    
+    for i, hotel in enumerate(hotels):
+        check_cancelled(cancel_event)
+        if progress:
+            progress(int(25 + 100 * i / (4 * len(hotels))), f"Elaborazione heatmap per {hotel}... ({i+1}/{len(hotels)})")
+        
+        hotel_key = hotel_keys.get(hotel, "")
+        if hotel_key:
+            heatmap_response = xotelo_api.get_heatmap(
+                hotel_key,
+                search["check_out"]
+            )
+            
+            # Salva la risposta grezza per il debug
+            raw_api_responses[f"heatmap_{hotel}"] = heatmap_response
+            
+            heatmap_data = process_heatmap_response(heatmap_response, hotel)
+            if heatmap_data:
+                all_heatmap_data.append(heatmap_data)
+    
+    if store is not None:
+        hotel_info_result = store.get_or_compute(
+            ("hotel_info",),
+            lambda: fetch_hotel_info(xotelo_api, progress),
+            ttl=HOTEL_INFO_TTL_SECONDS,
+            # Un recupero fallito non viene riproposto a tutti fino al TTL
+            cache_if=lambda result: result["hotel_info"] is not None
+        )
+    else:
+        hotel_info_result = fetch_hotel_info(xotelo_api, progress)
+    
+    raw_api_responses.update(hotel_info_result["raw_api_responses"])
+    messages.extend(hotel_info_result["messages"])
+    
+    normalized_df = None
+    sweep_data = None
+    fetched_at = datetime.now().timestamp()
+    
+    if all_data:
+        normalized_df = normalize_dataframe(apply_corrections(pd.concat(all_data, ignore_index=True), num_nights), num_nights)
+        
+        if sweep_df is not None:
+            sweep_data = pd.concat([normalized_df, sweep_df], ignore_index=True)
+    
+    result = {
+        "rate_data": normalized_df,
+        "sweep_data": sweep_data,
+        "heatmap_data": all_heatmap_data,
+        "hotel_info": hotel_info_result["hotel_info"],
+        "raw_hotel_data": hotel_info_result["raw_hotel_data"],
+        "raw_api_responses": raw_api_responses,
+        "events": None,
+        "messages": messages,
+        "searched_groups": len(shop_groups),
+        "pending_archive": shop_groups,
+        "fetched_at": fetched_at,
+        "hotel_fetched_at": {hotel: fetched_at for hotel in hotels}
+    }
+    
+    if archive:
+        archive_search(result)
+    
+    return result
+
+def archive_search(result):
+    """Archivia lo shop di un risultato calcolato con `archive=False`, una sola volta.
+
+    I prefetch non archiviano: uno shop entra nello storico (e genera avvisi)
+    solo quando un utente ne usa il risultato. Eventi e messaggi vengono
+    aggiunti al risultato condiviso.
+    """
+    with _archive_lock:
+        shop_groups = result.get("pending_archive")
+        if shop_groups is None:
+            return
+        result["pending_archive"] = None
+    
+    events = None
+    messages = []
+    rates = result["sweep_data"] if result["sweep_data"] is not None else result["rate_data"]
+    
+    if rates is not None:
+        # Archivia lo shop e confronta con l'ultimo snapshot per gli avvisi
+        try:
+            conn = rate_store.connect()
+            try:
+                events = alerts.process_shop(conn, rates, pd.DataFrame(shop_groups, columns=rate_store.GROUP_KEY))
+            finally:
+                conn.close()
+        except Exception as e:
+            messages.append(f"Non è stato possibile archiviare lo storico tariffe: {str(e)}")
+    
+    # Archivia calendario prezzi e info hotel per le analisi SQL
+    if result["heatmap_data"] or result["hotel_info"] is not None:
+        try:
+            conn = rate_store.connect()
+            try:
+                with conn:
+                    rate_store.record_heatmap(conn, result["heatmap_data"], result["fetched_at"])
+                    rate_store.record_hotel_info(conn, result["hotel_info"], result["fetched_at"])
+            finally:
+                conn.close()
+        except Exception as e:
+            messages.append(f"Non è stato possibile archiviare calendario e info hotel: {str(e)}")
+    
+    result["events"] = events
+    result["messages"] = result["messages"] + messages
@@ -0,0 +1,53 @@
+"""Esecuzione concorrente delle chiamate get_rates.
+
+Le chiamate sono identificate da una tupla hashable (vedi `rates_call`): i
+duplicati vengono eseguiti una sola volta e le risposte restituite per chiave.
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from adaptive_concurrency import DEFAULT_MAX_LIMIT
+
+# Limite superiore: le chiamate effettive sono regolate dalla finestra adattiva del client
+DEFAULT_MAX_WORKERS = DEFAULT_MAX_LIMIT
+
+
+def rates_call(hotel_key, check_in, check_out, adults=2, children_ages=None, rooms=1, currency="EUR"):
+    """Chiave di una chiamata get_rates"""
+    return (hotel_key, check_in, check_out, int(adults), tuple(children_ages or ()), int(rooms), currency)
+
+
+def _get_rates(xotelo_api, call, raw=False):
+    hotel_key, check_in, check_out, adults, children_ages, rooms, currency = call
+    # Con raw=True si chiede il corpo JSON non decodificato, se il client lo supporta
+    get = xotelo_api.get_rates_text if raw and hasattr(xotelo_api, "get_rates_text") else xotelo_api.get_rates
+    return get(
+        hotel_key,
+        check_in,
+        check_out,
+        adults=adults,
+        children_ages=list(children_ages) or None,
+        rooms=rooms,
+        currency=currency
+    )
+
+
+def fetch_rates_concurrent(xotelo_api, calls, max_workers=DEFAULT_MAX_WORKERS, progress=None, raw=False):
+    """Esegue in parallelo le chiamate distinte e restituisce {chiamata: risposta}.
+
+    `progress(completate, totale)` viene invocata dal thread chiamante. Con
+    `raw=True` le risposte possono essere testo JSON da decodificare (vedi parse_pool).
+    """
+    unique_calls = list(dict.fromkeys(calls))
+    responses = {}
+
+    if not unique_calls:
+        return responses
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(_get_rates, xotelo_api, call, raw): call for call in unique_calls}
+        for done, future in enumerate(as_completed(futures), 1):
+            responses[futures[future]] = future.result()
+            if progress:
+                progress(done, len(unique_calls))
+
+    return responses
@@ -0,0 +1,205 @@
+"""Conversione valute locale: si acquista una volta nella valuta base e si converte.
+
+Le tariffe vengono ricercate in BASE_CURRENCY e convertite nelle altre valute
+con una moltiplicazione vettoriale sulle colonne di prezzo, usando una tabella
+dei cambi su file (CSV) con la data di riferimento di ogni cambio:
+
+    currency,rate,as_of
+    USD,1.0842,2026-10-16
+
+`rate` è il numero di unità della valuta per 1 unità di BASE_CURRENCY. Il
+cambio della valuta base vale sempre 1. La tabella può essere scritta a mano
+oppure ricavata da Xotelo con `python fx.py`: per ogni valuta si richiedono
+le stesse tariffe e si prende il rapporto mediano rispetto alla valuta base,
+così i cambi coincidono con quelli usati dalle OTA (a meno degli
+arrotondamenti all'intero dell'API).
+
+Esempio:
+    python fx.py --days-ahead 30
+"""
+import argparse
+import os
+import sys
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from core import XoteloAPI, hotel_keys, process_xotelo_response
+from fetch_engine import DEFAULT_MAX_WORKERS, fetch_rates_concurrent, rates_call
+
+DEFAULT_FX_PATH = os.environ.get(
+    "RATESHOPPER_FX",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "config", "fx_rates.csv")
+)
+
+BASE_CURRENCY = "EUR"
+SUPPORTED_CURRENCIES = ["EUR", "USD", "GBP", "CAD", "CHF", "AUD", "JPY", "CNY", "INR", "THB", "BRL", "HKD", "RUB", "BZD"]
+
+FX_COLUMNS = ["currency", "rate", "as_of"]
+
+# Colonne in valuta delle tariffe (process_xotelo_response / normalize_dataframe)
+PRICE_COLUMNS = [
+    "price", "price_raw", "price_net", "tax", "rounding_correction",
+    "price_total", "price_total_raw", "price_night"
+]
+
+_cache = {}
+
+
+def _prepare(table):
+    table = table.reindex(columns=FX_COLUMNS).copy()
+    table["currency"] = table["currency"].astype(str).str.upper()
+    table["rate"] = pd.to_numeric(table["rate"], errors="coerce")
+    table = table[table["rate"] > 0].drop_duplicates("currency", keep="last")
+    table = table[table["currency"] != BASE_CURRENCY]
+    base = pd.DataFrame([{"currency": BASE_CURRENCY, "rate": 1.0, "as_of": None}])
+    return pd.concat([base, table], ignore_index=True) if not table.empty else base
+
+
+def load_fx_table(path=None):
+    """Legge la tabella dei cambi; ricaricata solo se il file è cambiato"""
+    path = path or DEFAULT_FX_PATH
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return _prepare(pd.DataFrame(columns=FX_COLUMNS))
+
+    cached = _cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    table = _prepare(pd.read_csv(path, dtype={"currency": str, "as_of": str}))
+    _cache[path] = (mtime, table)
+    return table
+
+
+def save_fx_table(table, path=None):
+    """Scrive la tabella dei cambi (senza la riga della valuta base)"""
+    path = path or DEFAULT_FX_PATH
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    table = table.reindex(columns=FX_COLUMNS)
+    table = table[table["currency"] != BASE_CURRENCY]
+    tmp_path = path + ".tmp"
+    table.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    _cache.pop(path, None)
+
+
+def fx_factor(from_currency, to_currency, table=None):
+    """Fattore di conversione tra due valute (None se manca un cambio)"""
+    if from_currency == to_currency:
+        return 1.0
+    rates = (load_fx_table() if table is None else table).set_index("currency")["rate"]
+    if from_currency not in rates.index or to_currency not in rates.index:
+        return None
+    return float(rates[to_currency] / rates[from_currency])
+
+
+def fx_as_of(currencies, table=None):
+    """Data del cambio più vecchio tra le valute indicate (None per la sola valuta base)"""
+    table = load_fx_table() if table is None else table
+    as_of = table.loc[table["currency"].isin(currencies), "as_of"].dropna()
+    return as_of.min() if not as_of.empty else None
+
+
+def convert_rates(rates_df, to_currency, table=None):
+    """Converte le colonne di prezzo nella valuta indicata, riga per riga.
+
+    Restituisce un nuovo DataFrame. Le righe in valute senza cambio restano
+    invariate, nella valuta originale.
+    """
+    table = load_fx_table() if table is None else table
+    rates = table.set_index("currency")["rate"]
+    converted = rates_df.copy()
+    if converted.empty or to_currency not in rates.index:
+        return converted
+
+    factor = (rates[to_currency] / converted["currency"].map(rates)).to_numpy(dtype=float)
+    known = ~np.isnan(factor)
+    factor = np.where(known, factor, 1.0)
+    for col in PRICE_COLUMNS:
+        if col in converted.columns:
+            converted[col] = converted[col].to_numpy(dtype=float) * factor
+    converted.loc[known, "currency"] = to_currency
+    return converted
+
+
+def derive_fx_table(xotelo_api, hotels, check_in, check_out, currencies=None,
+                    max_workers=DEFAULT_MAX_WORKERS):
+    """Ricava i cambi da Xotelo: rapporto mediano dei prezzi OTA rispetto alla valuta base"""
+    currencies = [c for c in (currencies or SUPPORTED_CURRENCIES) if c != BASE_CURRENCY]
+    hotel_list = [(hotel, hotel_keys[hotel]) for hotel in hotels if hotel in hotel_keys]
+    tasks = [
+        (rates_call(key, check_in, check_out, currency=currency), hotel, currency)
+        for hotel, key in hotel_list
+        for currency in [BASE_CURRENCY] + currencies
+    ]
+    responses = fetch_rates_concurrent(xotelo_api, [call for call, _, _ in tasks], max_workers=max_workers)
+
+    frames = [process_xotelo_response(responses[call], hotel, currency=currency) for call, hotel, currency in tasks]
+    prices = pd.concat(frames, ignore_index=True)
+    prices = prices[prices["available"] & (prices["price_raw"] > 0)]
+    if prices.empty:
+        return pd.DataFrame(columns=FX_COLUMNS)
+
+    # Stesso hotel e OTA in valuta base e nella valuta di destinazione
+    wide = prices.pivot_table(index=["hotel", "ota_code"], columns="currency", values="price_raw", aggfunc="first")
+    if BASE_CURRENCY not in wide.columns:
+        return pd.DataFrame(columns=FX_COLUMNS)
+    ratios = wide.drop(columns=BASE_CURRENCY).div(wide[BASE_CURRENCY], axis=0)
+
+    as_of = datetime.now().strftime("%Y-%m-%d")
+    median = ratios.median().dropna()
+    return pd.DataFrame({
+        "currency": median.index,
+        "rate": median.round(6).to_numpy(),
+        "samples": ratios.count()[median.index].to_numpy(),
+        "as_of": as_of
+    })
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Aggiornamento della tabella dei cambi da Xotelo")
+    parser.add_argument("--days-ahead", type=int, default=30, help="Giorni da oggi alla data di arrivo usata")
+    parser.add_argument("--currencies", nargs="*", default=SUPPORTED_CURRENCIES)
+    parser.add_argument("--hotels", nargs="*", default=list(hotel_keys.keys()))
+    parser.add_argument("--path", default=DEFAULT_FX_PATH, help="Tabella dei cambi da aggiornare")
+    parser.add_argument("--dry-run", action="store_true", help="Mostra i cambi senza scrivere la tabella")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    arrival = datetime.now() + timedelta(days=args.days_ahead)
+
+    derived = derive_fx_table(
+        XoteloAPI(),
+        args.hotels,
+        arrival.strftime("%Y-%m-%d"),
+        (arrival + timedelta(days=1)).strftime("%Y-%m-%d"),
+        args.currencies
+    )
+    if derived.empty:
+        print("Nessuna tariffa disponibile nella valuta base: tabella non aggiornata")
+        return 1
+
+    for _, row in derived.iterrows():
+        print(f"- 1 {BASE_CURRENCY} = {row['rate']:.4f} {row['currency']} ({row['samples']} tariffe)")
+    missing = sorted(set(args.currencies) - set(derived["currency"]) - {BASE_CURRENCY})
+    if missing:
+        print(f"Cambi non ricavati: {', '.join(missing)}")
+
+    if args.dry_run:
+        return 0
+
+    # I cambi non ricavati restano quelli precedenti
+    table = load_fx_table(args.path)
+    table = pd.concat([table[~table["currency"].isin(derived["currency"])], derived], ignore_index=True)
+    save_fx_table(table, args.path)
+    print(f"Tabella dei cambi aggiornata: {args.path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+"""Shop tariffe senza interfaccia, pensato per l'esecuzione pianificata (cron).
+
+Esempio:
+    python headless.py --check-in 2026-08-15 --nights 7 --days 14 --drop-threshold 10
+"""
+import argparse
+import sys
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+import alerts
+import rate_store
+from core import XoteloAPI, hotel_keys, normalize_dataframe
+from fetch_engine import DEFAULT_MAX_WORKERS, fetch_rates_concurrent, rates_call
+from parse_pool import parse_responses, parse_task
+from rate_cube import build_cube
+from rounding import apply_corrections
+
+
+def shop_rates_batch(xotelo_api, hotels, arrivals, num_nights, adults=2, children_ages=None, rooms=1,
+                     currency="EUR", max_workers=DEFAULT_MAX_WORKERS, parse_processes=None):
+    """Come core.shop_rates, con chiamate concorrenti e parsing opzionale in un pool di processi"""
+    children_count = len(children_ages) if children_ages else 0
+    tasks = []
+    calls = []
+
+    for arrival in arrivals:
+        check_in = arrival.strftime("%Y-%m-%d")
+        check_out = (arrival + timedelta(days=num_nights)).strftime("%Y-%m-%d")
+        for hotel in hotels:
+            hotel_key = hotel_keys.get(hotel, "")
+            if hotel_key:
+                calls.append(rates_call(hotel_key, check_in, check_out, adults, children_ages, rooms, currency))
+                tasks.append((hotel, check_in, check_out))
+
+    responses = fetch_rates_concurrent(xotelo_api, calls, max_workers=max_workers, raw=True)
+
+    rates_df, ok_flags = parse_responses(
+        [
+            parse_task(responses[call], hotel, num_nights, adults, children_count, rooms, currency, check_in, check_out)
+            for call, (hotel, check_in, check_out) in zip(calls, tasks)
+        ],
+        processes=parse_processes
+    )
+
+    groups = [
+        {
+            "hotel": hotel,
+            "check_in": check_in,
+            "check_out": check_out,
+            "adults": adults,
+            "children": children_count,
+            "rooms": rooms,
+            "currency": currency
+        }
+        for ok, (hotel, check_in, check_out) in zip(ok_flags, tasks) if ok
+    ]
+
+    if rates_df is not None:
+        rates_df = normalize_dataframe(apply_corrections(rates_df, num_nights), num_nights)
+    return rates_df, pd.DataFrame(groups, columns=rate_store.GROUP_KEY)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Shop tariffe Xotelo e avvisi di variazione prezzo")
+    parser.add_argument("--check-in", default=datetime.now().strftime("%Y-%m-%d"),
+                        help="Primo giorno di arrivo (YYYY-MM-DD)")
+    parser.add_argument("--nights", type=int, default=7, help="Durata del soggiorno")
+    parser.add_argument("--days", type=int, default=1, help="Numero di date di arrivo consecutive")
+    parser.add_argument("--adults", type=int, default=2)
+    parser.add_argument("--children-ages", default="", help="Età dei bambini separate da virgola")
+    parser.add_argument("--rooms", type=int, default=1)
+    parser.add_argument("--currency", default="EUR")
+    parser.add_argument("--hotels", nargs="*", default=list(hotel_keys.keys()))
+    parser.add_argument("--drop-threshold", type=float, default=alerts.DEFAULT_DROP_THRESHOLD_PCT,
+                        help="Calo percentuale minimo per generare un avviso")
+    parser.add_argument("--rise-threshold", type=float, default=alerts.DEFAULT_RISE_THRESHOLD_PCT,
+                        help="Aumento percentuale minimo per generare un avviso (disattivato se omesso)")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_MAX_WORKERS,
+                        help="Chiamate API contemporanee")
+    parser.add_argument("--parse-processes", type=int, default=1,
+                        help="Processi per il parsing delle risposte (1 = nel processo principale)")
+    parser.add_argument("--db", default=rate_store.DEFAULT_DB_PATH, help="Percorso del database SQLite")
+    parser.add_argument("--build-cube", action="store_true",
+                        help="Ricostruisce il cubo tariffe su disco usato dalla dashboard")
+    parser.add_argument("--export-parquet", action="store_true",
+                        help="Aggiorna la copia Parquet dell'archivio per le analisi SQL con DuckDB")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    first_arrival = datetime.strptime(args.check_in, "%Y-%m-%d")
+    arrivals = [first_arrival + timedelta(days=d) for d in range(max(args.days, 1))]
+    children_ages = [int(a) for a in args.children_ages.split(",") if a.strip()]
+
+    rates_df, groups_df = shop_rates_batch(
+        XoteloAPI(),
+        args.hotels,
+        arrivals,
+        args.nights,
+        adults=args.adults,
+        children_ages=children_ages or None,
+        rooms=args.rooms,
+        currency=args.currency,
+        max_workers=args.concurrency,
+        parse_processes=args.parse_processes
+    )
+
+    conn = rate_store.connect(args.db)
+    try:
+        events = alerts.process_shop(conn, rates_df, groups_df, args.drop_threshold, args.rise_threshold)
+        if args.build_cube:
+            build_cube(conn, args.currency, args.nights)
+    finally:
+        conn.close()
+    if args.export_parquet:
+        # pyarrow viene importato solo per l'esportazione
+        from analytics import export_parquet
+        export_parquet(args.db)
+
+    print(f"Ricerche completate: {len(groups_df)} (su {len(arrivals) * len(args.hotels)})")
+    print(f"Avvisi generati: {len(events)}")
+    for _, event in events.iterrows():
+        label = alerts.EVENT_LABELS.get(event["event_type"], event["event_type"])
+        change = f" ({event['change_pct']:+.1f}%)" if pd.notna(event["change_pct"]) else ""
+        print(f"- {label}: {event['hotel']} / {event['ota']} {event['check_in']}→{event['check_out']}{change}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,318 @@
+"""Catalogo degli hotel per località e ricerca dei competitor vicini.
+
+Il crawler scorre tutte le pagine di `get_hotel_list` (limit/offset) per le
+località indicate, in parallelo, e salva gli hotel trovati nella tabella
+`hotel_catalog` dell'archivio SQLite. Sulle coordinate del catalogo viene
+costruito un KD-tree (vettori unitari sulla sfera, distanza corda), che
+risponde in pochi millisecondi a interrogazioni come "hotel entro N km da
+VOI Alimini con rating ≥ X e fascia di prezzo simile", per comporre i comp set.
+
+Esempio:
+    python hotel_catalog.py --crawl --near "VOI Alimini" --radius 25 --min-rating 4
+"""
+import argparse
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import rate_store
+from core import XoteloAPI, hotel_keys, location_key, process_hotel_list_response
+from fetch_engine import DEFAULT_MAX_WORKERS
+
+EARTH_RADIUS_KM = 6371.0088
+DEFAULT_PAGE_SIZE = 100
+DEFAULT_MAX_PAGES = 50
+DEFAULT_RADIUS_KM = 25
+DEFAULT_PRICE_TOLERANCE = 0.35
+DEFAULT_PARITY_THRESHOLD_PCT = 2.0
+
+MAP_COLUMNS = ["hotel_key", "name", "latitude", "longitude", "rating", "price", "spread_pct", "otas", "parity", "price_range"]
+
+CATALOG_COLUMNS = [
+    "hotel_key", "name", "location_key", "accommodation_type", "url", "rating", "review_count",
+    "min_price", "max_price", "latitude", "longitude", "amenities", "crawled_at"
+]
+
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS hotel_catalog (
+    hotel_key TEXT PRIMARY KEY,
+    name TEXT,
+    location_key TEXT,
+    accommodation_type TEXT,
+    url TEXT,
+    rating REAL,
+    review_count INTEGER,
+    min_price REAL,
+    max_price REAL,
+    latitude REAL,
+    longitude REAL,
+    amenities TEXT,
+    crawled_at REAL NOT NULL
+);
+"""
+
+
+def default_locations():
+    """Località degli hotel configurati (prefisso della chiave TripAdvisor)"""
+    return list(dict.fromkeys([location_key] + [key.split("-")[0] for key in hotel_keys.values()]))
+
+
+def connect(db_path=None):
+    conn = rate_store.connect(db_path)
+    conn.executescript(CATALOG_SCHEMA)
+    return conn
+
+
+def _fetch_page(xotelo_api, location, offset, page_size, sort):
+    response = xotelo_api.get_hotel_list(location, limit=page_size, offset=offset, sort=sort)
+    hotels = process_hotel_list_response(response)
+    result = response.get("result") or {}
+    return hotels, result.get("total_count")
+
+
+def crawl_location(xotelo_api, location, page_size=DEFAULT_PAGE_SIZE, max_pages=DEFAULT_MAX_PAGES,
+                   max_workers=DEFAULT_MAX_WORKERS, sort="best_value", pool=None):
+    """Tutti gli hotel di una località.
+
+    La prima pagina indica il totale (`total_count`): le pagine restanti vengono
+    richieste in parallelo. Se il totale manca si procede a blocchi di
+    `max_workers` pagine fino alla prima pagina incompleta.
+    """
+    own_pool = pool is None
+    pool = pool or ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        first, total = _fetch_page(xotelo_api, location, 0, page_size, sort)
+        pages = [first]
+        if first is not None and len(first) >= page_size:
+            if total:
+                offsets = range(page_size, min(int(total), page_size * max_pages), page_size)
+                pages += list(pool.map(lambda offset: _fetch_page(xotelo_api, location, offset, page_size, sort)[0], offsets))
+            else:
+                next_page = 1
+                while next_page < max_pages:
+                    offsets = [page_size * p for p in range(next_page, min(next_page + max_workers, max_pages))]
+                    batch = list(pool.map(lambda offset: _fetch_page(xotelo_api, location, offset, page_size, sort)[0], offsets))
+                    pages += batch
+                    next_page += len(offsets)
+                    if any(page is None or len(page) < page_size for page in batch):
+                        break
+    finally:
+        if own_pool:
+            pool.shutdown()
+
+    pages = [page for page in pages if page is not None and not page.empty]
+    if not pages:
+        return pd.DataFrame(columns=CATALOG_COLUMNS)
+    hotels = pd.concat(pages, ignore_index=True).drop_duplicates("hotel_key")
+    return hotels.assign(location_key=location, crawled_at=time.time()).reindex(columns=CATALOG_COLUMNS)
+
+
+def crawl_locations(xotelo_api, locations, page_size=DEFAULT_PAGE_SIZE, max_pages=DEFAULT_MAX_PAGES,
+                    max_workers=DEFAULT_MAX_WORKERS, sort="best_value"):
+    """Crawl di più località con un unico pool di chiamate"""
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        # Località in parallelo; le pagine di tutte le località condividono `pool`
+        with ThreadPoolExecutor(max_workers=min(len(locations), max_workers) or 1) as outer:
+            frames = list(outer.map(
+                lambda location: crawl_location(xotelo_api, location, page_size, max_pages, max_workers, sort, pool),
+                locations
+            ))
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return pd.DataFrame(columns=CATALOG_COLUMNS)
+    return pd.concat(frames, ignore_index=True).drop_duplicates("hotel_key", keep="last")
+
+
+def save_catalog(conn, hotels_df):
+    """Inserisce o aggiorna gli hotel nel catalogo"""
+    if hotels_df is None or hotels_df.empty:
+        return 0
+    hotels_df = hotels_df.reindex(columns=CATALOG_COLUMNS)
+    conn.executemany(
+        f"INSERT OR REPLACE INTO hotel_catalog ({', '.join(CATALOG_COLUMNS)}) "
+        f"VALUES ({', '.join('?' * len(CATALOG_COLUMNS))})",
+        rate_store._to_rows(hotels_df)
+    )
+    conn.commit()
+    return len(hotels_df)
+
+
+def load_catalog(conn):
+    return pd.read_sql_query(f"SELECT {', '.join(CATALOG_COLUMNS)} FROM hotel_catalog", conn)
+
+
+def _unit_vectors(latitude, longitude):
+    lat = np.radians(np.asarray(latitude, dtype=float))
+    lon = np.radians(np.asarray(longitude, dtype=float))
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+def _chord(distance_km):
+    return 2 * np.sin(np.asarray(distance_km, dtype=float) / (2 * EARTH_RADIUS_KM))
+
+
+def _arc_km(chord):
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(np.asarray(chord) / 2, 0, 1))
+
+
+class HotelIndex:
+    """Indice spaziale del catalogo (hotel senza coordinate esclusi)"""
+
+    def __init__(self, catalog_df):
+        located = catalog_df["latitude"].notna() & catalog_df["longitude"].notna()
+        located &= (catalog_df["latitude"] != 0) | (catalog_df["longitude"] != 0)
+        self.hotels = catalog_df[located].reset_index(drop=True)
+        self._points = _unit_vectors(self.hotels["latitude"], self.hotels["longitude"])
+        # scipy viene importato solo quando si costruisce l'indice
+        from scipy.spatial import cKDTree
+        self._tree = cKDTree(self._points) if len(self.hotels) else None
+        self._rating = pd.to_numeric(self.hotels["rating"], errors="coerce").fillna(0).to_numpy()
+        low = pd.to_numeric(self.hotels["min_price"], errors="coerce").replace(0, np.nan)
+        high = pd.to_numeric(self.hotels["max_price"], errors="coerce").replace(0, np.nan)
+        self._price_mid = ((low.fillna(high) + high.fillna(low)) / 2).to_numpy()
+        self._position = {key: i for i, key in enumerate(self.hotels["hotel_key"])}
+
+    def __len__(self):
+        return len(self.hotels)
+
+    def locate(self, hotel):
+        """Posizione nel catalogo di un hotel (chiave TripAdvisor o nome configurato)"""
+        return self._position.get(hotel_keys.get(hotel, hotel))
+
+    def within(self, latitude, longitude, radius_km):
+        """Posizioni e distanze (km) degli hotel entro il raggio, dal più vicino"""
+        if self._tree is None:
+            return np.array([], dtype=int), np.array([])
+        center = _unit_vectors([latitude], [longitude])[0]
+        positions = np.asarray(self._tree.query_ball_point(center, _chord(radius_km)), dtype=int)
+        distances = _arc_km(np.linalg.norm(self._points[positions] - center, axis=1))
+        order = np.argsort(distances, kind="stable")
+        return positions[order], distances[order]
+
+    def comp_set(self, hotel, radius_km=DEFAULT_RADIUS_KM, min_rating=0, price_tolerance=DEFAULT_PRICE_TOLERANCE):
+        """Competitor entro `radius_km` da `hotel` con rating ≥ `min_rating`.
+
+        Con `price_tolerance` (es. 0.35 = ±35%) si tengono solo gli hotel con
+        prezzo medio della fascia TripAdvisor vicino a quello dell'hotel; gli
+        hotel senza fascia di prezzo vengono esclusi. None disattiva il filtro.
+        """
+        reference = self.locate(hotel)
+        if reference is None:
+            return None
+
+        positions, distances = self.within(
+            self.hotels.at[reference, "latitude"], self.hotels.at[reference, "longitude"], radius_km
+        )
+        keep = (positions != reference) & (self._rating[positions] >= min_rating)
+
+        reference_price = self._price_mid[reference]
+        if price_tolerance is not None and not np.isnan(reference_price):
+            ratio = self._price_mid[positions] / reference_price
+            with np.errstate(invalid="ignore"):
+                keep &= (ratio >= 1 - price_tolerance) & (ratio <= 1 + price_tolerance)
+
+        result = self.hotels.iloc[positions[keep]].copy()
+        result["distance_km"] = np.round(distances[keep], 2)
+        return result.reset_index(drop=True)
+
+
+def hotel_map_points(hotels_df, rates_df=None, price_col="price", parity_threshold_pct=DEFAULT_PARITY_THRESHOLD_PCT):
+    """Un punto per hotel: coordinate, prezzo minimo attuale e stato di parità tra le OTA.
+
+    `rates_df` (formato di process_xotelo_response) è aggregato per hotel: la
+    parità è rispettata se lo scarto tra OTA più cara e più economica non
+    supera `parity_threshold_pct`. Gli hotel senza tariffe ricercate hanno
+    prezzo NaN e stato "non rilevato".
+    """
+    points = hotels_df.reindex(columns=["hotel_key", "name", "latitude", "longitude", "rating", "min_price", "max_price"])
+    if rates_df is not None and not rates_df.empty:
+        available = rates_df[rates_df["available"]]
+        prices = available.groupby(available["hotel"].map(hotel_keys))[price_col].agg(["min", "max", "count"])
+        points = points.join(prices, on="hotel_key")
+    else:
+        points = points.assign(min=np.nan, max=np.nan, count=np.nan)
+
+    spread_pct = (points["max"] - points["min"]) / points["min"] * 100
+    parity = np.where(spread_pct > parity_threshold_pct, "disparità", "parità")
+    low = pd.to_numeric(points["min_price"], errors="coerce")
+    high = pd.to_numeric(points["max_price"], errors="coerce")
+    price_range = low.map("{:.0f}".format) + "-" + high.map("{:.0f}".format)
+
+    return pd.DataFrame({
+        "hotel_key": points["hotel_key"],
+        "name": points["name"],
+        "latitude": points["latitude"].round(5),
+        "longitude": points["longitude"].round(5),
+        "rating": pd.to_numeric(points["rating"], errors="coerce"),
+        "price": points["min"].round(2),
+        "spread_pct": spread_pct.round(1),
+        "otas": points["count"].fillna(0).astype(int),
+        "parity": np.where(points["min"].isna(), "non rilevato", parity),
+        "price_range": price_range.where(low.notna() & high.notna() & (low > 0), "")
+    })[MAP_COLUMNS].reset_index(drop=True)
+
+
+def load_hotel_index(db_path=None):
+    conn = connect(db_path)
+    try:
+        return HotelIndex(load_catalog(conn))
+    finally:
+        conn.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Catalogo hotel per località e comp set per distanza")
+    parser.add_argument("--crawl", action="store_true", help="Aggiorna il catalogo scorrendo le località")
+    parser.add_argument("--locations", nargs="*", default=default_locations(), help="Chiavi località TripAdvisor")
+    parser.add_argument("--page-size", type=int, default=DEFAULT_PAGE_SIZE)
+    parser.add_argument("--max-pages", type=int, default=DEFAULT_MAX_PAGES, help="Pagine massime per località")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_MAX_WORKERS, help="Chiamate API contemporanee")
+    parser.add_argument("--near", help="Hotel di riferimento per il comp set (nome configurato o chiave)")
+    parser.add_argument("--radius", type=float, default=DEFAULT_RADIUS_KM, help="Raggio in km")
+    parser.add_argument("--min-rating", type=float, default=0)
+    parser.add_argument("--price-tolerance", type=float, default=DEFAULT_PRICE_TOLERANCE,
+                        help="Scostamento massimo del prezzo medio (0.35 = ±35%%, negativo = nessun filtro)")
+    parser.add_argument("--db", default=rate_store.DEFAULT_DB_PATH, help="Percorso del database SQLite")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    conn = connect(args.db)
+    try:
+        if args.crawl:
+            started = time.perf_counter()
+            hotels = crawl_locations(XoteloAPI(), args.locations, args.page_size, args.max_pages, args.concurrency)
+            saved = save_catalog(conn, hotels)
+            print(f"Hotel salvati nel catalogo: {saved} ({len(args.locations)} località, {time.perf_counter() - started:.1f}s)")
+        catalog = load_catalog(conn)
+    finally:
+        conn.close()
+
+    if not args.near:
+        return 0
+
+    index = HotelIndex(catalog)
+    started = time.perf_counter()
+    comp_set = index.comp_set(
+        args.near, args.radius, args.min_rating, args.price_tolerance if args.price_tolerance >= 0 else None
+    )
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    if comp_set is None:
+        print(f"{args.near} non è nel catalogo (o non ha coordinate): eseguire prima --crawl")
+        return 1
+
+    print(f"Competitor entro {args.radius:g} km da {args.near}: {len(comp_set)} (su {len(index)} hotel, {elapsed_ms:.1f} ms)")
+    for _, hotel in comp_set.iterrows():
+        print(
+            f"- {hotel['name']} ({hotel['hotel_key']}): {hotel['distance_km']:.1f} km, rating {hotel['rating']}, "
+            f"prezzo {hotel['min_price']:g}-{hotel['max_price']:g}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""Matrice arrivo × durata del soggiorno (LOS).
+
+Per ogni hotel, data di arrivo e numero di notti viene eseguita una vera
+chiamata get_rates (i prezzi Xotelo dipendono dalla durata, non basta
+moltiplicare il prezzo per notte). I risultati sono raccolti in array NumPy
+di forma (hotel, arrivo, LOS) per poterli sezionare rapidamente nei grafici.
+"""
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from core import hotel_keys, process_xotelo_response
+from rounding import apply_corrections
+from fetch_engine import DEFAULT_MAX_WORKERS, fetch_rates_concurrent, rates_call
+
+MAX_LOS = 14
+
+
+def build_los_matrix(xotelo_api, hotels, arrivals, los_values, adults=2, children_ages=None, rooms=1,
+                     currency="EUR", max_workers=DEFAULT_MAX_WORKERS, progress=None):
+    """Prezzo minimo per notte per ogni (hotel, arrivo, LOS).
+
+    Restituisce un dizionario con gli assi ("hotels", "arrivals", "los") e gli
+    array "price" (con correzione arrotondamenti), "price_raw" e "min_ota";
+    le combinazioni senza disponibilità valgono NaN.
+    """
+    hotel_axis = [h for h in hotels if hotel_keys.get(h)]
+    arrival_axis = [a.strftime("%Y-%m-%d") for a in arrivals]
+    los_axis = [int(n) for n in los_values]
+    children_count = len(children_ages) if children_ages else 0
+
+    shape = (len(hotel_axis), len(arrival_axis), len(los_axis))
+    price = np.full(shape, np.nan, dtype=np.float32)
+    price_raw = np.full(shape, np.nan, dtype=np.float32)
+    min_ota = np.full(shape, "", dtype=object)
+
+    cells = {}
+    for h, hotel in enumerate(hotel_axis):
+        for a, arrival in enumerate(arrivals):
+            for l, nights in enumerate(los_axis):
+                check_out = (arrival + timedelta(days=nights)).strftime("%Y-%m-%d")
+                call = rates_call(hotel_keys[hotel], arrival_axis[a], check_out, adults, children_ages, rooms, currency)
+                cells[(h, a, l)] = call
+
+    responses = fetch_rates_concurrent(xotelo_api, cells.values(), max_workers=max_workers, progress=progress)
+
+    frames = []
+    for (h, a, l), call in cells.items():
+        df = process_xotelo_response(
+            responses[call], hotel_axis[h], los_axis[l], adults, children_count, rooms, currency
+        )
+        frames.append(df.assign(_h=h, _a=a, _l=l))
+
+    if frames:
+        rates = pd.concat(frames, ignore_index=True)
+        # Correzione arrotondamenti in blocco, con il numero di notti di ogni cella
+        rates = apply_corrections(rates, np.asarray(los_axis)[rates["_l"].to_numpy()])
+        available = rates[rates["available"]]
+        if not available.empty:
+            best = available.loc[available.groupby(["_h", "_a", "_l"])["price"].idxmin()]
+            cell = (best["_h"].to_numpy(), best["_a"].to_numpy(), best["_l"].to_numpy())
+            price[cell] = best["price"].to_numpy()
+            min_ota[cell] = best["ota"].to_numpy()
+            raw_min = available.groupby(["_h", "_a", "_l"])["price_raw"].min()
+            price_raw[tuple(np.asarray(level) for level in zip(*raw_min.index))] = raw_min.to_numpy()
+
+    return {
+        "hotels": hotel_axis,
+        "arrivals": arrival_axis,
+        "los": los_axis,
+        "price": price,
+        "price_raw": price_raw,
+        "min_ota": min_ota,
+        "currency": currency,
+        "calls": len(set(cells.values())),
+    }
+
+
+def los_slice(matrix, hotel=None, arrival=None, los=None, value="price"):
+    """Sezione 2-D (o 1-D) della matrice come DataFrame etichettato.
+
+    Fissare un asse con il suo valore: ad es. `hotel=...` restituisce arrivo × LOS,
+    `arrival=...` restituisce hotel × LOS, `los=...` restituisce hotel × arrivo.
+    """
+    data = matrix[value]
+    axes = {"hotels": matrix["hotels"], "arrivals": matrix["arrivals"], "los": matrix["los"]}
+    index = [slice(None)] * 3
+
+    for pos, (name, selected) in enumerate([("hotels", hotel), ("arrivals", arrival), ("los", los)]):
+        if selected is not None:
+            index[pos] = axes[name].index(selected)
+            axes[name] = None
+
+    sliced = data[tuple(index)]
+    labels = [labels for labels in axes.values() if labels is not None]
+
+    if sliced.ndim == 2:
+        return pd.DataFrame(sliced, index=labels[0], columns=labels[1])
+    if sliced.ndim == 1:
+        return pd.Series(sliced, index=labels[0])
+    return sliced
@@ -0,0 +1,201 @@
+"""Indice di mercato dei competitor per data di soggiorno.
+
+Per ogni data di arrivo l'indice è la distribuzione (quantili pesati per
+rating) del prezzo minimo per notte dei competitor, confrontata con la curva
+dell'hotel di riferimento. Lo stato è la griglia (data di arrivo, hotel) →
+prezzo minimo: ogni nuovo blocco di tariffe aggiorna solo le celle ricercate
+e ricalcola i quantili solo per le date toccate. `refresh` aggiunge i gruppi
+archiviati dopo l'ultimo caricamento, anche da altri processi (shop headless,
+worker della coda, job di shop).
+"""
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import rate_store
+from rounding import apply_corrections
+
+DEFAULT_REFERENCE_HOTEL = "VOI Alimini"
+DEFAULT_HORIZON_DAYS = 180
+DEFAULT_QUANTILES = (0.25, 0.5, 0.75)
+
+CURVE_COLUMNS = ["q25", "q50", "q75", "reference", "competitors"]
+
+# Margine sul punto di arrivo di refresh: uno shop con orario precedente può essere
+# registrato da un altro processo poco dopo (le celle ricaricate vengono solo riscritte)
+REFRESH_OVERLAP_SECONDS = 60
+
+
+def rating_weights(hotel_info):
+    """Peso di ogni hotel = rating TripAdvisor (da hotel_info)"""
+    if hotel_info is None or hotel_info.empty or "rating" not in hotel_info.columns:
+        return {}
+    ratings = pd.to_numeric(hotel_info["rating"], errors="coerce")
+    weights = pd.Series(ratings.to_numpy(), index=hotel_info["our_hotel_name"].to_numpy()).dropna()
+    return weights[weights > 0].to_dict()
+
+
+def weighted_quantiles(cells, weights, quantiles=DEFAULT_QUANTILES):
+    """Quantili pesati del prezzo per data.
+
+    `cells` ha colonne check_in, hotel, price (una riga per hotel e data);
+    gli hotel senza peso ricevono il peso mediano. Restituisce un DataFrame
+    indicizzato per check_in con una colonna per quantile e il numero di hotel.
+    """
+    cells = cells.dropna(subset=["price"])
+    if cells.empty:
+        return pd.DataFrame(columns=[f"q{int(q * 100)}" for q in quantiles] + ["competitors"])
+
+    default_weight = float(np.median(list(weights.values()))) if weights else 1.0
+    cells = cells.assign(weight=cells["hotel"].map(weights).fillna(default_weight).astype(float))
+    cells = cells.sort_values(["check_in", "price"], kind="stable")
+
+    by_date = cells.groupby("check_in", sort=True)
+    fraction = by_date["weight"].cumsum() / by_date["weight"].transform("sum")
+
+    # Quantile pesato: primo prezzo in cui il peso cumulato raggiunge q
+    result = pd.DataFrame(index=pd.Index(sorted(cells["check_in"].unique()), name="check_in"))
+    for q in quantiles:
+        reached = cells[fraction.to_numpy() >= q - 1e-9]
+        result[f"q{int(q * 100)}"] = reached.groupby("check_in")["price"].first()
+    result["competitors"] = by_date["hotel"].nunique()
+    return result
+
+
+class MarketIndex:
+    def __init__(self, reference_hotel=DEFAULT_REFERENCE_HOTEL, weights=None, quantiles=DEFAULT_QUANTILES):
+        self.reference_hotel = reference_hotel
+        self.quantiles = quantiles
+        self._weights = dict(weights or {})
+        self._lock = threading.Lock()
+        # Prezzo minimo per notte per (check_in, hotel); NaN = ricercato ma non disponibile
+        self._cells = pd.Series(dtype=float, index=pd.MultiIndex.from_arrays([[], []], names=["check_in", "hotel"]))
+        self._curve = pd.DataFrame(columns=CURVE_COLUMNS, index=pd.Index([], name="check_in"))
+        self.stats = {"updates": 0, "dates_recomputed": 0}
+        # Archivio da cui ricaricare i nuovi shop (vedi load_market_index) e ultimo shop letto
+        self._source = None
+        self.high_water = None
+
+    def _recompute(self, dates):
+        cells = self._cells[self._cells.index.get_level_values("check_in").isin(dates)].rename("price").reset_index()
+        competitors = cells[cells["hotel"] != self.reference_hotel]
+        reference = cells[cells["hotel"] == self.reference_hotel].set_index("check_in")["price"]
+
+        curve = weighted_quantiles(competitors, self._weights, self.quantiles)
+        curve = curve.reindex(pd.Index(sorted(dates), name="check_in"))
+        curve["reference"] = reference
+        curve["competitors"] = curve["competitors"].fillna(0).astype(int)
+
+        kept = self._curve[~self._curve.index.isin(dates)]
+        self._curve = pd.concat([kept, curve]).sort_index() if not kept.empty else curve
+        self.stats["dates_recomputed"] += len(dates)
+
+    def update(self, rates_df, price_col="price"):
+        """Aggiunge un blocco di tariffe (stesso formato di process_xotelo_response)"""
+        if rates_df is None or rates_df.empty:
+            return
+        rates = rates_df[rates_df["check_in"] != ""]
+        price = rates[price_col].where(rates["available"])
+        new_cells = price.groupby([rates["check_in"], rates["hotel"]]).min()
+        new_cells.index.names = ["check_in", "hotel"]
+
+        with self._lock:
+            self._cells = pd.concat([self._cells[~self._cells.index.isin(new_cells.index)], new_cells]).sort_index()
+            self._recompute(new_cells.index.get_level_values("check_in").unique())
+            self.stats["updates"] += 1
+
+    def refresh(self):
+        """Aggiunge i gruppi archiviati dopo l'ultimo caricamento; restituisce quanti ne ha letti"""
+        if self._source is None:
+            return 0
+        source = self._source
+        today = datetime.now()
+        where, params = rate_store._range_filter(
+            source["occupancy"]["adults"], source["occupancy"]["children"], source["occupancy"]["rooms"],
+            source["currency"], source["num_nights"], today.strftime("%Y-%m-%d"),
+            (today + timedelta(days=source["days"] - 1)).strftime("%Y-%m-%d")
+        )
+        since = -1.0 if self.high_water is None else self.high_water - REFRESH_OVERLAP_SECONDS
+
+        conn = rate_store.connect(source["db_path"])
+        try:
+            groups = pd.read_sql_query(
+                f"SELECT hotel, check_in, shop_ts FROM shop_groups WHERE {where} AND shop_ts > ?",
+                conn, params=params + [since]
+            )
+            stored = pd.read_sql_query(
+                f"SELECT * FROM rate_latest WHERE {where} AND shop_ts > ?", conn, params=params + [since]
+            )
+        finally:
+            conn.close()
+        if groups.empty:
+            return 0
+
+        frames = []
+        if not stored.empty:
+            frames.append(apply_corrections(stored.assign(available=True), source["num_nights"]))
+        # Gruppi ricercati senza tariffe: celle non disponibili
+        sold_out = groups[~groups.set_index(["hotel", "check_in"]).index.isin(
+            stored.set_index(["hotel", "check_in"]).index
+        )]
+        if not sold_out.empty:
+            frames.append(sold_out[["hotel", "check_in"]].assign(price=np.nan, available=False))
+        self.update(pd.concat(frames, ignore_index=True))
+        self.high_water = max(self.high_water or 0.0, float(groups["shop_ts"].max()))
+        return len(groups)
+
+    def set_weights(self, weights):
+        """Aggiorna i pesi (rating); se cambiano l'indice viene ricalcolato"""
+        weights = dict(weights or {})
+        with self._lock:
+            if weights == self._weights:
+                return
+            self._weights = weights
+            if not self._cells.empty:
+                self._recompute(self._cells.index.get_level_values("check_in").unique())
+
+    def curve(self, start=None, days=DEFAULT_HORIZON_DAYS):
+        """Curva di mercato (quantili, riferimento, numero di competitor) sulle prossime `days` date"""
+        start = start or datetime.now().strftime("%Y-%m-%d")
+        end = (datetime.strptime(start, "%Y-%m-%d") + timedelta(days=days - 1)).strftime("%Y-%m-%d")
+        with self._lock:
+            curve = self._curve.copy()
+        curve = curve[(curve.index >= start) & (curve.index <= end)]
+        curve.index = pd.to_datetime(curve.index)
+        return curve
+
+
+def load_market_index(occupancy, currency, num_nights, weights=None, days=DEFAULT_HORIZON_DAYS,
+                      reference_hotel=DEFAULT_REFERENCE_HOTEL, db_path=None, as_of=None):
+    """Indice inizializzato con le ultime tariffe archiviate sulle prossime `days` date.
+
+    Con `as_of` (epoch) usa le tariffe note a quel momento, sulle date successive
+    (indice fisso, senza refresh).
+    """
+    index = MarketIndex(reference_hotel=reference_hotel, weights=weights)
+    if not as_of:
+        index._source = {
+            "occupancy": dict(occupancy), "currency": currency, "num_nights": num_nights, "days": days, "db_path": db_path
+        }
+        index.refresh()
+        return index
+
+    today = datetime.fromtimestamp(as_of)
+    date_range = {
+        "nights": num_nights,
+        "check_in_from": today.strftime("%Y-%m-%d"),
+        "check_in_to": (today + timedelta(days=days - 1)).strftime("%Y-%m-%d")
+    }
+    conn = rate_store.connect(db_path)
+    try:
+        stored, _ = rate_store.load_as_of_range(
+            conn, as_of, occupancy["adults"], occupancy["children"], occupancy["rooms"], currency, **date_range
+        )
+    finally:
+        conn.close()
+
+    if not stored.empty:
+        index.update(apply_corrections(stored.assign(available=True), num_nights))
+    return index
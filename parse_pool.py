@@ -0,0 +1,98 @@
+"""Parsing delle risposte get_rates in un pool di processi.
+
+Per shop molto ampi la decodifica JSON, `process_xotelo_response` e la
+costruzione dei DataFrame saturano un solo core (GIL). Qui le risposte
+vengono suddivise in blocchi e analizzate da processi separati; ogni
+processo restituisce un blocco colonnare compatto (array NumPy, con le
+colonne di testo codificate a dizionario) invece di un DataFrame, così il
+trasferimento tra processi resta economico.
+"""
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from core import fill_requested_dates, process_xotelo_response
+
+DEFAULT_CHUNK_SIZE = 64
+
+
+def parse_task(payload, hotel, num_nights, adults=2, children_count=0, rooms=1, currency="EUR",
+               check_in="", check_out=""):
+    """Descrittore di una risposta da analizzare (payload: testo JSON o dizionario già decodificato)"""
+    return (payload, hotel, num_nights, adults, children_count, rooms, currency, check_in, check_out)
+
+
+def _is_ok(response):
+    return response.get("error") is None and response.get("result") is not None
+
+
+def _encode_columns(df):
+    # Colonne numeriche come array NumPy, colonne di testo come (codici, dizionario)
+    chunk = {}
+    for col in df.columns:
+        values = df[col].to_numpy()
+        if values.dtype == object:
+            codes, uniques = pd.factorize(values)
+            chunk[col] = ("dict", codes.astype(np.int32), np.asarray(uniques, dtype=object))
+        else:
+            chunk[col] = ("plain", values)
+    return chunk
+
+
+def _decode_columns(chunk):
+    data = {}
+    for col, encoded in chunk.items():
+        if encoded[0] == "dict":
+            _, codes, uniques = encoded
+            values = np.full(len(codes), None, dtype=object)
+            present = codes >= 0
+            values[present] = uniques[codes[present]]
+            data[col] = values
+        else:
+            data[col] = encoded[1]
+    return pd.DataFrame(data)
+
+
+def parse_chunk(tasks):
+    """Analizza un blocco di risposte; restituisce (blocco colonnare, esito per risposta)"""
+    frames = []
+    ok_flags = []
+
+    for payload, hotel, num_nights, adults, children_count, rooms, currency, check_in, check_out in tasks:
+        try:
+            response = json.loads(payload) if isinstance(payload, (str, bytes)) else payload
+        except ValueError as e:
+            response = {"error": f"Risposta non valida: {e}", "timestamp": 0, "result": None}
+
+        df = process_xotelo_response(response, hotel, num_nights, adults, children_count, rooms, currency)
+        if not df.empty:
+            frames.append(fill_requested_dates(df, check_in, check_out))
+        ok_flags.append(_is_ok(response))
+
+    combined = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    return _encode_columns(combined), ok_flags
+
+
+def parse_responses(tasks, processes=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Analizza le risposte (in parallelo se `processes` > 1).
+
+    Restituisce il DataFrame delle tariffe e la lista degli esiti, nello
+    stesso ordine di `tasks`.
+    """
+    tasks = list(tasks)
+    chunks = [tasks[i:i + chunk_size] for i in range(0, len(tasks), chunk_size)]
+
+    if processes and processes > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            results = list(pool.map(parse_chunk, chunks))
+    else:
+        results = [parse_chunk(chunk) for chunk in chunks]
+
+    frames = [_decode_columns(chunk) for chunk, _ in results]
+    frames = [f for f in frames if not f.empty]
+    ok_flags = [flag for _, flags in results for flag in flags]
+
+    rates_df = pd.concat(frames, ignore_index=True) if frames else None
+    return rates_df, ok_flags
@@ -0,0 +1,104 @@
+"""Prefetch in background delle ricerche probabili successive.
+
+Dopo una ricerca l'utente di solito sposta il check-in di una settimana o
+alterna poche occupazioni: queste ricerche vengono calcolate in anticipo,
+con un solo thread a bassa priorità, direttamente nell'archivio condiviso
+dei risultati. Una nuova ricerca della stessa sessione annulla i prefetch
+pendenti, anche quelli già avviati (tra una chiamata e l'altra). I prefetch
+cedono il passo alle ricerche degli utenti: con la finestra del gate quasi
+piena vengono saltati.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+DEFAULT_STEP_DAYS = 7
+MAX_RECENT_OCCUPANCIES = 3
+# Posti della finestra di concorrenza lasciati liberi per le ricerche degli utenti
+DEFAULT_RESERVED_SLOTS = int(os.environ.get("RATESHOPPER_PREFETCH_RESERVED_SLOTS", "1"))
+
+
+def _shift(date_str, days):
+    return (datetime.strptime(date_str, "%Y-%m-%d") + timedelta(days=days)).strftime("%Y-%m-%d")
+
+
+def occupancy_of(search):
+    return (search["adults"], search["children_ages"], search["rooms"])
+
+
+def remember_occupancy(recent, search):
+    """Aggiorna la lista delle ultime occupazioni usate (la più recente in testa)"""
+    occupancy = occupancy_of(search)
+    recent = [occupancy] + [o for o in recent if o != occupancy]
+    return recent[:MAX_RECENT_OCCUPANCIES]
+
+
+def likely_next_searches(search, recent_occupancies=(), step_days=DEFAULT_STEP_DAYS):
+    """Ricerche adiacenti: check-in ± una settimana e le altre occupazioni recenti.
+
+    Le ricerche candidate sono senza sweep (una sola data di arrivo): uno sweep
+    moltiplica le chiamate per un risultato che l'utente potrebbe non chiedere.
+    """
+    search = dict(search, sweep_days=1)
+    candidates = []
+
+    for offset in (step_days, -step_days):
+        if offset < 0 and _shift(search["check_in"], offset) < datetime.now().strftime("%Y-%m-%d"):
+            continue
+        candidates.append(dict(
+            search,
+            check_in=_shift(search["check_in"], offset),
+            check_out=_shift(search["check_out"], offset)
+        ))
+
+    for adults, children_ages, rooms in recent_occupancies:
+        if (adults, children_ages, rooms) != occupancy_of(search):
+            candidates.append(dict(search, adults=adults, children_ages=children_ages, rooms=rooms))
+
+    return candidates
+
+
+def gate_busy(gate, reserved_slots=DEFAULT_RESERVED_SLOTS):
+    """Vero se la finestra del gate non ha posti oltre quelli riservati agli utenti"""
+    return gate is not None and gate.limiter.free_slots() <= reserved_slots
+
+
+class Prefetcher:
+    def __init__(self, store, max_workers=1, cache_if=None, busy=None):
+        self.store = store
+        self.cache_if = cache_if
+        self.busy = busy
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+        self._lock = threading.Lock()
+        self.stats = {"scheduled": 0, "completed": 0, "skipped": 0, "busy": 0, "cancelled": 0, "failed": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _run(self, key, compute, cancel_event):
+        if cancel_event.is_set():
+            self._count("cancelled")
+            return
+        if self.store.get(key) is not None:
+            self._count("skipped")
+            return
+        if self.busy is not None and self.busy():
+            self._count("busy")
+            return
+        try:
+            self.store.get_or_compute(key, lambda: compute(cancel_event), cache_if=self.cache_if)
+            self._count("completed")
+        except Exception:
+            # Un prefetch annullato a metà termina con un'eccezione della funzione di calcolo
+            self._count("cancelled" if cancel_event.is_set() else "failed")
+
+    def schedule(self, jobs, cancel_event):
+        """Accoda i prefetch [(chiave, funzione di calcolo), ...]; `cancel_event` li annulla.
+
+        La funzione di calcolo riceve `cancel_event` per interrompersi tra una chiamata e l'altra.
+        """
+        for key, compute in jobs:
+            self._count("scheduled")
+            self._executor.submit(self._run, key, compute, cancel_event)
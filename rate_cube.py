@@ -0,0 +1,242 @@
+"""Cubo tariffe su disco (NumPy memmap) per sweep molto ampi.
+
+Per ogni valuta e durata del soggiorno il cubo è un array float32 denso di
+forma (occupazione, hotel, data di arrivo, OTA) con il prezzo API grezzo per
+notte (NaN = nessuna tariffa). Gli assi sono codificati a dizionario in
+`meta.json`; i dati sono in un file binario mappato in memoria, quindi la
+lettura della sezione di un hotel o di una data tocca solo le pagine
+necessarie e le sessioni dello stesso server condividono la cache del
+sistema operativo.
+
+Il cubo viene ricostruito dall'archivio (`rate_latest`) dopo gli shop:
+il nuovo file dati viene scritto accanto al precedente e `meta.json` è
+sostituito in modo atomico, così i lettori non vedono mai un cubo parziale.
+
+Esempio:
+    python rate_cube.py --currency EUR --nights 7 --days 365
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import threading
+import time
+import warnings
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import rate_store
+from rounding import lookup_corrections
+
+DEFAULT_CUBE_DIR = os.environ.get(
+    "RATESHOPPER_CUBE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "cube")
+)
+DEFAULT_DAYS = 365
+
+OCCUPANCY_KEY = ["adults", "children", "rooms"]
+
+
+def cube_path(currency, num_nights, cube_dir=None):
+    return os.path.join(cube_dir or DEFAULT_CUBE_DIR, f"{currency}_{int(num_nights)}n")
+
+
+def build_cube(conn, currency, num_nights, date_from=None, days=DEFAULT_DAYS, cube_dir=None):
+    """Ricostruisce il cubo di una valuta e durata dalle ultime tariffe archiviate"""
+    date_from = date_from or datetime.now().strftime("%Y-%m-%d")
+    date_to = (datetime.strptime(date_from, "%Y-%m-%d") + timedelta(days=days - 1)).strftime("%Y-%m-%d")
+
+    # Ultimo shop della valuta, durata e date del cubo, per riconoscere un cubo non aggiornato
+    last_shop_ts = rate_store.last_shop_ts(conn, currency, num_nights, date_from, date_to)
+    rates = pd.read_sql_query(
+        "SELECT hotel, check_in, adults, children, rooms, ota_code, price_raw FROM rate_latest "
+        "WHERE currency = ? AND julianday(check_out) - julianday(check_in) = ? "
+        "AND check_in >= ? AND check_in <= ?",
+        conn,
+        params=[currency, int(num_nights), date_from, date_to]
+    )
+
+    dates = pd.date_range(date_from, date_to, freq="D").strftime("%Y-%m-%d")
+    occupancy_codes, occupancies = pd.MultiIndex.from_frame(rates[OCCUPANCY_KEY]).factorize(sort=True)
+    hotel_codes, hotels = pd.factorize(rates["hotel"], sort=True)
+    ota_codes, otas = pd.factorize(rates["ota_code"], sort=True)
+    date_codes = dates.get_indexer(rates["check_in"])
+
+    shape = (len(occupancies), len(hotels), len(dates), len(otas))
+    path = cube_path(currency, num_nights, cube_dir)
+    os.makedirs(path, exist_ok=True)
+
+    data_file = f"price_raw-{time.time_ns()}.f32"
+    if len(rates):
+        cube = np.memmap(os.path.join(path, data_file), mode="w+", dtype=np.float32, shape=shape)
+        cube[:] = np.nan
+        cube[occupancy_codes, hotel_codes, date_codes, ota_codes] = rates["price_raw"].to_numpy(dtype=np.float32)
+        cube.flush()
+        del cube
+    else:
+        open(os.path.join(path, data_file), "wb").close()
+
+    meta = {
+        "currency": currency,
+        "nights": int(num_nights),
+        "built_at": time.time(),
+        "last_shop_ts": last_shop_ts,
+        "data_file": data_file,
+        "shape": list(shape),
+        "occupancies": [list(map(int, o)) for o in occupancies],
+        "hotels": list(hotels),
+        "dates": list(dates),
+        "otas": list(otas)
+    }
+    tmp_meta = os.path.join(path, "meta.json.tmp")
+    with open(tmp_meta, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(tmp_meta, os.path.join(path, "meta.json"))
+
+    # I vecchi file dati restano leggibili da chi li ha già mappati (unlink su POSIX)
+    for old in glob.glob(os.path.join(path, "price_raw-*.f32")):
+        if os.path.basename(old) != data_file:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+
+    return path
+
+
+class RateCube:
+    """Lettore del cubo: le sezioni vengono lette dal file mappato solo quando richieste"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.shape = tuple(self.meta["shape"])
+        self.currency = self.meta["currency"]
+        self.nights = self.meta["nights"]
+        self.hotels = self.meta["hotels"]
+        self.dates = self.meta["dates"]
+        self.otas = self.meta["otas"]
+        self._occupancy_index = {tuple(o): i for i, o in enumerate(self.meta["occupancies"])}
+        self._hotel_index = {h: i for i, h in enumerate(self.hotels)}
+        self._date_index = {d: i for i, d in enumerate(self.dates)}
+        self._data = None
+        if np.prod(self.shape) > 0:
+            self._data = np.memmap(
+                os.path.join(path, self.meta["data_file"]), mode="r", dtype=np.float32, shape=self.shape
+            )
+
+    def is_stale(self, conn):
+        """True se l'archivio contiene shop successivi al cubo per la sua valuta, durata e date"""
+        if not self.dates:
+            return False
+        last_shop_ts = rate_store.last_shop_ts(conn, self.currency, self.nights, self.dates[0], self.dates[-1])
+        if last_shop_ts is None:
+            return False
+        return last_shop_ts > (self.meta.get("last_shop_ts") or self.meta["built_at"])
+
+    def occupancy(self, adults, children, rooms):
+        return self._occupancy_index.get((int(adults), int(children), int(rooms)))
+
+    def _corrected(self, values, otas, apply_rounding):
+        # Correzione arrotondamenti sulla sola sezione letta
+        if not apply_rounding or values.size == 0:
+            return values
+        frame = pd.DataFrame({
+            "ota_code": np.broadcast_to(np.asarray(otas, dtype=object), values.shape).ravel(),
+            "currency": self.currency,
+            "price_raw": values.ravel()
+        })
+        corrections = lookup_corrections(frame).reshape(values.shape)
+        return values + corrections
+
+    def hotel_slice(self, hotel, adults, children, rooms, apply_rounding=True):
+        """Prezzo per notte date × OTA di un hotel (legge solo il blocco dell'hotel)"""
+        o, h = self.occupancy(adults, children, rooms), self._hotel_index.get(hotel)
+        if self._data is None or o is None or h is None:
+            return None
+        values = np.array(self._data[o, h], dtype=float)
+        return pd.DataFrame(self._corrected(values, self.otas, apply_rounding), index=pd.to_datetime(self.dates), columns=self.otas)
+
+    def date_slice(self, check_in, adults, children, rooms, apply_rounding=True):
+        """Prezzo per notte hotel × OTA per una data di arrivo"""
+        o, d = self.occupancy(adults, children, rooms), self._date_index.get(check_in)
+        if self._data is None or o is None or d is None:
+            return None
+        values = np.array(self._data[o, :, d], dtype=float)
+        return pd.DataFrame(self._corrected(values, self.otas, apply_rounding), index=self.hotels, columns=self.otas)
+
+    def min_price_matrix(self, adults, children, rooms, apply_rounding=True, hotels=None):
+        """Matrice hotel × data con il prezzo minimo tra le OTA (solo gli hotel richiesti)"""
+        o = self.occupancy(adults, children, rooms)
+        if self._data is None or o is None:
+            return None
+        names = [h for h in (hotels or self.hotels) if h in self._hotel_index]
+        if not names:
+            return None
+        rows = [self._hotel_index[h] for h in names]
+        values = self._corrected(np.array(self._data[o, rows], dtype=float), self.otas, apply_rounding)
+        with warnings.catch_warnings():
+            # Le date senza tariffe (tutte NaN) sono il caso normale
+            warnings.simplefilter("ignore", RuntimeWarning)
+            matrix = np.nanmin(values, axis=2)
+        return pd.DataFrame(matrix, index=names, columns=pd.to_datetime(self.dates))
+
+
+class CubeReader:
+    """Apre i cubi su richiesta e li riapre quando vengono ricostruiti"""
+
+    def __init__(self, cube_dir=None):
+        self.cube_dir = cube_dir
+        self._lock = threading.Lock()
+        self._cubes = {}
+
+    def get(self, currency, num_nights):
+        path = cube_path(currency, num_nights, self.cube_dir)
+        meta_path = os.path.join(path, "meta.json")
+        try:
+            mtime = os.path.getmtime(meta_path)
+        except OSError:
+            return None
+
+        with self._lock:
+            cached = self._cubes.get(path)
+            if cached is None or cached[0] != mtime:
+                try:
+                    cached = (mtime, RateCube(path))
+                except FileNotFoundError:
+                    # Ricostruzione in corso: il file dati indicato è appena stato sostituito
+                    cached = (os.path.getmtime(meta_path), RateCube(path))
+                self._cubes[path] = cached
+            return cached[1]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Ricostruzione del cubo tariffe su disco")
+    parser.add_argument("--currency", default="EUR")
+    parser.add_argument("--nights", type=int, nargs="+", default=[7], help="Durate del soggiorno")
+    parser.add_argument("--date-from", default=datetime.now().strftime("%Y-%m-%d"), help="Prima data di arrivo (YYYY-MM-DD)")
+    parser.add_argument("--days", type=int, default=DEFAULT_DAYS, help="Numero di date di arrivo")
+    parser.add_argument("--db", default=rate_store.DEFAULT_DB_PATH, help="Percorso del database SQLite")
+    parser.add_argument("--cube-dir", default=DEFAULT_CUBE_DIR)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    conn = rate_store.connect(args.db)
+    try:
+        for nights in args.nights:
+            path = build_cube(conn, args.currency, nights, args.date_from, args.days, args.cube_dir)
+            cube = RateCube(path)
+            print(f"Cubo {os.path.basename(path)}: forma {cube.shape}, {np.prod(cube.shape) * 4 / 1e6:.1f} MB")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
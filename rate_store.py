@@ -0,0 +1,570 @@
+"""Archivio locale (SQLite) delle tariffe rilevate.
+
+Lo storico è codificato per variazioni: `rate_intervals` contiene una riga
+per ogni periodo in cui una tariffa (hotel, OTA, soggiorno, occupazione) è
+rimasta invariata, con `valid_from` (shop in cui è comparsa o cambiata) e
+`valid_to` (shop in cui è cambiata o sparita, NULL se ancora valida). Uno shop
+che conferma i prezzi precedenti non aggiunge righe, quindi lo spazio cresce
+con i movimenti di prezzo e non con il numero di shop.
+
+Gli intervalli non attraversano i periodi di `SNAPSHOT_PERIOD_SECONDS`
+(allineati all'epoch): il primo shop di ogni periodo riapre tutte le tariffe
+del gruppo, anche se invariate, come uno snapshot completo. La ricostruzione
+di uno shop legge quindi solo gli intervalli iniziati nell'ultimo periodo,
+con tempi indipendenti dalla lunghezza dello storico.
+
+`rate_latest` è lo snapshot compatto dell'ultima tariffa nota per chiave ed è
+la base per il confronto incrementale degli avvisi. `shop_log` registra ogni
+ricerca di un gruppo, anche senza tariffe disponibili: insieme agli
+intervalli permette di ricostruire le tariffe di qualunque shop o momento
+(vedi `load_history`, `as_of_shops`, `load_shop_rates`).
+
+`heatmap_days` e `hotel_info` conservano l'ultimo calendario prezzi
+(economico/medio/alto) e l'anagrafica degli hotel ricercati, per le analisi
+SQL (vedi `analytics`).
+
+`rate_history` (una riga completa per tariffa e shop) è il formato degli
+archivi precedenti: alla connessione viene compattato una volta negli
+intervalli.
+"""
+import os
+import sqlite3
+import time
+
+import pandas as pd
+
+DEFAULT_DB_PATH = os.environ.get(
+    "RATESHOPPER_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "rateshopper.sqlite")
+)
+
+# WAL (predefinito) richiede memoria condivisa sullo stesso host: con worker su più host
+# che condividono l'archivio impostare DELETE per tutti i processi
+DEFAULT_JOURNAL_MODE = os.environ.get("RATESHOPPER_JOURNAL_MODE", "WAL")
+
+# Chiave di un gruppo di ricerca: corrisponde a una singola chiamata get_rates
+GROUP_KEY = ["hotel", "check_in", "check_out", "adults", "children", "rooms", "currency"]
+
+# Chiave di una singola tariffa: gruppo + OTA
+RATE_KEY = GROUP_KEY + ["ota_code"]
+
+RATE_VALUES = ["ota", "price_raw", "price_net", "tax", "timestamp"]
+
+# Valori che aprono un nuovo intervallo quando cambiano (timestamp è l'orario della risposta API)
+CHANGE_VALUES = ["ota", "price_raw", "price_net", "tax"]
+
+# Durata di un periodo tra snapshot completi: ridurla rende non validi gli intervalli già archiviati
+SNAPSHOT_PERIOD_SECONDS = 7 * 24 * 3600
+
+# Date di arrivo compattate per transazione nella conversione dal formato precedente
+COMPACT_BATCH_STAYS = 31
+
+STORED_COLUMNS = RATE_KEY + RATE_VALUES
+
+HEATMAP_COLUMNS = ["hotel", "date", "price_level", "level_value", "check_out", "fetched_at"]
+
+HOTEL_INFO_COLUMNS = [
+    "hotel", "hotel_key", "name", "accommodation_type", "url", "rating", "review_count",
+    "min_price", "max_price", "latitude", "longitude", "amenities", "fetched_at"
+]
+
+_RATE_COLUMNS_SQL = """
+    hotel TEXT NOT NULL,
+    check_in TEXT NOT NULL,
+    check_out TEXT NOT NULL,
+    adults INTEGER NOT NULL,
+    children INTEGER NOT NULL,
+    rooms INTEGER NOT NULL,
+    currency TEXT NOT NULL,
+    ota_code TEXT NOT NULL,
+    ota TEXT,
+    price_raw REAL,
+    price_net REAL,
+    tax REAL,
+    timestamp INTEGER
+"""
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS rate_history (
+    shop_ts REAL NOT NULL,
+    {_RATE_COLUMNS_SQL}
+);
+CREATE INDEX IF NOT EXISTS idx_rate_history_stay
+    ON rate_history (check_in, hotel, shop_ts);
+
+CREATE TABLE IF NOT EXISTS rate_intervals (
+    valid_from REAL NOT NULL,
+    valid_to REAL,
+    {_RATE_COLUMNS_SQL}
+);
+CREATE INDEX IF NOT EXISTS idx_rate_intervals_group
+    ON rate_intervals (check_in, hotel, check_out, adults, children, rooms, currency, valid_from);
+
+CREATE TABLE IF NOT EXISTS rate_latest (
+    shop_ts REAL NOT NULL,
+    {_RATE_COLUMNS_SQL},
+    PRIMARY KEY (hotel, check_in, check_out, adults, children, rooms, currency, ota_code)
+);
+CREATE INDEX IF NOT EXISTS idx_rate_latest_stay
+    ON rate_latest (check_in);
+
+CREATE TABLE IF NOT EXISTS shop_groups (
+    hotel TEXT NOT NULL,
+    check_in TEXT NOT NULL,
+    check_out TEXT NOT NULL,
+    adults INTEGER NOT NULL,
+    children INTEGER NOT NULL,
+    rooms INTEGER NOT NULL,
+    currency TEXT NOT NULL,
+    shop_ts REAL NOT NULL,
+    PRIMARY KEY (hotel, check_in, check_out, adults, children, rooms, currency)
+);
+
+CREATE TABLE IF NOT EXISTS shop_log (
+    hotel TEXT NOT NULL,
+    check_in TEXT NOT NULL,
+    check_out TEXT NOT NULL,
+    adults INTEGER NOT NULL,
+    children INTEGER NOT NULL,
+    rooms INTEGER NOT NULL,
+    currency TEXT NOT NULL,
+    shop_ts REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_shop_log_group
+    ON shop_log (check_in, hotel, check_out, adults, children, rooms, currency, shop_ts);
+
+CREATE TABLE IF NOT EXISTS heatmap_days (
+    hotel TEXT NOT NULL,
+    date TEXT NOT NULL,
+    price_level TEXT,
+    level_value INTEGER,
+    check_out TEXT,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (hotel, date)
+);
+
+CREATE TABLE IF NOT EXISTS hotel_info (
+    hotel TEXT PRIMARY KEY,
+    hotel_key TEXT,
+    name TEXT,
+    accommodation_type TEXT,
+    url TEXT,
+    rating REAL,
+    review_count INTEGER,
+    min_price REAL,
+    max_price REAL,
+    latitude REAL,
+    longitude REAL,
+    amenities TEXT,
+    fetched_at REAL NOT NULL
+);
+"""
+
+
+def connect(db_path=None, journal_mode=None):
+    """Apre (e inizializza se necessario) il database delle tariffe"""
+    db_path = db_path or DEFAULT_DB_PATH
+    directory = os.path.dirname(db_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        conn.execute(f"PRAGMA journal_mode={journal_mode or DEFAULT_JOURNAL_MODE}")
+    except sqlite3.OperationalError:
+        # Archivio aperto da altri processi con un altro journal: il cambio non è possibile
+        pass
+    conn.executescript(SCHEMA)
+    _backfill_shop_log(conn)
+    compact_history(conn)
+    return conn
+
+
+def _backfill_shop_log(conn):
+    # Archivi creati prima di shop_log: gli shop si ricavano dallo storico (senza quelli sold out)
+    if conn.execute("SELECT 1 FROM shop_log LIMIT 1").fetchone() is not None:
+        return
+    if conn.execute("SELECT 1 FROM rate_history LIMIT 1").fetchone() is None:
+        return
+    with conn:
+        conn.execute(
+            f"INSERT INTO shop_log ({', '.join(GROUP_KEY)}, shop_ts) "
+            f"SELECT DISTINCT {', '.join(GROUP_KEY)}, shop_ts FROM rate_history "
+            f"WHERE NOT EXISTS (SELECT 1 FROM shop_log)"
+        )
+
+
+def history_intervals(history, shops):
+    """Intervalli di validità da righe complete per tariffa e shop (vettoriale).
+
+    Un intervallo inizia alla prima comparsa di una tariffa, a un cambio di
+    valori, alla ricomparsa dopo uno shop del gruppo in cui mancava o al primo
+    shop di un nuovo periodo di snapshot; finisce al primo shop del gruppo
+    successivo all'ultima conferma (NaN se non c'è).
+    `shops` elenca tutti gli shop dei gruppi (colonne GROUP_KEY e shop_ts).
+    """
+    history = _normalize_key(history).sort_values(RATE_KEY + ["shop_ts"], kind="stable").reset_index(drop=True)
+    rows = history[GROUP_KEY + ["shop_ts"]].assign(_row=history.index).sort_values("shop_ts", kind="stable")
+    next_shop = pd.merge_asof(
+        rows,
+        _normalize_key(shops[GROUP_KEY + ["shop_ts"]]).rename(columns={"shop_ts": "next_shop_ts"}).sort_values("next_shop_ts"),
+        left_on="shop_ts",
+        right_on="next_shop_ts",
+        by=GROUP_KEY,
+        direction="forward",
+        allow_exact_matches=False
+    ).sort_values("_row")["next_shop_ts"].reset_index(drop=True)
+
+    same_key = (history[RATE_KEY] == history[RATE_KEY].shift()).all(axis=1)
+    # La riga precedente della stessa tariffa è dello shop immediatamente precedente del gruppo
+    continuous = (
+        same_key
+        & (next_shop.shift() == history["shop_ts"])
+        & (_period(history["shop_ts"]) == _period(history["shop_ts"].shift()))
+    )
+    starts = ~(continuous & _same_values(history[CHANGE_VALUES], history[CHANGE_VALUES].shift()))
+    # L'ultima riga di ogni intervallo precede l'inizio del successivo
+    ends = starts.shift(-1, fill_value=True)
+
+    intervals = history[starts].rename(columns={"shop_ts": "valid_from"})
+    intervals["valid_to"] = next_shop[ends.to_numpy()].to_numpy()
+    return intervals[["valid_from", "valid_to"] + STORED_COLUMNS].reset_index(drop=True)
+
+
+def compact_history(conn):
+    """Converte le righe complete di `rate_history` (archivi precedenti) in intervalli.
+
+    Non fa nulla se `rate_history` è vuota. Lavora per blocchi di date di
+    arrivo, ognuno nella propria transazione.
+    """
+    if conn.execute("SELECT 1 FROM rate_history LIMIT 1").fetchone() is None:
+        return
+
+    check_ins = [row[0] for row in conn.execute("SELECT DISTINCT check_in FROM rate_history ORDER BY check_in")]
+    for start in range(0, len(check_ins), COMPACT_BATCH_STAYS):
+        batch = check_ins[start:start + COMPACT_BATCH_STAYS]
+        marks = ", ".join("?" * len(batch))
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            history = pd.read_sql_query(f"SELECT * FROM rate_history WHERE check_in IN ({marks})", conn, params=batch)
+            if history.empty:
+                continue
+            shops = pd.read_sql_query(
+                f"SELECT {', '.join(GROUP_KEY)}, shop_ts FROM shop_log WHERE check_in IN ({marks})",
+                conn,
+                params=batch
+            )
+            intervals = history_intervals(history, shops)
+            conn.executemany(
+                f"INSERT INTO rate_intervals (valid_from, valid_to, {', '.join(STORED_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * (len(STORED_COLUMNS) + 2))})",
+                _to_rows(intervals)
+            )
+            conn.execute(f"DELETE FROM rate_history WHERE check_in IN ({marks})", batch)
+
+
+def _stage_groups(conn, groups_df):
+    # Carica i gruppi richiesti in una tabella temporanea, così le letture
+    # passano dalla chiave primaria invece di scandire tutta la tabella
+    conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS _groups ({', '.join(GROUP_KEY)})")
+    conn.execute("DELETE FROM _groups")
+    conn.executemany(
+        f"INSERT INTO _groups VALUES ({', '.join('?' * len(GROUP_KEY))})",
+        _to_rows(groups_df[GROUP_KEY].drop_duplicates())
+    )
+
+
+def _to_rows(df):
+    # sqlite3 non accetta gli scalari NumPy: converte in tipi Python nativi
+    return list(df.astype(object).where(df.notna(), None).itertuples(index=False, name=None))
+
+
+def load_latest(conn, groups_df):
+    """Restituisce l'ultima tariffa nota per i gruppi indicati e i gruppi già visti in passato"""
+    _stage_groups(conn, groups_df)
+
+    join_on = " AND ".join(f"r.{c} = g.{c}" for c in GROUP_KEY)
+    latest_df = pd.read_sql_query(
+        f"SELECT r.* FROM _groups g JOIN rate_latest r ON {join_on}",
+        conn
+    )
+
+    join_on = " AND ".join(f"s.{c} = g.{c}" for c in GROUP_KEY)
+    known_groups = pd.read_sql_query(
+        f"SELECT s.* FROM _groups g JOIN shop_groups s ON {join_on}",
+        conn
+    )
+
+    return latest_df, known_groups
+
+
+def _covering(shops_alias):
+    # Condizione di join tra uno shop e l'intervallo del suo gruppo valido in quel momento;
+    # il limite inferiore su valid_from (un periodo di snapshot) restringe la scansione dell'indice
+    match = " AND ".join(f"r.{c} = {shops_alias}.{c}" for c in GROUP_KEY)
+    return (
+        f"{match} AND r.valid_from <= {shops_alias}.shop_ts "
+        f"AND r.valid_from > {shops_alias}.shop_ts - {SNAPSHOT_PERIOD_SECONDS} "
+        f"AND (r.valid_to IS NULL OR r.valid_to > {shops_alias}.shop_ts)"
+    )
+
+
+def load_history(conn, groups_df):
+    """Tutte le tariffe dei gruppi indicati, una riga per tariffa e shop (ricostruite dagli intervalli)"""
+    _stage_groups(conn, groups_df)
+
+    join_on = " AND ".join(f"s.{c} = g.{c}" for c in GROUP_KEY)
+    return pd.read_sql_query(
+        f"SELECT s.shop_ts, {', '.join('r.' + c for c in STORED_COLUMNS)} FROM _groups g "
+        f"JOIN shop_log s ON {join_on} JOIN rate_intervals r ON {_covering('s')}",
+        conn
+    )
+
+
+def rates_for_storage(rates_df):
+    """Seleziona le righe disponibili e le colonne da archiviare"""
+    if rates_df is None or rates_df.empty:
+        return pd.DataFrame(columns=STORED_COLUMNS)
+
+    stored = rates_df[rates_df["available"]].copy()
+    for col in STORED_COLUMNS:
+        if col not in stored.columns:
+            stored[col] = None
+    return stored[STORED_COLUMNS]
+
+
+def _same_values(left, right):
+    # Confronto colonna per colonna in cui due valori mancanti sono uguali
+    same = pd.Series(True, index=left.index)
+    for col in CHANGE_VALUES:
+        a, b = left[col], right[col]
+        same &= (a == b) | (a.isna() & b.isna())
+    return same
+
+
+def _period(ts):
+    return ts // SNAPSHOT_PERIOD_SECONDS
+
+
+def _normalize_key(df):
+    return df.astype({"adults": "int64", "children": "int64", "rooms": "int64"})
+
+
+def record_shop(conn, rates_df, groups_df, shop_ts=None):
+    """Registra nello storico le variazioni dello shop e sostituisce l'ultimo snapshot dei gruppi ricercati.
+
+    Negli intervalli si chiudono le tariffe cambiate o sparite e si aprono
+    quelle nuove o cambiate; le tariffe confermate non vengono riscritte, tranne
+    al primo shop di un nuovo periodo di snapshot.
+    Non esegue il commit: il chiamante decide il perimetro della transazione.
+    """
+    shop_ts = shop_ts or time.time()
+    stored = rates_for_storage(rates_df)
+
+    placeholders = ", ".join("?" * (len(STORED_COLUMNS) + 1))
+    columns = ", ".join(["shop_ts"] + STORED_COLUMNS)
+    rows = [(shop_ts,) + row for row in _to_rows(stored)]
+
+    _stage_groups(conn, groups_df)
+    join_on = " AND ".join(f"r.{c} = g.{c}" for c in GROUP_KEY)
+    open_df = pd.read_sql_query(
+        f"SELECT r.rowid AS interval_id, r.valid_from, {', '.join('r.' + c for c in STORED_COLUMNS)} FROM _groups g "
+        f"JOIN rate_intervals r ON {join_on} WHERE r.valid_to IS NULL",
+        conn
+    )
+
+    merged = _normalize_key(open_df).merge(
+        _normalize_key(stored), on=RATE_KEY, how="outer", suffixes=("_old", "_new"), indicator=True
+    )
+    both = merged["_merge"] == "both"
+    unchanged = both & (_period(merged["valid_from"]) == _period(shop_ts)) & _same_values(
+        merged[[c + "_old" for c in CHANGE_VALUES]].set_axis(CHANGE_VALUES, axis=1),
+        merged[[c + "_new" for c in CHANGE_VALUES]].set_axis(CHANGE_VALUES, axis=1)
+    )
+    closed = merged.loc[(merged["_merge"] == "left_only") | (both & ~unchanged), "interval_id"]
+    opened = merged.loc[(merged["_merge"] == "right_only") | (both & ~unchanged)]
+    opened = opened[RATE_KEY + [c + "_new" for c in RATE_VALUES]].set_axis(STORED_COLUMNS, axis=1)
+
+    conn.executemany(
+        "UPDATE rate_intervals SET valid_to = ? WHERE rowid = ?",
+        [(shop_ts, int(interval_id)) for interval_id in closed]
+    )
+    conn.executemany(
+        f"INSERT INTO rate_intervals (valid_from, {', '.join(STORED_COLUMNS)}) VALUES ({placeholders})",
+        [(shop_ts,) + row for row in _to_rows(opened)]
+    )
+
+    conn.execute(
+        f"DELETE FROM rate_latest WHERE ({', '.join(GROUP_KEY)}) IN (SELECT * FROM _groups)"
+    )
+    conn.executemany(f"INSERT INTO rate_latest ({columns}) VALUES ({placeholders})", rows)
+    conn.execute(
+        f"INSERT OR REPLACE INTO shop_groups ({', '.join(GROUP_KEY)}, shop_ts) "
+        f"SELECT *, ? FROM _groups",
+        (shop_ts,)
+    )
+    conn.execute(
+        f"INSERT INTO shop_log ({', '.join(GROUP_KEY)}, shop_ts) SELECT *, ? FROM _groups",
+        (shop_ts,)
+    )
+
+
+def record_heatmap(conn, heatmap_data, fetched_at=None):
+    """Aggiorna il calendario prezzi degli hotel con le heatmap elaborate (process_heatmap_response).
+
+    Non esegue il commit.
+    """
+    fetched_at = fetched_at or time.time()
+    frames = [
+        item["data"].assign(check_out=item["check_out"], fetched_at=fetched_at)
+        for item in heatmap_data or []
+        if item is not None and not item["data"].empty
+    ]
+    if not frames:
+        return
+    days = pd.concat(frames, ignore_index=True)
+    days["date"] = pd.to_datetime(days["date"]).dt.strftime("%Y-%m-%d")
+    conn.executemany(
+        f"INSERT OR REPLACE INTO heatmap_days ({', '.join(HEATMAP_COLUMNS)}) "
+        f"VALUES ({', '.join('?' * len(HEATMAP_COLUMNS))})",
+        _to_rows(days[HEATMAP_COLUMNS])
+    )
+
+
+def record_hotel_info(conn, hotel_info, fetched_at=None):
+    """Aggiorna l'anagrafica degli hotel configurati (info hotel della ricerca, colonna our_hotel_name).
+
+    Non esegue il commit.
+    """
+    if hotel_info is None or hotel_info.empty:
+        return
+    info = hotel_info.rename(columns={"our_hotel_name": "hotel"}).assign(fetched_at=fetched_at or time.time())
+    conn.executemany(
+        f"INSERT OR REPLACE INTO hotel_info ({', '.join(HOTEL_INFO_COLUMNS)}) "
+        f"VALUES ({', '.join('?' * len(HOTEL_INFO_COLUMNS))})",
+        _to_rows(info.reindex(columns=HOTEL_INFO_COLUMNS))
+    )
+
+
+def last_shop_ts(conn, currency=None, nights=None, check_in_from=None, check_in_to=None):
+    """Orario dell'ultimo shop archiviato, anche solo per valuta, durata e date di arrivo (None se assente)"""
+    where, params = ["1 = 1"], []
+    if currency is not None:
+        where.append("currency = ?")
+        params.append(currency)
+    if nights is not None:
+        where.append("julianday(check_out) - julianday(check_in) = ?")
+        params.append(int(nights))
+    if check_in_from is not None:
+        where.append("check_in >= ?")
+        params.append(check_in_from)
+    if check_in_to is not None:
+        where.append("check_in <= ?")
+        params.append(check_in_to)
+    return conn.execute(f"SELECT MAX(shop_ts) FROM shop_log WHERE {' AND '.join(where)}", params).fetchone()[0]
+
+
+def change_events(conn, since):
+    """Shop (colonne GROUP_KEY e shop_ts) successivi a `since` in cui una tariffa del gruppo è comparsa, cambiata o sparita.
+
+    Le riaperture di inizio periodo con valori invariati non sono variazioni.
+    """
+    intervals = pd.read_sql_query(
+        f"SELECT valid_from, valid_to, {', '.join(RATE_KEY + CHANGE_VALUES)} FROM rate_intervals "
+        f"WHERE valid_from >= ? OR valid_to >= ?",
+        conn,
+        params=[since, since]
+    )
+    opened = intervals[intervals["valid_from"] >= since].rename(columns={"valid_from": "shop_ts"})
+    closed = intervals[intervals["valid_to"] >= since].rename(columns={"valid_to": "shop_ts"})
+    merged = opened.drop(columns="valid_to").merge(
+        closed.drop(columns="valid_from"), on=RATE_KEY + ["shop_ts"], how="outer",
+        suffixes=("_new", "_old"), indicator=True
+    )
+    carried = (merged["_merge"] == "both") & _same_values(
+        merged[[c + "_old" for c in CHANGE_VALUES]].set_axis(CHANGE_VALUES, axis=1),
+        merged[[c + "_new" for c in CHANGE_VALUES]].set_axis(CHANGE_VALUES, axis=1)
+    )
+    return merged.loc[~carried, GROUP_KEY + ["shop_ts"]].drop_duplicates().reset_index(drop=True)
+
+
+def _range_filter(adults, children, rooms, currency, nights=None, check_in_from=None, check_in_to=None):
+    where = "adults = ? AND children = ? AND rooms = ? AND currency = ?"
+    params = [int(adults), int(children), int(rooms), currency]
+
+    if nights is not None:
+        where += " AND julianday(check_out) - julianday(check_in) = ?"
+        params.append(int(nights))
+    if check_in_from is not None:
+        where += " AND check_in >= ?"
+        params.append(check_in_from)
+    if check_in_to is not None:
+        where += " AND check_in <= ?"
+        params.append(check_in_to)
+    return where, params
+
+
+def load_latest_range(conn, adults, children, rooms, currency, nights=None, check_in_from=None, check_in_to=None):
+    """Ultime tariffe note per un'occupazione e valuta, su un intervallo di date di arrivo"""
+    where, params = _range_filter(adults, children, rooms, currency, nights, check_in_from, check_in_to)
+    return pd.read_sql_query(f"SELECT * FROM rate_latest WHERE {where}", conn, params=params)
+
+
+def as_of_shops(conn, targets):
+    """Shop più recente di ogni gruppo al momento indicato (join "as of" per gruppo).
+
+    `targets` ha le colonne GROUP_KEY e `as_of` (epoch, anche diverso per riga).
+    Restituisce le stesse righe con `shop_ts` dell'ultimo shop non successivo
+    ad `as_of` (NaN se il gruppo non era ancora stato ricercato). Ogni ricerca
+    è una discesa nell'indice ordinato (gruppo, shop_ts) di `shop_log`, quindi
+    il costo non dipende dalla lunghezza dello storico.
+    """
+    targets = targets[GROUP_KEY + ["as_of"]].reset_index(drop=True)
+    conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS _targets (_order, {', '.join(GROUP_KEY)}, as_of)")
+    conn.execute("DELETE FROM _targets")
+    conn.executemany(
+        f"INSERT INTO _targets VALUES ({', '.join('?' * (len(GROUP_KEY) + 2))})",
+        _to_rows(targets.assign(as_of=targets["as_of"].astype(float)).reset_index())
+    )
+
+    match = " AND ".join(f"s.{c} = t.{c}" for c in GROUP_KEY)
+    shop_ts = pd.read_sql_query(
+        f"SELECT t._order, (SELECT MAX(s.shop_ts) FROM shop_log s WHERE {match} AND s.shop_ts <= t.as_of) AS shop_ts "
+        f"FROM _targets t ORDER BY t._order",
+        conn
+    )
+    return targets.assign(shop_ts=shop_ts["shop_ts"].astype(float).to_numpy())
+
+
+def load_shop_rates(conn, shops):
+    """Tariffe archiviate negli shop indicati (colonne GROUP_KEY e shop_ts)"""
+    shops = shops.dropna(subset=["shop_ts"])[GROUP_KEY + ["shop_ts"]].drop_duplicates()
+    conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS _shops ({', '.join(GROUP_KEY)}, shop_ts)")
+    conn.execute("DELETE FROM _shops")
+    conn.executemany(
+        f"INSERT INTO _shops VALUES ({', '.join('?' * (len(GROUP_KEY) + 1))})",
+        _to_rows(shops)
+    )
+
+    return pd.read_sql_query(
+        f"SELECT s.shop_ts, {', '.join('r.' + c for c in STORED_COLUMNS)} FROM _shops s "
+        f"JOIN rate_intervals r ON {_covering('s')}",
+        conn
+    )
+
+
+def load_as_of_range(conn, as_of, adults, children, rooms, currency, nights=None, check_in_from=None,
+                     check_in_to=None):
+    """Come load_latest_range, ma con le tariffe note al momento `as_of` (epoch).
+
+    Restituisce (tariffe, gruppi): per ogni gruppo ricercato entro `as_of` le
+    tariffe del suo ultimo shop precedente, e l'orario di quello shop.
+    """
+    where, params = _range_filter(adults, children, rooms, currency, nights, check_in_from, check_in_to)
+    groups = pd.read_sql_query(
+        f"SELECT DISTINCT {', '.join(GROUP_KEY)} FROM shop_log WHERE {where} AND shop_ts <= ?",
+        conn,
+        params=params + [as_of]
+    )
+    shops = as_of_shops(conn, groups.assign(as_of=float(as_of)))
+    return load_shop_rates(conn, shops), shops.drop(columns="as_of")
@@ -0,0 +1,245 @@
+"""Pianificazione dei refresh in base alla volatilità osservata.
+
+Dallo storico (registro degli shop e intervalli di validità) si ricava, per
+ogni hotel e fascia di anticipo (giorni tra lo shop e l'arrivo), la frequenza
+con cui le tariffe di un soggiorno cambiano tra due shop consecutivi.
+Assumendo cambi come eventi di Poisson con frequenza λ, ricontrollare un
+soggiorno ogni T giorni rileva in media 1 - exp(-λ·T) cambi per chiamata.
+Gli intervalli vengono scelti tra quelli candidati assegnando le chiamate, a
+partire dal budget giornaliero, alle fasce con il maggior numero di cambi
+rilevati per chiamata aggiuntiva.
+
+Lo schedule può accodare nella coda di lavoro i soggiorni scaduti.
+
+Esempio:
+    python refresh_scheduler.py --budget 2000
+    python refresh_scheduler.py --budget 2000 --enqueue
+"""
+import argparse
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import rate_store
+
+DEFAULT_HISTORY_DAYS = 30
+# Fasce di anticipo (giorni) e intervalli di refresh candidati (ore)
+LEAD_BUCKETS = [0, 7, 14, 30, 60, 90, 180, 365]
+CANDIDATE_INTERVALS_HOURS = [3, 6, 12, 24, 48, 72, 168, 336, 720]
+# Senza budget: si refresha più spesso finché ogni chiamata in più rileva almeno questi cambi
+DEFAULT_MIN_YIELD = 0.05
+
+SCHEDULE_COLUMNS = [
+    "hotel", "lead_bucket", "slices", "intervals", "changes", "change_rate_per_day",
+    "interval_hours", "calls_per_day", "changes_per_day"
+]
+
+
+def lead_bucket_labels(buckets=LEAD_BUCKETS):
+    return [f"{low}-{high - 1} g" for low, high in zip(buckets[:-1], buckets[1:])] + [f"{buckets[-1]}+ g"]
+
+
+def _bucket(lead_days, buckets=LEAD_BUCKETS):
+    return np.clip(np.searchsorted(np.asarray(buckets), lead_days, side="right") - 1, 0, len(buckets) - 1)
+
+
+def observed_changes(conn, history_days=DEFAULT_HISTORY_DAYS, now=None):
+    """Intervalli tra shop consecutivi dello stesso soggiorno, con esito (cambiato o no).
+
+    Un soggiorno è cambiato in uno shop se lì si è aperto o chiuso un
+    intervallo di validità di una sua tariffa (prezzo cambiato, OTA comparsa o
+    sparita).
+    """
+    now = now or time.time()
+    since = now - history_days * 86400
+    group_columns = ", ".join(rate_store.GROUP_KEY)
+    shops = pd.read_sql_query(
+        f"SELECT {group_columns}, shop_ts FROM shop_log WHERE shop_ts >= ?",
+        conn,
+        params=[since]
+    )
+    if shops.empty:
+        return pd.DataFrame(columns=["hotel", "check_in", "shop_ts", "interval_days", "lead_days", "changed"])
+
+    events = rate_store.change_events(conn, since)
+    shops = shops.drop_duplicates().sort_values(rate_store.GROUP_KEY + ["shop_ts"], kind="stable")
+    changed = shops.merge(
+        events.assign(_event=True), on=rate_store.GROUP_KEY + ["shop_ts"], how="left"
+    )["_event"].notna().to_numpy()
+
+    same_group = (shops[rate_store.GROUP_KEY] == shops[rate_store.GROUP_KEY].shift()).all(axis=1)
+    intervals = shops.assign(
+        interval_days=shops["shop_ts"].diff() / 86400,
+        changed=changed
+    )[same_group.to_numpy()]
+
+    check_in_ts = (pd.to_datetime(intervals["check_in"]) - pd.Timestamp("1970-01-01")).dt.total_seconds()
+    intervals["lead_days"] = (check_in_ts - intervals["shop_ts"]) / 86400
+    return intervals[["hotel", "check_in", "shop_ts", "interval_days", "lead_days", "changed"]].reset_index(drop=True)
+
+
+def change_rates(intervals, buckets=LEAD_BUCKETS):
+    """Frequenza di cambio (per giorno) per hotel e fascia di anticipo.
+
+    Stimatore per osservazioni a intervalli: λ = -ln((n - X + 0.5) / (n + 0.5)) / Ī,
+    con n intervalli, X cambiati e Ī durata media (robusto anche se X = n).
+    """
+    intervals = intervals[intervals["lead_days"] >= 0]
+    if intervals.empty:
+        return pd.DataFrame(columns=["hotel", "lead_bucket", "intervals", "changes", "change_rate_per_day"])
+
+    grouped = intervals.assign(lead_bucket=_bucket(intervals["lead_days"].to_numpy(), buckets)).groupby(
+        ["hotel", "lead_bucket"]
+    ).agg(intervals=("changed", "size"), changes=("changed", "sum"), mean_interval=("interval_days", "mean"))
+
+    n, x = grouped["intervals"].to_numpy(dtype=float), grouped["changes"].to_numpy(dtype=float)
+    grouped["change_rate_per_day"] = -np.log((n - x + 0.5) / (n + 0.5)) / grouped["mean_interval"].to_numpy()
+    return grouped.drop(columns="mean_interval").reset_index()
+
+
+def tracked_slices(conn, now=None, buckets=LEAD_BUCKETS):
+    """Soggiorni futuri già ricercati, con fascia di anticipo e ultimo shop"""
+    now = now or time.time()
+    groups = pd.read_sql_query(
+        "SELECT * FROM shop_groups WHERE check_in >= ?",
+        conn,
+        params=[datetime.fromtimestamp(now).strftime("%Y-%m-%d")]
+    )
+    check_in_ts = (pd.to_datetime(groups["check_in"]) - pd.Timestamp("1970-01-01")).dt.total_seconds()
+    groups["lead_bucket"] = _bucket(((check_in_ts - now) / 86400).to_numpy(), buckets)
+    return groups
+
+
+def plan_intervals(rates, slices, budget_per_day=None, min_yield=DEFAULT_MIN_YIELD,
+                   intervals_hours=CANDIDATE_INTERVALS_HOURS):
+    """Intervallo di refresh per fascia che massimizza i cambi rilevati per chiamata.
+
+    `rates` ha una riga per fascia (change_rate_per_day) e `slices` il numero di
+    soggiorni della fascia. Con il budget (chiamate al giorno) le chiamate vanno
+    agli incrementi di frequenza con la resa marginale più alta; senza budget
+    si accettano gli incrementi con resa ≥ `min_yield` cambi per chiamata.
+    Restituisce l'indice dell'intervallo scelto per ogni fascia.
+    """
+    periods = np.sort(np.asarray(intervals_hours, dtype=float))[::-1] / 24  # dal più lungo
+    lam = np.nan_to_num(np.asarray(rates, dtype=float))[:, None]
+    n = np.asarray(slices, dtype=float)[:, None]
+
+    # Cambi rilevati e chiamate al giorno per ogni (fascia, intervallo)
+    detected = n * (1 - np.exp(-lam * periods)) / periods
+    calls = n / periods
+
+    # Incrementi passando all'intervallo successivo (più breve): la resa marginale è
+    # decrescente per fascia, quindi l'ordinamento globale rispetta l'ordine per fascia
+    gain = np.diff(detected, axis=1)
+    cost = np.diff(calls, axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = np.where(cost > 0, gain / cost, 0.0)
+
+    chosen = np.zeros(len(n), dtype=int)
+    order = np.argsort(-ratio, axis=None, kind="stable")
+    steps = np.column_stack(np.unravel_index(order, ratio.shape))
+    spent = calls[:, 0].sum()
+    for (s, k), r in zip(steps, ratio.ravel()[order]):
+        if r < min_yield or (k != chosen[s]):
+            continue
+        if budget_per_day is not None and spent + cost[s, k] > budget_per_day:
+            continue
+        spent += cost[s, k]
+        chosen[s] = k + 1
+
+    return len(periods) - 1 - chosen
+
+
+def build_schedule(conn, budget_per_day=None, min_yield=DEFAULT_MIN_YIELD, history_days=DEFAULT_HISTORY_DAYS,
+                   now=None, intervals_hours=CANDIDATE_INTERVALS_HOURS):
+    """Schedule per hotel e fascia di anticipo, con il volume di chiamate previsto"""
+    now = now or time.time()
+    rates = change_rates(observed_changes(conn, history_days, now))
+    slices = tracked_slices(conn, now).groupby(["hotel", "lead_bucket"]).size().rename("slices").reset_index()
+    if slices.empty:
+        return pd.DataFrame(columns=SCHEDULE_COLUMNS)
+
+    schedule = slices.merge(rates, on=["hotel", "lead_bucket"], how="left")
+    # Fasce senza storico: frequenza mediana dello stesso anticipo, altrimenti di tutte le fasce
+    fallback = rates.groupby("lead_bucket")["change_rate_per_day"].median()
+    schedule["change_rate_per_day"] = schedule["change_rate_per_day"].fillna(schedule["lead_bucket"].map(fallback))
+    schedule["change_rate_per_day"] = schedule["change_rate_per_day"].fillna(rates["change_rate_per_day"].median())
+    schedule[["intervals", "changes"]] = schedule[["intervals", "changes"]].fillna(0).astype(int)
+
+    hours = np.sort(np.asarray(intervals_hours, dtype=float))
+    chosen = plan_intervals(schedule["change_rate_per_day"], schedule["slices"], budget_per_day, min_yield, hours)
+    period_days = hours[chosen] / 24
+    lam = schedule["change_rate_per_day"].fillna(0).to_numpy()
+
+    schedule["interval_hours"] = hours[chosen]
+    schedule["calls_per_day"] = schedule["slices"] / period_days
+    schedule["changes_per_day"] = schedule["slices"] * (1 - np.exp(-lam * period_days)) / period_days
+    schedule["lead_bucket"] = np.asarray(lead_bucket_labels())[schedule["lead_bucket"].to_numpy()]
+    return schedule[SCHEDULE_COLUMNS].round({"change_rate_per_day": 3, "calls_per_day": 1, "changes_per_day": 2})
+
+
+def due_slices(conn, schedule, now=None):
+    """Soggiorni il cui ultimo shop è più vecchio dell'intervallo della propria fascia"""
+    now = now or time.time()
+    slices = tracked_slices(conn, now)
+    if slices.empty or schedule.empty:
+        return slices.iloc[0:0]
+    slices["lead_bucket"] = np.asarray(lead_bucket_labels())[slices["lead_bucket"].to_numpy()]
+    slices = slices.merge(schedule[["hotel", "lead_bucket", "interval_hours"]], on=["hotel", "lead_bucket"])
+    return slices[slices["shop_ts"] + slices["interval_hours"] * 3600 <= now].reset_index(drop=True)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Pianificazione dei refresh in base alla volatilità delle tariffe")
+    parser.add_argument("--budget", type=float, help="Chiamate API al giorno disponibili (default: nessun limite)")
+    parser.add_argument("--min-yield", type=float, default=DEFAULT_MIN_YIELD,
+                        help="Cambi rilevati minimi per chiamata aggiuntiva")
+    parser.add_argument("--history-days", type=int, default=DEFAULT_HISTORY_DAYS, help="Giorni di storico analizzati")
+    parser.add_argument("--enqueue", action="store_true", help="Accoda nella coda di lavoro i soggiorni scaduti")
+    parser.add_argument("--db", default=rate_store.DEFAULT_DB_PATH, help="Percorso del database SQLite")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    conn = rate_store.connect(args.db)
+    try:
+        schedule = build_schedule(conn, args.budget, args.min_yield, args.history_days)
+        due = due_slices(conn, schedule) if args.enqueue else None
+    finally:
+        conn.close()
+
+    if schedule.empty:
+        print("Nessun soggiorno futuro nell'archivio: eseguire prima uno shop")
+        return 1
+
+    for _, row in schedule.iterrows():
+        print(
+            f"- {row['hotel']} [{row['lead_bucket']}]: {row['slices']} soggiorni, "
+            f"λ={row['change_rate_per_day']:.3f}/g ({row['changes']}/{row['intervals']} cambi), "
+            f"ogni {row['interval_hours']:g} h → {row['calls_per_day']:.1f} chiamate/g, {row['changes_per_day']:.2f} cambi/g"
+        )
+    calls, changes = schedule["calls_per_day"].sum(), schedule["changes_per_day"].sum()
+    print(f"Volume previsto: {calls:.0f} chiamate/giorno, {changes:.1f} cambi rilevati/giorno ({changes / calls:.3f} per chiamata)")
+
+    if due is not None:
+        import work_queue
+
+        # shop_groups conserva solo il numero di bambini: i soggiorni con bambini restano ai job con le età
+        with_children = due["children"] > 0
+        if with_children.any():
+            print(f"Soggiorni con bambini non accodati (età non archiviate): {int(with_children.sum())}")
+        tasks = due[~with_children].assign(children_ages="")[work_queue.TASK_KEY]
+        queue_conn = work_queue.connect()
+        try:
+            print(f"Soggiorni da aggiornare accodati: {work_queue.enqueue(queue_conn, tasks)}")
+        finally:
+            queue_conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
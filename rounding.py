@@ -0,0 +1,126 @@
+"""Correzione degli arrotondamenti delle tariffe Xotelo.
+
+L'API Xotelo restituisce rate e tax come interi arrotondati per difetto: la
+correzione (per notte) compensa la differenza rispetto ai prezzi reali su
+TripAdvisor. I valori sono in una tabella di configurazione (CSV) con una
+riga per OTA, valuta e fascia di prezzo opzionale:
+
+    ota_code,currency,price_min,price_max,correction
+    BookingCom,EUR,,,2
+
+`currency` vale "*" per tutte le valute; `price_min` (incluso) e `price_max`
+(escluso) si riferiscono al prezzo API grezzo per notte e possono restare
+vuoti. Se più righe corrispondono vince la più specifica (valuta esplicita,
+poi fascia di prezzo; a parità l'ultima). La tabella viene applicata in blocco
+all'intero DataFrame delle tariffe, senza rielaborare le risposte.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_CORRECTIONS_PATH = os.environ.get(
+    "RATESHOPPER_CORRECTIONS",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "config", "rounding_corrections.csv")
+)
+
+CORRECTION_COLUMNS = ["ota_code", "currency", "price_min", "price_max", "correction"]
+
+ANY_CURRENCY = "*"
+
+_cache = {}
+
+
+def _prepare(table):
+    table = table.reindex(columns=CORRECTION_COLUMNS).copy()
+    table["ota_code"] = table["ota_code"].astype(str)
+    table["currency"] = table["currency"].fillna(ANY_CURRENCY).astype(str).str.upper()
+    table.loc[table["currency"] == "", "currency"] = ANY_CURRENCY
+    table["price_min"] = pd.to_numeric(table["price_min"], errors="coerce")
+    table["price_max"] = pd.to_numeric(table["price_max"], errors="coerce")
+    table["correction"] = pd.to_numeric(table["correction"], errors="coerce").fillna(0.0)
+    # Priorità: valuta esplicita prima del jolly, poi le fasce di prezzo più ristrette
+    table["_priority"] = (
+        (table["currency"] != ANY_CURRENCY).astype(int) * 2
+        + (table["price_min"].notna() | table["price_max"].notna()).astype(int)
+    )
+    return table
+
+
+def load_corrections(path=None):
+    """Legge la tabella delle correzioni; ricaricata solo se il file è cambiato"""
+    path = path or DEFAULT_CORRECTIONS_PATH
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return _prepare(pd.DataFrame(columns=CORRECTION_COLUMNS))
+
+    cached = _cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    table = _prepare(pd.read_csv(path, dtype={"ota_code": str, "currency": str}))
+    _cache[path] = (mtime, table)
+    return table
+
+
+def save_corrections(table, path=None):
+    """Scrive la tabella delle correzioni (ad es. dopo una calibrazione)"""
+    path = path or DEFAULT_CORRECTIONS_PATH
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    table = table.reindex(columns=CORRECTION_COLUMNS)
+    tmp_path = path + ".tmp"
+    table.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    _cache.pop(path, None)
+
+
+def lookup_corrections(rates_df, table=None):
+    """Correzione per notte di ogni riga di `rates_df` (array allineato alle righe)"""
+    table = load_corrections() if table is None else _prepare(table)
+    corrections = np.zeros(len(rates_df))
+    if table.empty or rates_df.empty:
+        return corrections
+
+    # OTA e valute codificate a dizionario: i confronti avvengono su interi
+    ota_codes, ota_values = pd.factorize(rates_df["ota_code"])
+    currency_codes, currency_values = pd.factorize(rates_df["currency"])
+    ota_index = {code: i for i, code in enumerate(ota_values)}
+    currency_upper = np.array([str(c).upper() for c in currency_values], dtype=object)
+    price = pd.to_numeric(rates_df["price_raw"], errors="coerce").to_numpy(dtype=float)
+
+    # Regole dalla meno alla più specifica: le più specifiche sovrascrivono
+    for rule in table.sort_values("_priority", kind="stable").itertuples(index=False):
+        ota = ota_index.get(rule.ota_code)
+        if ota is None:
+            continue
+        mask = ota_codes == ota
+        if rule.currency != ANY_CURRENCY:
+            mask &= np.isin(currency_codes, np.flatnonzero(currency_upper == rule.currency))
+        if not pd.isna(rule.price_min):
+            mask &= price >= rule.price_min
+        if not pd.isna(rule.price_max):
+            mask &= price < rule.price_max
+        corrections[mask] = rule.correction
+
+    return corrections
+
+
+def apply_corrections(rates_df, num_nights, table=None):
+    """Ricalcola rounding_correction, price e price_total a partire dai prezzi grezzi.
+
+    Modifica `rates_df` e lo restituisce. `num_nights` può essere un numero o
+    un array con le notti di ogni riga. Le righe non disponibili restano a 0.
+    """
+    corrections = lookup_corrections(rates_df, table)
+    if "available" in rates_df.columns:
+        corrections = np.where(rates_df["available"].to_numpy(dtype=bool), corrections, 0.0)
+
+    nights = np.asarray(num_nights)
+    rates_df["rounding_correction"] = corrections
+    rates_df["price"] = rates_df["price_raw"].to_numpy() + corrections
+    rates_df["price_total_raw"] = rates_df["price_raw"].to_numpy() * nights
+    rates_df["price_total"] = rates_df["price"].to_numpy() * nights
+    if "price_night" in rates_df.columns:
+        rates_df["price_night"] = rates_df["price"]
+    return rates_df
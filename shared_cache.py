@@ -0,0 +1,129 @@
+"""Archivio dei risultati condiviso tra le sessioni dello stesso processo.
+
+Le ricerche identiche lanciate da utenti diversi vengono calcolate una sola
+volta: il primo richiedente esegue il calcolo, gli altri attendono lo stesso
+risultato invece di ripetere le chiamate a Xotelo (coalescenza delegata a
+`SingleFlight`). I valori restituiti sono condivisi e vanno trattati in sola
+lettura (copiare prima di modificarli).
+"""
+import threading
+import time
+
+from singleflight import SingleFlight
+
+DEFAULT_TTL_SECONDS = 15 * 60
+
+
+class SharedResultStore:
+    def __init__(self, ttl_seconds=DEFAULT_TTL_SECONDS, max_entries=256):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._flight = SingleFlight()
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def stats(self):
+        """Ricerche servite dalla cache, calcolate e in attesa di un calcolo identico già in corso"""
+        with self._lock:
+            return {"hits": self._hits, "misses": self._misses, "coalesced": self._flight.stats["saved"]}
+
+    def _fresh(self, entry, ttl):
+        fetched_at, _ = entry
+        return time.time() - fetched_at <= ttl
+
+    def get(self, key, ttl=None):
+        """Valore in cache se ancora valido, altrimenti None"""
+        ttl = self.ttl_seconds if ttl is None else ttl
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._fresh(entry, ttl):
+                return entry[1]
+        return None
+
+    def fetched_at(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[0] if entry is not None else None
+
+    def get_entry(self, key):
+        """(orario di calcolo, valore) anche se scaduto, oppure None"""
+        with self._lock:
+            return self._entries.get(key)
+
+    def is_refreshing(self, key):
+        return self._flight.in_flight(key)
+
+    def refresh_in_background(self, key, compute, cache_if=None):
+        """Ricalcola la voce in un thread separato, se non è già in corso un calcolo.
+
+        Fino al termine del calcolo `get_entry` continua a restituire il valore
+        precedente (stale-while-revalidate); un risultato scartato da `cache_if`
+        lascia la voce precedente.
+        """
+        if self._flight.in_flight(key):
+            return False
+
+        def _refresh():
+            try:
+                self._flight.do(key, lambda: self._compute(key, compute, cache_if))
+            except Exception:
+                pass  # la voce precedente resta disponibile
+
+        thread = threading.Thread(target=_refresh, name="shared-cache-refresh", daemon=True)
+        thread.start()
+        # Al ritorno il calcolo è registrato: is_refreshing è subito vero
+        while thread.is_alive() and not self._flight.in_flight(key):
+            time.sleep(0.001)
+        return True
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            if len(self._entries) > self.max_entries:
+                # Elimina le voci più vecchie
+                oldest = sorted(self._entries.items(), key=lambda item: item[1][0])
+                for old_key, _ in oldest[:len(self._entries) - self.max_entries]:
+                    del self._entries[old_key]
+
+    def get_or_compute(self, key, compute, ttl=None, cache_if=None):
+        """Restituisce il valore in cache o lo calcola una sola volta per tutti i richiedenti.
+
+        Se `cache_if(valore)` è falso (es. tutte le chiamate fallite) il valore
+        viene restituito ai richiedenti in attesa ma non conservato.
+        """
+        ttl = self.ttl_seconds if ttl is None else ttl
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._fresh(entry, ttl):
+                self._hits += 1
+                return entry[1]
+
+        def lead():
+            # Un calcolo appena concluso può aver già salvato la voce
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and self._fresh(entry, ttl):
+                    self._hits += 1
+                    return entry[1]
+            return self._compute(key, compute, cache_if)
+
+        return self._flight.do(key, lead)
+
+    def _compute(self, key, compute, cache_if=None):
+        with self._lock:
+            self._misses += 1
+        value = compute()
+        if cache_if is None or cache_if(value):
+            self.put(key, value)
+        return value
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
@@ -0,0 +1,351 @@
+"""Job di shop di lunga durata, riprendibili.
+
+Un job è uno sweep hotel × date di arrivo suddiviso in fette (una per data di
+arrivo). Il manifest del job (`manifest.json` nella cartella del job) elenca
+i parametri e lo stato di ogni fetta; ogni fetta completata viene salvata
+subito nell'archivio tariffe (con gli avvisi, come lo shop headless) e
+segnata nel manifest. Un job interrotto (eccezione, rete, riavvio) riparte
+solo dalle fette mancanti e, nelle fette parziali, dagli hotel le cui
+chiamate erano fallite. Avanzamento e tempo stimato sono letti dal manifest,
+quindi sono disponibili sia alla dashboard sia alla riga di comando.
+
+Un solo runner per job: l'esecuzione tiene una transazione esclusiva su
+`run.lock` (SQLite, rilasciata dal sistema operativo se il processo muore)
+e aggiorna il file `heartbeat` anche durante le fette più lunghe.
+
+Esempio:
+    python shop_jobs.py --check-in 2026-08-01 --days 90 --nights 7
+    python shop_jobs.py --status
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+import alerts
+import rate_store
+from core import XoteloAPI, hotel_keys
+from fetch_engine import DEFAULT_MAX_WORKERS
+from headless import shop_rates_batch
+
+DEFAULT_JOBS_DIR = os.environ.get(
+    "RATESHOPPER_JOBS_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "jobs")
+)
+
+# Un job "in corso" senza aggiornamenti del manifest da più di così è considerato interrotto
+STALE_HEARTBEAT_SECONDS = 120
+# Intervallo di aggiornamento dell'heartbeat durante l'esecuzione di una fetta
+HEARTBEAT_INTERVAL_SECONDS = 30
+
+JOB_STATUS_LABELS = {
+    "pending": "in attesa",
+    "running": "in corso",
+    "interrupted": "interrotto",
+    "completed": "completato",
+    "failed": "con errori"
+}
+
+
+class JobRunningError(RuntimeError):
+    """Il job è già in esecuzione in un altro thread o processo"""
+
+
+def job_params(hotels, first_arrival, days, num_nights, adults=2, children_ages=None, rooms=1, currency="EUR"):
+    """Parametri normalizzati di un job (serializzabili nel manifest)"""
+    return {
+        "hotels": sorted(h for h in hotels if h in hotel_keys),
+        "first_arrival": first_arrival,
+        "days": int(days),
+        "num_nights": int(num_nights),
+        "adults": int(adults),
+        "children_ages": [int(a) for a in (children_ages or [])],
+        "rooms": int(rooms),
+        "currency": currency
+    }
+
+
+def job_id(params, created=None):
+    """Stessi parametri nello stesso giorno → stesso job (che viene ripreso)"""
+    digest = hashlib.sha1(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()[:10]
+    return f"{(created or datetime.now()).strftime('%Y%m%d')}-{digest}"
+
+
+class ShopJob:
+    def __init__(self, path):
+        self.path = path
+        self.manifest_path = os.path.join(path, "manifest.json")
+        self.heartbeat_path = os.path.join(path, "heartbeat")
+        self.lock_path = os.path.join(path, "run.lock")
+        self._load()
+
+    def _load(self):
+        with open(self.manifest_path, encoding="utf-8") as f:
+            self.manifest = json.load(f)
+
+    @classmethod
+    def create(cls, params, jobs_dir=None):
+        """Crea il job, oppure riapre quello esistente con gli stessi parametri"""
+        path = os.path.join(jobs_dir or DEFAULT_JOBS_DIR, job_id(params))
+        if os.path.exists(os.path.join(path, "manifest.json")):
+            return cls(path)
+
+        os.makedirs(path, exist_ok=True)
+        first = datetime.strptime(params["first_arrival"], "%Y-%m-%d")
+        now = time.time()
+        manifest = {
+            "job_id": os.path.basename(path),
+            "params": params,
+            "created_at": now,
+            "updated_at": now,
+            "status": "pending",
+            "slices": [
+                {
+                    "check_in": (first + timedelta(days=d)).strftime("%Y-%m-%d"),
+                    "status": "pending",
+                    "failed_hotels": [],
+                    "calls": 0,
+                    "duration": 0.0,
+                    "done_at": None
+                }
+                for d in range(params["days"])
+            ]
+        }
+        _write_manifest(os.path.join(path, "manifest.json"), manifest)
+        return cls(path)
+
+    @property
+    def job_id(self):
+        return self.manifest["job_id"]
+
+    def heartbeat(self):
+        """Ultimo segno di vita del runner (salvataggio del manifest o heartbeat durante una fetta)"""
+        try:
+            beat = os.path.getmtime(self.heartbeat_path)
+        except OSError:
+            beat = 0
+        return max(self.manifest["updated_at"], beat)
+
+    def status(self):
+        status = self.manifest["status"]
+        if status == "running" and time.time() - self.heartbeat() > STALE_HEARTBEAT_SECONDS:
+            return "interrupted"
+        return status
+
+    def is_active(self):
+        return self.status() == "running"
+
+    def _save(self):
+        self.manifest["updated_at"] = time.time()
+        _write_manifest(self.manifest_path, self.manifest)
+
+    def _acquire_lock(self):
+        """Transazione esclusiva su run.lock per tutta l'esecuzione (JobRunningError se già presa)"""
+        lock = sqlite3.connect(self.lock_path, timeout=0, isolation_level=None, check_same_thread=False)
+        try:
+            lock.execute("BEGIN EXCLUSIVE")
+        except sqlite3.OperationalError:
+            lock.close()
+            raise JobRunningError(f"Il job {self.job_id} è già in esecuzione")
+        return lock
+
+    def _beat(self, stop_event):
+        while not stop_event.wait(HEARTBEAT_INTERVAL_SECONDS):
+            with open(self.heartbeat_path, "a"):
+                pass
+            os.utime(self.heartbeat_path)
+
+    def pending_work(self):
+        """(indice fetta, hotel da ricercare) per le fette non completate"""
+        hotels = self.manifest["params"]["hotels"]
+        work = []
+        for i, piece in enumerate(self.manifest["slices"]):
+            if piece["status"] == "pending":
+                work.append((i, hotels))
+            elif piece["status"] == "partial":
+                work.append((i, piece["failed_hotels"]))
+        return work
+
+    def progress(self):
+        """Avanzamento in chiamate get_rates e tempo stimato al termine (secondi, None se ignoto)"""
+        hotels = len(self.manifest["params"]["hotels"])
+        total = hotels * len(self.manifest["slices"])
+        remaining = sum(len(h) for _, h in self.pending_work())
+        finished = [s for s in self.manifest["slices"] if s["calls"]]
+        calls = sum(s["calls"] for s in finished)
+        seconds_per_call = sum(s["duration"] for s in finished) / calls if calls else None
+        return {
+            "done": total - remaining,
+            "total": total,
+            "slices_done": sum(s["status"] == "done" for s in self.manifest["slices"]),
+            "slices": len(self.manifest["slices"]),
+            "eta_seconds": remaining * seconds_per_call if seconds_per_call is not None else None,
+            "status": self.status()
+        }
+
+    def run(self, xotelo_api, db_path=None, max_workers=DEFAULT_MAX_WORKERS, progress=None, cancel_event=None):
+        """Esegue le fette mancanti, salvando ciascuna appena completata.
+
+        `progress(job)` viene invocata dopo ogni fetta. Restituisce lo stato
+        finale ("completed", "failed" se restano chiamate fallite, "interrupted"
+        se annullato con `cancel_event`). Solleva JobRunningError se un altro
+        runner sta già eseguendo il job.
+        """
+        lock = self._acquire_lock()
+        stop_event = threading.Event()
+        try:
+            # Il manifest letto in precedenza può essere superato da un runner appena terminato
+            self._load()
+            self.manifest["status"] = "running"
+            self._save()
+            threading.Thread(target=self._beat, args=(stop_event,), name=f"heartbeat-{self.job_id}", daemon=True).start()
+            return self._run(xotelo_api, db_path, max_workers, progress, cancel_event)
+        finally:
+            stop_event.set()
+            lock.execute("ROLLBACK")
+            lock.close()
+
+    def _run(self, xotelo_api, db_path, max_workers, progress, cancel_event):
+        params = self.manifest["params"]
+        conn = rate_store.connect(db_path)
+        try:
+            for i, hotels in self.pending_work():
+                if cancel_event is not None and cancel_event.is_set():
+                    self.manifest["status"] = "interrupted"
+                    self._save()
+                    return "interrupted"
+
+                piece = self.manifest["slices"][i]
+                started = time.perf_counter()
+                rates_df, groups_df = shop_rates_batch(
+                    xotelo_api,
+                    hotels,
+                    [datetime.strptime(piece["check_in"], "%Y-%m-%d")],
+                    params["num_nights"],
+                    adults=params["adults"],
+                    children_ages=params["children_ages"] or None,
+                    rooms=params["rooms"],
+                    currency=params["currency"],
+                    max_workers=max_workers
+                )
+                # Checkpoint: la fetta è nell'archivio prima di essere segnata nel manifest
+                alerts.process_shop(conn, rates_df, groups_df)
+
+                ok_hotels = set(groups_df["hotel"])
+                piece["failed_hotels"] = [h for h in hotels if h not in ok_hotels]
+                piece["status"] = "partial" if piece["failed_hotels"] else "done"
+                piece["calls"] += len(hotels)
+                piece["duration"] += time.perf_counter() - started
+                piece["done_at"] = time.time()
+                self._save()
+                if progress:
+                    progress(self)
+        except Exception:
+            self.manifest["status"] = "interrupted"
+            self._save()
+            raise
+        finally:
+            conn.close()
+
+        self.manifest["status"] = "failed" if self.pending_work() else "completed"
+        self._save()
+        return self.manifest["status"]
+
+
+def _write_manifest(path, manifest):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def list_jobs(jobs_dir=None):
+    """Job presenti su disco, dal più recente"""
+    jobs = []
+    for manifest_path in glob.glob(os.path.join(jobs_dir or DEFAULT_JOBS_DIR, "*", "manifest.json")):
+        try:
+            jobs.append(ShopJob(os.path.dirname(manifest_path)))
+        except (OSError, ValueError):
+            continue
+    return sorted(jobs, key=lambda job: job.manifest["created_at"], reverse=True)
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return "n.d."
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h {minutes:02d}m" if hours else f"{minutes}m {seconds:02d}s"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Shop tariffe a fette con ripresa dopo un'interruzione")
+    parser.add_argument("--check-in", default=datetime.now().strftime("%Y-%m-%d"),
+                        help="Primo giorno di arrivo (YYYY-MM-DD)")
+    parser.add_argument("--days", type=int, default=30, help="Numero di date di arrivo consecutive")
+    parser.add_argument("--nights", type=int, default=7, help="Durata del soggiorno")
+    parser.add_argument("--adults", type=int, default=2)
+    parser.add_argument("--children-ages", default="", help="Età dei bambini separate da virgola")
+    parser.add_argument("--rooms", type=int, default=1)
+    parser.add_argument("--currency", default="EUR")
+    parser.add_argument("--hotels", nargs="*", default=list(hotel_keys.keys()))
+    parser.add_argument("--resume", help="Riprende il job indicato (id) invece di crearne uno")
+    parser.add_argument("--status", action="store_true", help="Mostra lo stato dei job e termina")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_MAX_WORKERS, help="Chiamate API contemporanee")
+    parser.add_argument("--db", default=rate_store.DEFAULT_DB_PATH, help="Percorso del database SQLite")
+    parser.add_argument("--jobs-dir", default=DEFAULT_JOBS_DIR)
+    return parser.parse_args(argv)
+
+
+def _print_progress(job):
+    p = job.progress()
+    print(
+        f"[{job.job_id}] {p['done']}/{p['total']} chiamate, {p['slices_done']}/{p['slices']} date "
+        f"- ETA {format_eta(p['eta_seconds'])}",
+        flush=True
+    )
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.status:
+        for job in list_jobs(args.jobs_dir):
+            p = job.progress()
+            print(
+                f"{job.job_id}: {JOB_STATUS_LABELS.get(p['status'], p['status'])}, "
+                f"{p['done']}/{p['total']} chiamate, ETA {format_eta(p['eta_seconds'])}"
+            )
+        return 0
+
+    if args.resume:
+        job = ShopJob(os.path.join(args.jobs_dir, args.resume))
+    else:
+        children_ages = [int(a) for a in args.children_ages.split(",") if a.strip()]
+        params = job_params(
+            args.hotels, args.check_in, args.days, args.nights, args.adults, children_ages, args.rooms, args.currency
+        )
+        job = ShopJob.create(params, args.jobs_dir)
+
+    if job.is_active():
+        print(f"Il job {job.job_id} è già in esecuzione")
+        return 1
+
+    _print_progress(job)
+    try:
+        status = job.run(XoteloAPI(), args.db, args.concurrency, progress=_print_progress)
+    except JobRunningError as e:
+        print(str(e))
+        return 1
+    print(f"Job {job.job_id}: {JOB_STATUS_LABELS.get(status, status)}")
+    return 0 if status == "completed" else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,65 @@
+"""Coalescenza delle richieste identiche in corso (single-flight).
+
+Quando più thread chiedono contemporaneamente la stessa risorsa (stesso
+endpoint e stessi parametri) viene eseguita una sola chiamata: il primo
+richiedente la esegue, gli altri attendono e ricevono lo stesso risultato.
+Nessun risultato viene conservato dopo il completamento della chiamata. I
+valori restituiti sono condivisi tra i richiedenti e vanno trattati in sola
+lettura.
+"""
+import threading
+
+
+def request_key(endpoint, params):
+    """Chiave hashable di una richiesta (endpoint, parametri)"""
+    return (endpoint, tuple(sorted(params.items())))
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight = {}
+        # requests: richieste ricevute, upstream: chiamate eseguite, saved: chiamate risparmiate
+        self.stats = {"requests": 0, "upstream": 0, "saved": 0}
+
+    def in_flight(self, key):
+        """True se una chiamata con questa chiave è in corso"""
+        with self._lock:
+            return key in self._inflight
+
+    def do(self, key, fn):
+        """Esegue `fn()` una sola volta per tutte le richieste contemporanee con la stessa chiave"""
+        with self._lock:
+            self.stats["requests"] += 1
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._inflight[key] = call
+                self.stats["upstream"] += 1
+            else:
+                self.stats["saved"] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = fn()
+            return call.value
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            call.done.set()
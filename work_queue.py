@@ -0,0 +1,451 @@
+"""Coda di lavoro locale (SQLite) per distribuire gli shop su più worker.
+
+Le richieste di shop vengono scomposte in task (hotel, soggiorno,
+occupazione, valuta), uno per chiamata get_rates, e accodate nella tabella
+`queue_tasks`. Ogni worker prende in lease un blocco di task con una
+scadenza: se il worker muore, alla scadenza i task tornano disponibili per
+gli altri (fino a `max_attempts` tentativi). I risultati vengono scritti
+nell'archivio tariffe condiviso, con gli avvisi, come nello shop headless.
+
+Il limite di chiamate a Xotelo è globale: un token bucket nella stessa coda
+(tabella `queue_rate_limit`) viene consumato da tutti i worker, quindi
+aggiungendo worker la velocità cresce fino al limite e poi si stabilizza.
+
+I worker possono girare su più host che condividono la cartella della coda:
+in quel caso la coda e l'archivio tariffe dei worker usano il journal
+classico di SQLite (il WAL richiede memoria condivisa sullo stesso host).
+Anche la dashboard deve allora aprire l'archivio senza WAL
+(RATESHOPPER_JOURNAL_MODE=DELETE): se l'archivio è in WAL i worker lo
+segnalano e restano limitati a questo host. Durante un blocco il worker
+rinnova il lease dei suoi task, così un blocco lento non viene ripreso da
+un altro worker.
+
+Esempio:
+    python work_queue.py enqueue --check-in 2026-08-01 --days 90 --nights 7
+    python work_queue.py work --workers 4 --rate 5
+    python work_queue.py status
+"""
+import argparse
+import multiprocessing
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+import alerts
+import rate_store
+from core import XoteloAPI, hotel_keys, normalize_dataframe, process_xotelo_response
+from rounding import apply_corrections
+
+DEFAULT_QUEUE_PATH = os.environ.get(
+    "RATESHOPPER_QUEUE_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "work_queue.sqlite")
+)
+
+DEFAULT_LEASE_SECONDS = 120
+DEFAULT_BATCH_SIZE = 20
+DEFAULT_MAX_ATTEMPTS = 3
+# Limite globale di chiamate Xotelo al secondo (tutti i worker insieme) e raffica massima
+DEFAULT_RATE_PER_SECOND = 4.0
+DEFAULT_BURST = 8
+
+TASK_KEY = ["hotel", "check_in", "check_out", "adults", "children_ages", "rooms", "currency"]
+
+QUEUE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS queue_tasks (
+    task_id INTEGER PRIMARY KEY,
+    hotel TEXT NOT NULL,
+    check_in TEXT NOT NULL,
+    check_out TEXT NOT NULL,
+    adults INTEGER NOT NULL,
+    children_ages TEXT NOT NULL,
+    rooms INTEGER NOT NULL,
+    currency TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    enqueued_at REAL NOT NULL,
+    finished_at REAL,
+    error TEXT,
+    UNIQUE (hotel, check_in, check_out, adults, children_ages, rooms, currency)
+);
+CREATE INDEX IF NOT EXISTS idx_queue_tasks_status ON queue_tasks (status, lease_expires);
+
+CREATE TABLE IF NOT EXISTS queue_rate_limit (
+    name TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+def connect(queue_path=None):
+    """Apre (e inizializza se necessario) la coda"""
+    queue_path = queue_path or DEFAULT_QUEUE_PATH
+    directory = os.path.dirname(queue_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    # isolation_level=None: le transazioni sono aperte esplicitamente con BEGIN IMMEDIATE
+    conn = sqlite3.connect(queue_path, timeout=60, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=DELETE")
+    conn.executescript(QUEUE_SCHEMA)
+    return conn
+
+
+@contextmanager
+def _immediate(conn):
+    # Transazione con lock di scrittura preso subito: lease e token non si sovrappongono tra worker
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def sweep_tasks(hotels, arrivals, nights_values, adults=2, children_ages=None, rooms=1, currency="EUR"):
+    """Task per ogni combinazione hotel × data di arrivo × durata"""
+    ages = ",".join(str(int(a)) for a in (children_ages or []))
+    rows = [
+        (hotel, arrival.strftime("%Y-%m-%d"), (arrival + timedelta(days=int(n))).strftime("%Y-%m-%d"),
+         int(adults), ages, int(rooms), currency)
+        for arrival in arrivals
+        for n in nights_values
+        for hotel in hotels
+        if hotel in hotel_keys
+    ]
+    return pd.DataFrame(rows, columns=TASK_KEY)
+
+
+def enqueue(conn, tasks_df, now=None):
+    """Accoda i task; un task già presente torna in coda se completato o fallito"""
+    now = now or time.time()
+    rows = [row + (now,) for row in rate_store._to_rows(tasks_df[TASK_KEY])]
+    with _immediate(conn):
+        conn.executemany(
+            f"INSERT INTO queue_tasks ({', '.join(TASK_KEY)}, enqueued_at) VALUES ({', '.join('?' * (len(TASK_KEY) + 1))}) "
+            f"ON CONFLICT ({', '.join(TASK_KEY)}) DO UPDATE SET status = 'queued', attempts = 0, error = NULL, "
+            "enqueued_at = excluded.enqueued_at WHERE status IN ('done', 'failed')",
+            rows
+        )
+    return len(rows)
+
+
+def lease(conn, worker_id, batch_size=DEFAULT_BATCH_SIZE, lease_seconds=DEFAULT_LEASE_SECONDS,
+          max_attempts=DEFAULT_MAX_ATTEMPTS, now=None):
+    """Prende in lease fino a `batch_size` task in coda o con lease scaduto"""
+    now = now or time.time()
+    with _immediate(conn):
+        # Lease scaduti oltre i tentativi massimi: il task è fallito
+        conn.execute(
+            "UPDATE queue_tasks SET status = 'failed', error = 'lease scaduto', finished_at = ? "
+            "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+            (now, now, max_attempts)
+        )
+        tasks = pd.read_sql_query(
+            f"SELECT task_id, {', '.join(TASK_KEY)}, attempts FROM queue_tasks "
+            "WHERE status = 'queued' OR (status = 'leased' AND lease_expires < ?) "
+            "ORDER BY check_in, task_id LIMIT ?",
+            conn,
+            params=[now, int(batch_size)]
+        )
+        conn.executemany(
+            "UPDATE queue_tasks SET status = 'leased', lease_owner = ?, lease_expires = ?, attempts = attempts + 1 "
+            "WHERE task_id = ?",
+            [(worker_id, now + lease_seconds, int(task_id)) for task_id in tasks["task_id"]]
+        )
+    return tasks
+
+
+def complete(conn, worker_id, task_ids, now=None):
+    """Segna i task come completati (solo se il lease è ancora del worker)"""
+    now = now or time.time()
+    with _immediate(conn):
+        conn.executemany(
+            "UPDATE queue_tasks SET status = 'done', finished_at = ?, lease_owner = NULL, lease_expires = NULL "
+            "WHERE task_id = ? AND lease_owner = ? AND status = 'leased'",
+            [(now, int(task_id), worker_id) for task_id in task_ids]
+        )
+
+
+def renew(conn, worker_id, task_ids, lease_seconds=DEFAULT_LEASE_SECONDS, now=None):
+    """Prolunga il lease dei task ancora del worker"""
+    now = now or time.time()
+    with _immediate(conn):
+        conn.executemany(
+            "UPDATE queue_tasks SET lease_expires = ? WHERE task_id = ? AND lease_owner = ? AND status = 'leased'",
+            [(now + lease_seconds, int(task_id), worker_id) for task_id in task_ids]
+        )
+
+
+def _renew_leases(queue_path, worker_id, task_ids, lease_seconds, stop_event):
+    # Connessione propria: il thread principale usa la sua per lease e token
+    conn = connect(queue_path)
+    try:
+        while not stop_event.wait(lease_seconds / 3):
+            try:
+                renew(conn, worker_id, task_ids, lease_seconds)
+            except sqlite3.OperationalError:
+                # Coda occupata: si riprova al prossimo intervallo, prima della scadenza
+                continue
+    finally:
+        conn.close()
+
+
+def _connect_rates(db_path):
+    """Archivio tariffe del worker con il journal classico (condivisibile tra host)"""
+    conn = rate_store.connect(db_path, journal_mode="DELETE")
+    mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+    if mode.lower() == "wal":
+        # Archivio aperto in WAL da altri processi: il cambio non è stato possibile
+        warnings.warn(
+            "L'archivio tariffe è in modalità WAL: i worker devono girare sullo stesso host "
+            "(impostare RATESHOPPER_JOURNAL_MODE=DELETE per tutti i processi)"
+        )
+    return conn
+
+
+def release(conn, worker_id, task_ids, error, max_attempts=DEFAULT_MAX_ATTEMPTS, now=None):
+    """Rimette in coda i task falliti, o li segna falliti oltre i tentativi massimi"""
+    now = now or time.time()
+    with _immediate(conn):
+        conn.executemany(
+            "UPDATE queue_tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END, "
+            "finished_at = CASE WHEN attempts >= ? THEN ? ELSE NULL END, error = ?, lease_owner = NULL, lease_expires = NULL "
+            "WHERE task_id = ? AND lease_owner = ? AND status = 'leased'",
+            [(max_attempts, max_attempts, now, error, int(task_id), worker_id) for task_id in task_ids]
+        )
+
+
+def acquire_tokens(conn, wanted, rate_per_second=DEFAULT_RATE_PER_SECOND, burst=DEFAULT_BURST, name="xotelo"):
+    """Consuma fino a `wanted` token del limite globale.
+
+    Restituisce (token ottenuti, secondi da attendere prima di riprovare se
+    non sono stati ottenuti tutti). Chiedere più token insieme riduce le
+    transazioni sulla coda condivisa.
+    """
+    now = time.time()
+    with _immediate(conn):
+        row = conn.execute("SELECT tokens, updated_at FROM queue_rate_limit WHERE name = ?", (name,)).fetchone()
+        tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate_per_second)
+        granted = min(int(wanted), int(tokens))
+        tokens -= granted
+        wait = 0.0 if granted == wanted else max(1 - tokens, 0) / rate_per_second
+        conn.execute(
+            "INSERT OR REPLACE INTO queue_rate_limit (name, tokens, updated_at) VALUES (?, ?, ?)",
+            (name, tokens, now)
+        )
+    return granted, wait
+
+
+def queue_stats(conn, window_seconds=300):
+    """Task per stato e task completati al minuto nell'ultima finestra"""
+    counts = dict(conn.execute("SELECT status, COUNT(*) FROM queue_tasks GROUP BY status").fetchall())
+    recent = conn.execute(
+        "SELECT COUNT(*) FROM queue_tasks WHERE status = 'done' AND finished_at >= ?",
+        (time.time() - window_seconds,)
+    ).fetchone()[0]
+    stats = {status: counts.get(status, 0) for status in ["queued", "leased", "done", "failed"]}
+    stats["per_minute"] = recent * 60 / window_seconds
+    return stats
+
+
+def _fetch(xotelo_api, task):
+    hotel, check_in, check_out, adults, ages, rooms, currency = (task[c] for c in TASK_KEY)
+    return xotelo_api.get_rates(
+        hotel_keys[hotel], check_in, check_out,
+        adults=int(adults),
+        children_ages=[int(a) for a in ages.split(",")] if ages else None,
+        rooms=int(rooms),
+        currency=currency
+    )
+
+
+def process_batch(xotelo_api, queue_conn, rate_conn, tasks, rate_per_second=DEFAULT_RATE_PER_SECOND,
+                  burst=DEFAULT_BURST, max_workers=4):
+    """Esegue un blocco di task rispettando il limite globale e archivia le tariffe.
+
+    Restituisce (id completati, id falliti).
+    """
+    records = tasks.to_dict("records")
+    futures = []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while len(futures) < len(records):
+            granted, wait = acquire_tokens(queue_conn, len(records) - len(futures), rate_per_second, burst)
+            for task in records[len(futures):len(futures) + granted]:
+                futures.append(pool.submit(_fetch, xotelo_api, task))
+            if wait > 0:
+                time.sleep(wait)
+    responses = [future.result() for future in futures]
+
+    frames, groups, done, failed = [], [], [], []
+    for task, response in zip(records, responses):
+        ok = response.get("error") is None and response.get("result") is not None
+        (done if ok else failed).append(task["task_id"])
+        if not ok:
+            continue
+        children = len(task["children_ages"].split(",")) if task["children_ages"] else 0
+        nights = (datetime.strptime(task["check_out"], "%Y-%m-%d") - datetime.strptime(task["check_in"], "%Y-%m-%d")).days
+        frames.append(process_xotelo_response(
+            response, task["hotel"], nights, task["adults"], children, task["rooms"], task["currency"]
+        ).assign(_nights=nights))
+        groups.append({
+            "hotel": task["hotel"], "check_in": task["check_in"], "check_out": task["check_out"],
+            "adults": task["adults"], "children": children, "rooms": task["rooms"], "currency": task["currency"]
+        })
+
+    if frames:
+        rates = pd.concat(frames, ignore_index=True)
+        # Correzione arrotondamenti in blocco, con il numero di notti di ogni task
+        rates = apply_corrections(rates, rates["_nights"].to_numpy()).drop(columns="_nights")
+        alerts.process_shop(rate_conn, normalize_dataframe(rates, 1), pd.DataFrame(groups, columns=rate_store.GROUP_KEY))
+    return done, failed
+
+
+def run_worker(worker_id=None, queue_path=None, db_path=None, batch_size=DEFAULT_BATCH_SIZE,
+               lease_seconds=DEFAULT_LEASE_SECONDS, rate_per_second=DEFAULT_RATE_PER_SECOND,
+               burst=DEFAULT_BURST, max_workers=4, max_attempts=DEFAULT_MAX_ATTEMPTS,
+               idle_exit_seconds=10, xotelo_api=None):
+    """Ciclo del worker: lease, shop, archiviazione; termina dopo `idle_exit_seconds` senza task"""
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    xotelo_api = xotelo_api or XoteloAPI()
+    queue_conn = connect(queue_path)
+    rate_conn = _connect_rates(db_path)
+    processed = 0
+    idle_since = None
+    try:
+        while True:
+            tasks = lease(queue_conn, worker_id, batch_size, lease_seconds, max_attempts)
+            if tasks.empty:
+                idle_since = idle_since or time.time()
+                if time.time() - idle_since >= idle_exit_seconds:
+                    return processed
+                time.sleep(min(1.0, idle_exit_seconds))
+                continue
+            idle_since = None
+
+            stop_renewal = threading.Event()
+            renewal = threading.Thread(
+                target=_renew_leases,
+                args=(queue_path, worker_id, tasks["task_id"].tolist(), lease_seconds, stop_renewal),
+                daemon=True
+            )
+            renewal.start()
+            try:
+                done, failed = process_batch(xotelo_api, queue_conn, rate_conn, tasks, rate_per_second, burst, max_workers)
+            except Exception as e:
+                release(queue_conn, worker_id, tasks["task_id"], str(e), max_attempts)
+                continue
+            finally:
+                stop_renewal.set()
+                renewal.join()
+            complete(queue_conn, worker_id, done)
+            if failed:
+                release(queue_conn, worker_id, failed, "risposta Xotelo in errore", max_attempts)
+            processed += len(done)
+    finally:
+        queue_conn.close()
+        rate_conn.close()
+
+
+def _worker_process(kwargs):
+    return run_worker(**kwargs)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Coda di lavoro per shop distribuiti su più worker")
+    parser.add_argument("--queue", default=DEFAULT_QUEUE_PATH, help="Percorso del database della coda")
+    parser.add_argument("--db", default=rate_store.DEFAULT_DB_PATH, help="Percorso del database delle tariffe")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    enqueue_parser = commands.add_parser("enqueue", help="Accoda uno sweep hotel × date × durate")
+    enqueue_parser.add_argument("--check-in", default=datetime.now().strftime("%Y-%m-%d"),
+                                help="Primo giorno di arrivo (YYYY-MM-DD)")
+    enqueue_parser.add_argument("--days", type=int, default=1, help="Numero di date di arrivo consecutive")
+    enqueue_parser.add_argument("--nights", type=int, nargs="+", default=[7], help="Durate del soggiorno")
+    enqueue_parser.add_argument("--adults", type=int, default=2)
+    enqueue_parser.add_argument("--children-ages", default="", help="Età dei bambini separate da virgola")
+    enqueue_parser.add_argument("--rooms", type=int, default=1)
+    enqueue_parser.add_argument("--currency", default="EUR")
+    enqueue_parser.add_argument("--hotels", nargs="*", default=list(hotel_keys.keys()))
+
+    work_parser = commands.add_parser("work", help="Avvia i worker su questo host")
+    work_parser.add_argument("--workers", type=int, default=1, help="Processi worker")
+    work_parser.add_argument("--threads", type=int, default=4, help="Chiamate contemporanee per worker")
+    work_parser.add_argument("--batch", type=int, default=DEFAULT_BATCH_SIZE, help="Task per lease")
+    work_parser.add_argument("--lease", type=float, default=DEFAULT_LEASE_SECONDS, help="Durata del lease (secondi)")
+    work_parser.add_argument("--rate", type=float, default=DEFAULT_RATE_PER_SECOND,
+                             help="Chiamate Xotelo al secondo per tutti i worker insieme")
+    work_parser.add_argument("--burst", type=int, default=DEFAULT_BURST)
+    work_parser.add_argument("--idle-exit", type=float, default=10, help="Secondi senza task prima di terminare")
+
+    commands.add_parser("status", help="Stato della coda")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.command == "enqueue":
+        first_arrival = datetime.strptime(args.check_in, "%Y-%m-%d")
+        tasks = sweep_tasks(
+            args.hotels,
+            [first_arrival + timedelta(days=d) for d in range(max(args.days, 1))],
+            args.nights,
+            args.adults,
+            [int(a) for a in args.children_ages.split(",") if a.strip()],
+            args.rooms,
+            args.currency
+        )
+        conn = connect(args.queue)
+        try:
+            print(f"Task accodati: {enqueue(conn, tasks)}")
+        finally:
+            conn.close()
+        return 0
+
+    if args.command == "work":
+        kwargs = {
+            "queue_path": args.queue,
+            "db_path": args.db,
+            "batch_size": args.batch,
+            "lease_seconds": args.lease,
+            "rate_per_second": args.rate,
+            "burst": args.burst,
+            "max_workers": args.threads,
+            "idle_exit_seconds": args.idle_exit
+        }
+        started = time.perf_counter()
+        if args.workers <= 1:
+            processed = [run_worker(**kwargs)]
+        else:
+            with multiprocessing.Pool(args.workers) as pool:
+                processed = pool.map(_worker_process, [kwargs] * args.workers)
+        elapsed = time.perf_counter() - started
+        print(f"Task completati: {sum(processed)} in {elapsed:.1f}s ({sum(processed) / max(elapsed, 1e-9):.1f}/s)")
+
+    conn = connect(args.queue)
+    try:
+        stats = queue_stats(conn)
+    finally:
+        conn.close()
+    print(
+        f"Coda: {stats['queued']} in attesa, {stats['leased']} in lavorazione, {stats['done']} completati, "
+        f"{stats['failed']} falliti ({stats['per_minute']:.1f} task/min negli ultimi 5 minuti)"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+"""Client Xotelo asincrono (httpx) e facciata sincrona.
+
+`AsyncXoteloAPI` espone gli stessi metodi di `core.XoteloAPI` come coroutine,
+con un pool di connessioni condiviso e un semaforo che limita le richieste
+contemporanee. In caso di errore restituisce lo stesso dizionario
+{"error": ..., "timestamp": 0, "result": None} del client sincrono. Come
+`XoteloAPI`, regola le chiamate contemporanee con la finestra adattiva e i
+circuit breaker di `AdaptiveGate` (il semaforo ne è il massimo).
+
+`SyncXoteloAPI` esegue il client asincrono su un event loop dedicato in un
+thread di background, così il codice esistente (UI, thread pool) può usarlo
+al posto di `XoteloAPI` senza modifiche.
+"""
+import asyncio
+import threading
+
+try:
+    import httpx
+except ImportError:  # dipendenza opzionale
+    httpx = None
+
+from adaptive_concurrency import DEFAULT_MAX_LIMIT, AdaptiveGate, AIMDLimiter
+from core import REQUEST_TIMEOUT_SECONDS, XOTELO_BASE_URL, heatmap_params, hotel_list_params, rates_params
+from singleflight import SingleFlight, request_key
+
+DEFAULT_MAX_CONCURRENCY = DEFAULT_MAX_LIMIT
+DEFAULT_TIMEOUT_SECONDS = REQUEST_TIMEOUT_SECONDS
+
+
+class AsyncXoteloAPI:
+    def __init__(self, max_concurrency=DEFAULT_MAX_CONCURRENCY, timeout=DEFAULT_TIMEOUT_SECONDS, client=None,
+                 gate=None):
+        if httpx is None and client is None:
+            raise ImportError("AsyncXoteloAPI richiede il pacchetto httpx (pip install httpx)")
+
+        self.base_url = XOTELO_BASE_URL
+        self.max_concurrency = max_concurrency
+        self.gate = gate or AdaptiveGate(AIMDLimiter(max_limit=max_concurrency))
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._owns_client = client is None
+        self._client = client or httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency)
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        if self._owns_client:
+            await self._client.aclose()
+
+    async def _request(self, endpoint, params):
+        """Risposta HTTP grezza, nella finestra del gate (le eccezioni di rete vengono propagate)"""
+        async def fetch():
+            async with self._semaphore:
+                return await self._client.get(f"{self.base_url}/{endpoint}", params=params)
+
+        return await self.gate.call_async(endpoint, fetch)
+
+    async def _get(self, endpoint, params):
+        try:
+            return (await self._request(endpoint, params)).json()
+        except Exception as e:
+            return {"error": str(e), "timestamp": 0, "result": None}
+
+    async def get_rates(self, hotel_key, check_in, check_out, adults=2, children_ages=None, rooms=1, currency="EUR"):
+        return await self._get("rates", rates_params(hotel_key, check_in, check_out, adults, children_ages, rooms, currency))
+
+    async def get_heatmap(self, hotel_key, check_out):
+        return await self._get("heatmap", heatmap_params(hotel_key, check_out))
+
+    async def get_hotel_list(self, location_key, limit=30, offset=0, sort="best_value"):
+        return await self._get("list", hotel_list_params(location_key, limit, offset, sort))
+
+
+class SyncXoteloAPI:
+    """Facciata sincrona e thread-safe sopra `AsyncXoteloAPI`"""
+
+    def __init__(self, max_concurrency=DEFAULT_MAX_CONCURRENCY, timeout=DEFAULT_TIMEOUT_SECONDS):
+        # Verifica prima di avviare il thread del loop: senza httpx il chiamante ripiega su XoteloAPI
+        if httpx is None:
+            raise ImportError("SyncXoteloAPI richiede il pacchetto httpx (pip install httpx)")
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="xotelo-async", daemon=True)
+        self._thread.start()
+        self._api = self._call(self._create_api(max_concurrency, timeout))
+        # Come in XoteloAPI: le richieste identiche in corso diventano una sola chiamata,
+        # eseguita nella finestra adattiva del client asincrono
+        self.single_flight = SingleFlight()
+        self.gate = self._api.gate
+
+    async def _create_api(self, max_concurrency, timeout):
+        # Il client va creato all'interno del loop che lo userà
+        return AsyncXoteloAPI(max_concurrency=max_concurrency, timeout=timeout)
+
+    def _call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def _get(self, endpoint, params):
+        return self.single_flight.do(request_key(endpoint, params), lambda: self._call(self._api._get(endpoint, params)))
+
+    def get_rates(self, hotel_key, check_in, check_out, adults=2, children_ages=None, rooms=1, currency="EUR"):
+        return self._get("rates", rates_params(hotel_key, check_in, check_out, adults, children_ages, rooms, currency))
+
+    def get_heatmap(self, hotel_key, check_out):
+        return self._get("heatmap", heatmap_params(hotel_key, check_out))
+
+    def get_hotel_list(self, location_key, limit=30, offset=0, sort="best_value"):
+        return self._get("list", hotel_list_params(location_key, limit, offset, sort))
+
+    def close(self):
+        self._call(self._api.aclose())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()